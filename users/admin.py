@@ -1,9 +1,102 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import FieldError, ValidationError
+from django.utils import timezone
 
-from .models import CustomUser
+from .changelist import EstimatedCountPaginator, KeysetChangeList, prefix_search
+from .models import Campaign, CustomUser, RetentionJob, UserProfile
+from .tasks import resume_campaign
+from . import campaigns, retention
 # Register your models here.
 
+class UserProfileInline(admin.StackedInline):
+    model = UserProfile
+    can_delete = False
+
+
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
-    list_display = ['email', 'first_name', 'last_name', 'username', 'phone', 'address1', 'address2', 'city', 'country', 'province', 'postal_code', 'marketing_consent1', 'marketing_consent2']
\ No newline at end of file
+    list_display = ['email', 'first_name', 'last_name', 'username', 'phone', 'address1', 'address2', 'city', 'country', 'province', 'postal_code', 'marketing_consent1', 'marketing_consent2']
+    list_select_related = ['profile'] # Колонки телефону / адреси - з UserProfile, одним LEFT JOIN замість запиту на рядок
+    inlines = [UserProfileInline]
+    # Таблиця на мільйони рядків: оцінка кількості, keyset сторінки, тільки колонки списку (users/changelist.py)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False # Інакше ще один COUNT(*) по всій таблиці на кожну сторінку
+    show_facets = admin.ShowFacets.NEVER # Фасети - COUNT на кожне значення кожного фільтра
+    sortable_by = () # Сортування тільки по id (keyset)
+    search_fields = ['email', 'username', 'first_name', 'last_name', 'profile__city']
+    search_help_text = 'Пошук за початком email, тегу, імені, прізвища або міста'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if any(formset.has_changed() for formset in formsets):
+            # Профіль збережено інлайном окремо від користувача - оновлюємо версію рядка для кешу фрагментів
+            form.instance.profile_updated_at = timezone.now()
+            form.instance.save(update_fields=['profile_updated_at'])
+
+    def get_search_results(self, request, queryset, search_term):
+        return prefix_search(queryset, self.search_fields, search_term), False
+
+
+@admin.register(Campaign)
+class CampaignAdmin(admin.ModelAdmin):
+    list_display = ['name', 'audience', 'status', 'rate_per_minute', 'scheduled_count', 'sent_count', 'created_at', 'finished_at']
+    readonly_fields = ['status', 'cursor', 'scheduled_count', 'sent_count', 'finished_at']
+    actions = ['start', 'pause', 'resume']
+
+    @admin.action(description='Запустити розсилку')
+    def start(self, request, queryset):
+        for campaign in queryset.filter(status=Campaign.STATUS_DRAFT):
+            campaigns.start(campaign.pk)
+
+    @admin.action(description='Поставити на паузу')
+    def pause(self, request, queryset):
+        for campaign in queryset:
+            campaigns.pause(campaign.pk)
+
+    @admin.action(description='Продовжити розсилку')
+    def resume(self, request, queryset):
+        for campaign in queryset.exclude(status=Campaign.STATUS_FINISHED):
+            resume_campaign.delay(campaign.pk)
+
+
+@admin.register(RetentionJob)
+class RetentionJobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'action', 'status', 'processed_count', 'chunk_size', 'created_at', 'finished_at']
+    readonly_fields = ['status', 'matched_users', 'cursor', 'processed_count', 'last_error', 'finished_at']
+    actions = ['start', 'pause', 'resume']
+
+    @admin.display(description='Підпадає під фільтри')
+    def matched_users(self, obj):
+        # Видно на сторінці job ще до запуску. Тільки тут, а не в списку: COUNT на кожен рядок списку дорогий
+        if obj.pk is None or obj.status != RetentionJob.STATUS_DRAFT:
+            return '-'
+        try:
+            return retention.audience(obj).count()
+        except (FieldError, TypeError, ValueError, ValidationError) as e:
+            return f'Невірні фільтри: {e}'
+
+    @admin.action(description='Запустити')
+    def start(self, request, queryset):
+        for job in queryset.filter(status=RetentionJob.STATUS_DRAFT):
+            try:
+                matched = retention.start(job.pk)
+            except ValidationError as e:
+                self.message_user(request, f'«{job}» не запущено: {" ".join(e.messages)}', messages.ERROR)
+                continue
+            if matched is not None:
+                self.message_user(request, f'«{job}» запущено: {job.get_action_display().lower()} {matched} користувачів',
+                                  messages.WARNING)
+
+    @admin.action(description='Поставити на паузу')
+    def pause(self, request, queryset):
+        for job in queryset:
+            retention.pause(job.pk)
+
+    @admin.action(description='Продовжити')
+    def resume(self, request, queryset):
+        for job in queryset.filter(status__in=[RetentionJob.STATUS_PAUSED, RetentionJob.STATUS_FAILED]):
+            retention.resume(job.pk)
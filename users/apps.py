@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class UsersConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from . import signals  # noqa: F401 Підключаємо обробники сигналів
+        from . import metrics  # noqa: F401 Сигнали celery і лічильник SQL запитів для метрик
@@ -0,0 +1,178 @@
+# Асинхронні (ASGI) версії представлень з views.py.
+# Під uvicorn кожне синхронне представлення ганяється через sync_to_async потік,
+# тут же запити до БД йдуть через async ORM (aget, asave), а цикл подій не блокується.
+# ATOMIC_REQUESTS з async представленнями не працює, тому всі вони non_atomic_requests
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth import alogin
+from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode
+import logging
+
+from .forms import CustomUserLoginForm, CustomUserUpdateForm, PasswordResetConfirmForm
+from .hashers import amake_password
+from .models import CustomUser
+from .outbox import aenqueue_email
+from .ratelimit import ratelimit
+from .search import asearch_users
+from . import export
+from .tasks import send_account_activation_email
+from .tokens import account_activation_token, password_reset_token
+
+# Представлення, яким async нічого не дає, беремо як є
+from .views import register, logout_view, password_reset_request
+
+
+async def _auser(request):
+    # request.user лінивий і вантажиться синхронно, а в async контексті це SynchronousOnlyOperation.
+    # Підвантажуємо користувача (і разом з ним сесію) заздалегідь і підміняємо на готовий об'єкт
+    request.user = await request.auser()
+    return request.user
+
+
+async def _aget_user_from_uid(uidb64):
+    try:
+        uid = force_str(urlsafe_base64_decode(uidb64)) # Розшифровуємо юід
+        return await CustomUser.objects.aget(pk=uid)
+    except (TypeError, ValueError, OverflowError, CustomUser.DoesNotExist):
+        return None
+
+
+@transaction.non_atomic_requests
+@ratelimit('login')
+async def login_view(request):
+    await _auser(request)
+    if request.method == 'POST':
+        form = CustomUserLoginForm(request=request, data=request.POST)
+        if await form.ais_valid(): # Пароль перевіряється в пулі процесів через aauthenticate()
+            await alogin(request, form.get_user(), backend='users.backends.PooledModelBackend')
+            return redirect('users:profile')
+    else:
+        form = CustomUserLoginForm()
+    return render(request, 'users/login.html', {'form': form})
+
+
+@transaction.non_atomic_requests
+@login_required
+async def profile_views(request):
+    user = await _auser(request)
+    await user.aget_profile() # Телефон і країна в шаблоні - з профілю
+    return render(request, 'users/profile.html', {'user': user})
+
+
+@transaction.non_atomic_requests
+@login_required
+async def account_details(request):
+    user = await _auser(request) # Свіжий з кешу
+    await user.aget_profile() # Адреса - окрема таблиця, один запит тільки на цій сторінці
+    return render(request, 'users/partials/account_details.html', {'user': user})
+
+
+@transaction.non_atomic_requests
+@login_required
+async def edit_account_details(request):
+    user = await _auser(request)
+    await user.aget_profile()
+    form = CustomUserUpdateForm(instance=user)
+    return render(request, 'users/partials/edit_account_details.html', {'user': user, 'form': form})
+
+
+@transaction.non_atomic_requests
+@login_required
+async def update_account_details(request):
+    user = await _auser(request)
+    await user.aget_profile()
+    if request.method == 'POST':
+        form = CustomUserUpdateForm(request.POST, instance=user)
+        if await sync_to_async(form.is_valid)(): # clean_email і validate_unique ходять в БД
+            user = form.save(commit=False)
+            user.clean()
+            await user.asave()
+            return render(request, 'users/partials/account_details.html', {'user': user})
+        return render(request, 'users/partials/edit_account_details.html', {'user': user, 'form': form})
+    return render(request, 'users/partials/account_details.html', {'user': user})
+
+
+@transaction.non_atomic_requests
+async def password_reset_confirm(request, uidb64, token):
+    await _auser(request)
+    user = await _aget_user_from_uid(uidb64)
+
+    if user is not None and password_reset_token.check_token(user, token):
+        if request.method == 'POST':
+            form = PasswordResetConfirmForm(request.POST)
+            if form.is_valid():
+                # PBKDF2 хешування забирає CPU, тому рахуємо його в пулі процесів, а не в циклі подій
+                user.password = await amake_password(form.cleaned_data['new_password1'])
+                await user.asave()
+                messages.success(request, 'Ваш пароль змінено успішно!')
+                return render(request, 'users/password_reset_complete.html')
+        else:
+            form = PasswordResetConfirmForm()
+        return render(request, 'users/password_reset_confirm.html', {'form': form, 'validlink': True})
+    return render(request, 'users/password_reset_confirm.html', {'validlink': False})
+
+
+@transaction.non_atomic_requests
+@login_required
+async def account_activation_request(request):
+    user = await _auser(request)
+    if request.method == 'POST':
+        if user.email_confirmed:
+            messages.info(request, "Email вже підтверджено.")
+            return redirect('users:profile')
+
+        logging.info(f'Attempting to send acctivation email to {user.email}, for user id {user.pk}')
+        await aenqueue_email(send_account_activation_email, user.email, user.pk, debounce_key=user.pk) # Один INSERT в outbox, повтор в межах вікна відкидається
+        messages.success(request, f'Лист активації акаунта надіслано на пошту {user.email}. Перевірте свою пошту та перейдіть за посиланням в листі')
+    return redirect('users:profile')
+
+
+@transaction.non_atomic_requests
+async def account_activation_confirm(request, uidb64, token):
+    await _auser(request)
+    user = await _aget_user_from_uid(uidb64)
+
+    if user is not None and account_activation_token.check_token(user, token):
+        if user.email_confirmed:
+            messages.info(request, "Email вже підтверджено.")
+            return redirect('users:profile')
+
+        user.email_confirmed = True
+        await user.asave(update_fields=["email_confirmed"])
+        messages.success(request, 'Акаунт успішно активований!')
+        return redirect('users:profile')
+    return render(request, 'users/password_reset_confirm.html', {'validlink': False})
+
+
+@transaction.non_atomic_requests
+@staff_member_required
+@permission_required('users.view_customuser', raise_exception=True) # Email, телефон і місто - не для кожного staff
+async def user_search(request):
+    try:
+        page = await asearch_users(request.GET.get('q'), request.GET.get('cursor'), request.GET.get('limit'))
+    except ValueError:
+        return JsonResponse({'error': 'Невірний курсор.'}, status=400)
+    return JsonResponse(page, json_dumps_params={'ensure_ascii': False})
+
+
+@transaction.non_atomic_requests
+@staff_member_required
+@permission_required('users.export_customuser', raise_exception=True)
+async def export_users(request):
+    # Async генератор: ASGI сервер читає рядки через aiterator(), без потоку на весь час вивантаження
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest('Невідомий формат.')
+    compress = request.GET.get('gzip') == '1'
+    user = await _auser(request)
+    logging.info(f'User export ({fmt}) by staff user id {user.pk}: {request.GET.urlencode()}')
+    response = StreamingHttpResponse(export.aiter_export(export.filter_users(request.GET), fmt, compress),
+                                     content_type=export.content_type(fmt, compress))
+    response['Content-Disposition'] = f'attachment; filename="{export.filename(fmt, compress)}"'
+    return response
@@ -0,0 +1,63 @@
+# Бекенд автентифікації: паролі перевіряє через пул процесів з hashers.py,
+# а користувача для request.user бере з кешу (user_cache.py)
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+from . import user_cache
+from .hashers import acheck_password, amake_password
+
+UserModel = get_user_model()
+
+
+class PooledModelBackend(ModelBackend):
+    # Синхронний authenticate() лишається від ModelBackend: user.check_password() і так
+    # йде через PooledPBKDF2PasswordHasher. Тут додаємо нативний async шлях без sync_to_async потоків.
+    # В AUTHENTICATION_BACKENDS після нього стоїть звичайний ModelBackend - тільки для сесій, створених до пулу.
+    # Щоб він не перевіряв той самий пароль вдруге (в потоці запиту), невдалий вхід тут одразу зупиняє перебір бекендів
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None and password is not None:
+            raise PermissionDenied
+        return user
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await UserModel._default_manager.aget_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Хешуємо пароль навіть для неіснуючого користувача, щоб по часу відповіді не можна було вгадати email
+            await amake_password(password)
+            raise PermissionDenied
+
+        is_correct, must_update = await acheck_password(password, user.password)
+        if not is_correct or not self.user_can_authenticate(user):
+            raise PermissionDenied
+        if must_update: # Хеш зі старою кількістю ітерацій - перехешовуємо
+            user.password = await amake_password(password)
+            await user.asave(update_fields=['password'])
+        return user
+
+    def get_user(self, user_id):
+        # Викликається AuthenticationMiddleware на кожен запит. Спершу кеш, БД тільки при промаху
+        user = user_cache.get_user(user_id)
+        if user is None:
+            try:
+                user = UserModel._default_manager.get(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            user_cache.set_user(user)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        user = await user_cache.aget_user(user_id)
+        if user is None:
+            try:
+                user = await UserModel._default_manager.aget(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            await user_cache.aset_user(user)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,48 @@
+# Спільні хелпери для бенчмарк команд (manage.py bench_*)
+import statistics
+
+
+def percentile(values, p):
+    # p від 0 до 100, значення без інтерполяції (nearest-rank)
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    # latencies - список секунд на одну операцію, elapsed - загальний час прогону
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': (statistics.fmean(latencies) * 1000) if latencies else 0.0,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def format_summary(name, summary):
+    return (f"{name:<40} n={summary['count']:<6} p50={summary['p50_ms']:8.2f}ms "
+            f"p95={summary['p95_ms']:8.2f}ms p99={summary['p99_ms']:8.2f}ms "
+            f"{summary['throughput']:10.1f} ops/s" + (f" q/req={summary['queries']:.1f}" if 'queries' in summary else ''))
+
+
+def compare(summary, baseline, threshold):
+    # Повертає список регресій відносно збереженого baseline (threshold 0.2 = гірше на 20%)
+    regressions = []
+    for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries'):
+        if key in baseline and baseline[key] and summary.get(key, 0) > baseline[key] * (1 + threshold):
+            regressions.append(f'{key} {baseline[key]:.2f} -> {summary[key]:.2f}')
+    if baseline.get('throughput') and summary['throughput'] < baseline['throughput'] * (1 - threshold):
+        regressions.append(f"throughput {baseline['throughput']:.1f} -> {summary['throughput']:.1f}")
+    # Помилки без порогу: прогін, де частина запитів впала, швидший за рахунок цих запитів, а не кращий
+    if error_rate(summary) > error_rate(baseline):
+        regressions.append(f"errors {baseline.get('errors', 0)}/{baseline.get('count', 0)} -> "
+                           f"{summary.get('errors', 0)}/{summary['count']}")
+    return regressions
+
+
+def error_rate(summary):
+    return summary.get('errors', 0) / summary['count'] if summary.get('count') else 0.0
@@ -0,0 +1,187 @@
+# Маркетингові розсилки.
+# Аудиторію не вантажимо в пам'ять: schedule_page() бере сторінку id користувачів по keyset (id > cursor),
+# створює для них CampaignDelivery і роздає celery group пачками по CAMPAIGN_CHUNK_SIZE.
+# Пачки розносяться в часі через countdown, щоб не перевищити rate_per_minute кампанії.
+# Кожен лист спершу "забирається" (pending -> sending), тому повтор таски чи resume після падіння
+# воркера не відправляє лист вдруге. Пауза / resume збільшують Campaign.epoch, і таски старого ланцюжка
+# (з іншим epoch) нічого не роблять, тому після resume працює рівно один ланцюжок
+import logging
+
+from celery import group
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import emails
+from .models import Campaign, CampaignDelivery, CustomUser
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _seconds_per_chunk(campaign):
+    return settings.CAMPAIGN_CHUNK_SIZE * 60 / max(campaign.rate_per_minute, 1)
+
+
+def _current(campaign, epoch):
+    # epoch=None - таска поставлена ще до появи epoch
+    return campaign.status == Campaign.STATUS_RUNNING and (epoch is None or epoch == campaign.epoch)
+
+
+def _fan_out(campaign, user_ids):
+    # Кожна наступна пачка стартує пізніше на стільки, скільки займає відправка попередньої на ліміті кампанії
+    from .tasks import send_campaign_chunk
+
+    delay = _seconds_per_chunk(campaign)
+    signatures = [
+        send_campaign_chunk.signature((campaign.pk, chunk, campaign.epoch), countdown=index * delay)
+        for index, chunk in enumerate(_chunks(user_ids, settings.CAMPAIGN_CHUNK_SIZE))
+    ]
+    if signatures:
+        transaction.on_commit(group(signatures).apply_async)
+    return len(signatures) * delay
+
+
+def start(campaign_id):
+    # Тільки з чернетки і умовним UPDATE ще до постановки таски: подвійний клік в адмінці не запускає два ланцюжки
+    from .tasks import schedule_campaign_page
+
+    with transaction.atomic():
+        if not Campaign.objects.filter(pk=campaign_id, status=Campaign.STATUS_DRAFT).update(status=Campaign.STATUS_RUNNING):
+            return False
+        epoch = Campaign.objects.values_list('epoch', flat=True).get(pk=campaign_id)
+        transaction.on_commit(lambda: schedule_campaign_page.delay(campaign_id, epoch))
+    return True
+
+
+def schedule_page(campaign_id, epoch=None):
+    from .tasks import schedule_campaign_page
+
+    with transaction.atomic():
+        campaign = Campaign.objects.select_for_update().get(pk=campaign_id)
+        if not _current(campaign, epoch):
+            return 0
+
+        page_size = settings.CAMPAIGN_CHUNK_SIZE * settings.CAMPAIGN_PAGE_CHUNKS
+        user_ids = list(
+            CustomUser.objects.filter(**{campaign.audience: True}, is_active=True, id__gt=campaign.cursor)
+            .order_by('id').values_list('id', flat=True)[:page_size]
+        )
+        if not user_ids:
+            # Нових користувачів немає. Кампанія завершена, коли не лишилось листів в черзі,
+            # інакше перевіримо ще раз трохи пізніше
+            if campaign.deliveries.filter(status=CampaignDelivery.STATUS_PENDING).exists():
+                transaction.on_commit(lambda: schedule_campaign_page.apply_async(
+                    (campaign_id, campaign.epoch), countdown=_seconds_per_chunk(campaign)))
+            else:
+                campaign.status = Campaign.STATUS_FINISHED
+                campaign.finished_at = timezone.now()
+                campaign.save(update_fields=['status', 'finished_at'])
+            return 0
+
+        CampaignDelivery.objects.bulk_create(
+            [CampaignDelivery(campaign=campaign, user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        # Курсор і доставки в одній транзакції: після падіння продовжуємо рівно з того ж місця
+        campaign.cursor = user_ids[-1]
+        campaign.scheduled_count = F('scheduled_count') + len(user_ids)
+        campaign.save(update_fields=['cursor', 'scheduled_count'])
+
+        page_duration = _fan_out(campaign, user_ids)
+        transaction.on_commit(lambda: schedule_campaign_page.apply_async(
+            (campaign_id, campaign.epoch), countdown=page_duration))
+    logger.info(f'Campaign {campaign_id}: scheduled {len(user_ids)} deliveries')
+    return len(user_ids)
+
+
+def resume(campaign_id):
+    # Після падіння воркера / паузи: повторно роздаємо ще не взяті листи і продовжуємо з курсора.
+    # Листи в статусі sending не чіпаємо - вони могли вже піти.
+    # Новий epoch: пачки і планування, що ще стоять в брокері від попереднього запуску, вийдуть самі
+    from .tasks import resume_campaign_page
+
+    with transaction.atomic():
+        campaign = Campaign.objects.select_for_update().get(pk=campaign_id)
+        if campaign.status in (Campaign.STATUS_DRAFT, Campaign.STATUS_FINISHED):
+            return
+        campaign.status = Campaign.STATUS_RUNNING
+        campaign.epoch += 1 # Рядок заблокований, гонки немає
+        campaign.save(update_fields=['status', 'epoch'])
+        transaction.on_commit(lambda: resume_campaign_page.delay(campaign_id, campaign.epoch))
+
+
+def resume_page(campaign_id, epoch=None, after_id=0):
+    # Листи, що лишились pending, теж не вантажимо в пам'ять: сторінка по keyset (id доставки > after_id),
+    # як schedule_page() по аудиторії. Коли pending закінчились - далі звичайне планування з курсора,
+    # тому поки йде resume, нових доставок не з'являється
+    from .tasks import resume_campaign_page, schedule_campaign_page
+
+    with transaction.atomic():
+        campaign = Campaign.objects.select_for_update().get(pk=campaign_id)
+        if not _current(campaign, epoch):
+            return 0
+
+        page_size = settings.CAMPAIGN_CHUNK_SIZE * settings.CAMPAIGN_PAGE_CHUNKS
+        pending = list(
+            campaign.deliveries.filter(status=CampaignDelivery.STATUS_PENDING, id__gt=after_id)
+            .order_by('id').values_list('id', 'user_id')[:page_size]
+        )
+        if not pending:
+            transaction.on_commit(lambda: schedule_campaign_page.delay(campaign_id, campaign.epoch))
+            return 0
+
+        page_duration = _fan_out(campaign, [user_id for _, user_id in pending])
+        last_id = pending[-1][0]
+        transaction.on_commit(lambda: resume_campaign_page.apply_async(
+            (campaign_id, campaign.epoch, last_id), countdown=page_duration))
+    logger.info(f'Campaign {campaign_id}: re-queued {len(pending)} pending deliveries')
+    return len(pending)
+
+
+def pause(campaign_id):
+    Campaign.objects.filter(pk=campaign_id, status=Campaign.STATUS_RUNNING).update(
+        status=Campaign.STATUS_PAUSED, epoch=F('epoch') + 1)
+
+
+def send_chunk(campaign_id, user_ids, epoch=None):
+    campaign = Campaign.objects.get(pk=campaign_id)
+    if not _current(campaign, epoch):
+        return 0 # Пауза або старий ланцюжок: листи лишаються pending, їх роздасть resume()
+
+    with transaction.atomic():
+        claimed = list(
+            CampaignDelivery.objects.select_for_update(skip_locked=True)
+            .filter(campaign_id=campaign_id, user_id__in=user_ids, status=CampaignDelivery.STATUS_PENDING)
+            .values_list('id', 'user_id')
+        )
+        CampaignDelivery.objects.filter(id__in=[delivery_id for delivery_id, _ in claimed]).update(
+            status=CampaignDelivery.STATUS_SENDING)
+    if not claimed:
+        return 0
+
+    # Згоду перевіряємо ще раз: користувач міг відписатись поки лист стояв в черзі
+    users = list(CustomUser.objects.filter(
+        id__in=[user_id for _, user_id in claimed], is_active=True, **{campaign.audience: True},
+    ).only('id', 'email', 'first_name'))
+    consenting = {user.id for user in users}
+    skipped = [delivery_id for delivery_id, user_id in claimed if user_id not in consenting]
+    CampaignDelivery.objects.filter(id__in=skipped).update(status=CampaignDelivery.STATUS_SKIPPED)
+
+    delivered = [delivery_id for delivery_id, user_id in claimed if user_id in consenting]
+    try:
+        emails.send('marketing', [(user.email, {'user': user, 'campaign': campaign}) for user in users])
+    except Exception as e:
+        logger.error(f'Campaign {campaign_id} chunk failed: {str(e)}')
+        CampaignDelivery.objects.filter(id__in=delivered).update(status=CampaignDelivery.STATUS_FAILED)
+        raise
+
+    CampaignDelivery.objects.filter(id__in=delivered).update(status=CampaignDelivery.STATUS_SENT, sent_at=timezone.now())
+    Campaign.objects.filter(pk=campaign_id).update(sent_count=F('sent_count') + len(delivered))
+    logger.info(f'Campaign {campaign_id}: sent {len(delivered)}, skipped {len(skipped)}')
+    return len(delivered)
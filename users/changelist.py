@@ -0,0 +1,130 @@
+# Список користувачів в адмінці для таблиці на мільйони рядків.
+# Стандартний ChangeList на кожну сторінку робить COUNT(*) по всій таблиці (двічі, з show_full_result_count)
+# і OFFSET пагінацію, яка на далеких сторінках читає і викидає всі попередні рядки. Тут:
+#   - кількість без фільтрів - оцінка з pg_class.reltuples, з фільтрами / пошуком - COUNT з LIMIT
+#   - сторінки по keyset (id < курсор), посилання "Наступна сторінка" замість номерів
+#   - з БД беруться тільки колонки list_display
+#   - пошук за префіксом lower(поле), під нього індекси text_pattern_ops (міграції 0009, 0013)
+from django.conf import settings
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Lower
+from django.db.models.lookups import StartsWith
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'cursor'
+
+
+class EstimatedCountPaginator(Paginator):
+    estimated = False # Кількість з статистики Postgres, а не COUNT(*)
+    capped = False # Рядків більше, ніж ADMIN_COUNT_LIMIT, порахували тільки до ліміту
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self._estimate(queryset)
+            if estimate >= settings.ADMIN_COUNT_ESTIMATE_THRESHOLD:
+                self.estimated = True
+                return estimate
+        # SELECT COUNT(*) FROM (... LIMIT n): Postgres зупиняється після n рядків, а не сканує все
+        count = queryset.order_by()[:settings.ADMIN_COUNT_LIMIT + 1].count()
+        if count > settings.ADMIN_COUNT_LIMIT:
+            self.capped = True
+            return settings.ADMIN_COUNT_LIMIT
+        return count
+
+    def _estimate(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return -1
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row else -1 # -1: таблицю ще не аналізували (autovacuum / ANALYZE)
+
+
+class KeysetChangeList(ChangeList):
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(CURSOR_VAR, None) # Курсор - не фільтр по полю
+        return params
+
+    def get_ordering(self, request, queryset):
+        # Keyset тільки по первинному ключу: нові користувачі зверху
+        return ['-pk']
+
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        fields = [name for name in self.list_display if self._is_column(self.lookup_opts, name)]
+        # Колонки з list_select_related зв'язків: атрибут моделі, що читає зв'язаний рядок (user.city -> profile.city)
+        if isinstance(self.list_select_related, (list, tuple)):
+            for relation in self.list_select_related:
+                opts = self.lookup_opts.get_field(relation).related_model._meta
+                fields += [f'{relation}__{name}' for name in self.list_display if self._is_column(opts, name)]
+        return queryset.only(*fields)
+
+    def _is_column(self, opts, name):
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            return False # Метод адмінки, атрибут-проксі або action_checkbox
+        return field.concrete and not field.many_to_many
+
+    def get_results(self, request):
+        self.page_num = 1 # Номери сторінок не використовуємо, paginator тільки для кількості
+        super().get_results(request)
+        self.cursor = request.GET.get(CURSOR_VAR)
+        self.next_cursor = None
+        self.count_estimated = self.paginator.estimated
+        self.count_capped = self.paginator.capped
+        if self.show_all and self.can_show_all:
+            return
+        queryset = self.queryset
+        if self.cursor:
+            try:
+                queryset = queryset.filter(pk__lt=int(self.cursor))
+            except ValueError:
+                raise IncorrectLookupParameters
+        rows = list(queryset[:self.list_per_page + 1]) # Зайвий рядок показує, чи є наступна сторінка
+        if len(rows) > self.list_per_page:
+            rows = rows[:self.list_per_page]
+            self.next_cursor = rows[-1].pk
+        self.result_list = rows
+        self.multi_page = bool(self.cursor or self.next_cursor)
+        self.first_page_url = self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
+        self.next_page_url = self.get_query_string({CURSOR_VAR: self.next_cursor}, [PAGE_VAR])
+
+
+def prefix_search(queryset, search_fields, search_term):
+    # Кожне слово - префікс хоча б одного з полів: lower(email) LIKE 'ivan%' OR lower(username) LIKE 'ivan%' ...
+    # На відміну від icontains ('%ivan%') такий LIKE йде по індексу
+    terms = search_term.lower().split()
+    if not terms:
+        return queryset
+    local = [field for field in search_fields if LOOKUP_SEP not in field]
+    related = [field for field in search_fields if LOOKUP_SEP in field]
+    model = queryset.model
+    for term in terms:
+        condition = _prefix_condition(local or related, term)
+        if local and related:
+            # OR між колонками двох таблиць - це LEFT JOIN і скан, індекси не допоможуть.
+            # Тому id з кожної таблиці окремим запитом по її індексах, об'єднані через UNION
+            matched = model._default_manager.filter(condition).values('pk').union(
+                model._default_manager.filter(_prefix_condition(related, term)).values('pk'))
+            condition = Q(pk__in=matched)
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def _prefix_condition(fields, term):
+    condition = Q()
+    for field in fields:
+        condition |= Q(StartsWith(Lower(field), term))
+    return condition
@@ -0,0 +1,111 @@
+# Дебаунс тасок по (ім'я таски, id користувача).
+# Користувачі клацають "Активувати" / "Скинути пароль" по кілька разів, і кожен POST ставив ще один лист.
+# Перший запит у вікні займає ключ через cache.add() (атомарний SET NX в Redis), решта до кінця вікна
+# відкидаються і рахуються. В тестах / локально той самий код працює на locmem кеші
+import logging
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_finished
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_uncommitted = weakref.WeakKeyDictionary() # З'єднання з БД -> ключі, зайняті в його ще не закоміченій транзакції
+
+
+def _cache():
+    return caches[settings.DEBOUNCE_CACHE_ALIAS]
+
+
+def _key(task_name, key):
+    return f'debounce:{task_name}:{key}'
+
+
+def _suppressed_key(task_name):
+    return f'debounce:suppressed:{task_name}'
+
+
+def window_for(task_name):
+    return settings.TASK_DEBOUNCE_WINDOWS.get(task_name)
+
+
+def acquire(task_name, key):
+    # True - можна ставити таску, False - така сама вже стоїть в межах вікна
+    window = window_for(task_name)
+    if not window:
+        return True
+    if _cache().add(_key(task_name, key), 1, timeout=window):
+        return True
+    _count_suppressed(task_name)
+    logger.info(f'Debounced {task_name} for {key}')
+    return False
+
+
+async def aacquire(task_name, key):
+    window = window_for(task_name)
+    if not window:
+        return True
+    if await _cache().aadd(_key(task_name, key), 1, timeout=window):
+        return True
+    await _acount_suppressed(task_name)
+    logger.info(f'Debounced {task_name} for {key}')
+    return False
+
+
+def release(task_name, key):
+    # Звільнити вікно достроково (наприклад, якщо лист так і не поставили в чергу)
+    _cache().delete(_key(task_name, key))
+
+
+async def arelease(task_name, key):
+    await _cache().adelete(_key(task_name, key))
+
+
+def release_on_rollback(task_name, key):
+    # Ключ зайнято, а рядок outbox ще в незакоміченій транзакції (ATOMIC_REQUESTS). Якщо вона відкотиться,
+    # листа не буде, а вікно лишилось би зайнятим і наступний запит користувача відкинувся б.
+    # on_rollback в джанго немає: on_commit знімає ключ зі списку, а все, що лишилось до кінця запиту, відкотилось
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return
+    pending = _uncommitted.setdefault(connection, set())
+    pending.add((task_name, key))
+    transaction.on_commit(lambda: pending.discard((task_name, key)))
+
+
+def _release_uncommitted(**kwargs):
+    for connection in connections.all(initialized_only=True):
+        for task_name, key in _uncommitted.pop(connection, ()):
+            logger.info(f'Released debounce of {task_name} for {key}: transaction rolled back')
+            release(task_name, key)
+
+
+request_finished.connect(_release_uncommitted)
+
+
+def _count_suppressed(task_name):
+    # Лічильник спільний для всіх процесів (INCR в Redis). incr падає на відсутньому ключі, тому спершу add
+    cache = _cache()
+    cache.add(_suppressed_key(task_name), 0, timeout=None)
+    try:
+        cache.incr(_suppressed_key(task_name))
+    except ValueError:
+        pass # Ключ витіснили між add і incr, один пропущений відлік не критичний
+
+
+async def _acount_suppressed(task_name):
+    cache = _cache()
+    await cache.aadd(_suppressed_key(task_name), 0, timeout=None)
+    try:
+        await cache.aincr(_suppressed_key(task_name))
+    except ValueError:
+        pass
+
+
+def stats():
+    # Скільки відправок відкинуто, по кожній таскі з TASK_DEBOUNCE_WINDOWS
+    names = list(settings.TASK_DEBOUNCE_WINDOWS)
+    values = _cache().get_many([_suppressed_key(name) for name in names])
+    return {name: values.get(_suppressed_key(name), 0) for name in names}
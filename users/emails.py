@@ -0,0 +1,99 @@
+# Реєстр шаблонів листів.
+# Кожен лист - тема + текстова і HTML версії з users/templates/users/emails/. Шаблони компілюються
+# один раз на процес воркера, а render_many() рендерить один шаблон для списку отримувачів за один прохід
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import Context, engines
+from django.template.loader import get_template
+
+from . import metrics
+
+_registry = {}
+_lock = threading.Lock()
+
+
+class EmailTemplate:
+    def __init__(self, name, subject, text_template, html_template):
+        self.name = name
+        self.subject_source = subject
+        self.text_template_name = text_template
+        self.html_template_name = html_template
+        self._compiled = None
+
+    def _compile(self):
+        # .template - скомпільований django.template.base.Template без обгортки бекенду
+        if self._compiled is None:
+            with _lock:
+                if self._compiled is None:
+                    subject = engines['django'].from_string(
+                        '{% autoescape off %}' + self.subject_source + '{% endautoescape %}')
+                    self._compiled = (
+                        subject.template,
+                        get_template(self.text_template_name).template,
+                        get_template(self.html_template_name).template,
+                    )
+        return self._compiled
+
+    def render(self, context):
+        return self.render_many([context])[0]
+
+    def render_many(self, contexts):
+        # Один Context на всю пачку, для кожного отримувача тільки push / pop його змінних
+        subject, text, html = self._compile()
+        context = Context()
+        rendered = []
+        for values in contexts:
+            with context.push(values):
+                rendered.append((subject.render(context).strip(), text.render(context), html.render(context)))
+        return rendered
+
+
+def register(name, subject, text_template, html_template):
+    _registry[name] = EmailTemplate(name, subject, text_template, html_template)
+    return _registry[name]
+
+
+def get(name):
+    return _registry[name]
+
+
+def build_messages(name, recipients, from_email=None):
+    # recipients - список (email, context). Повертає готові EmailMultiAlternatives
+    template = get(name)
+    rendered = template.render_many([context for _, context in recipients])
+    messages = []
+    for (email, _), (subject, text, html) in zip(recipients, rendered):
+        message = EmailMultiAlternatives(subject, text, from_email or settings.DEFAULT_FROM_EMAIL, [email])
+        message.attach_alternative(html, 'text/html')
+        messages.append(message)
+    return messages
+
+
+def send(name, recipients, connection=None, fail_silently=False):
+    # Всі листи пачки йдуть через одне SMTP з'єднання
+    messages = build_messages(name, recipients)
+    connection = connection or get_connection(fail_silently=fail_silently)
+    started = time.perf_counter()
+    result = 'error'
+    try:
+        sent = connection.send_messages(messages)
+        result = 'sent'
+        return sent
+    finally:
+        metrics.observe('users_smtp_send_duration_seconds', time.perf_counter() - started, {'template': name},
+                        help="Відправка пачки листів (з'єднання + SMTP діалог)")
+        metrics.inc('users_smtp_messages_total', {'template': name, 'result': result}, len(messages),
+                    help='Листи, передані SMTP серверу')
+
+
+register('welcome', 'Ласкаво просимо на нашу платформу!',
+         'users/emails/welcome.txt', 'users/emails/welcome.html')
+register('account_activation', 'Активація акаунту',
+         'users/emails/account_activation.txt', 'users/emails/account_activation.html')
+register('password_reset', 'Запит для скидання пароля',
+         'users/emails/password_reset.txt', 'users/emails/password_reset.html')
+register('marketing', '{{ campaign.subject }}',
+         'users/emails/marketing.txt', 'users/emails/marketing.html')
@@ -0,0 +1,123 @@
+# Потокове вивантаження користувачів у CSV / NDJSON (staff представлення /users/export/ і manage.py export_users).
+# Рядки йдуть з БД через iterator(): на Postgres це server-side курсор, в пам'яті тільки одна пачка chunk_size.
+# Серіалізуємо пачками по EXPORT_BUFFER_SIZE байт, а не по рядку, щоб не віддавати тисячі дрібних шматків.
+# gzip стискається на льоту (zlib), файл на кілька ГБ не збирається ні в пам'яті, ні на диску.
+# Колонки ті самі, що читає import_users, тому вивантаження можна завантажити назад (без паролів).
+# Комірки CSV, що починаються з = + - @ (або таб / CR), Excel / Google Sheets виконують як формулу
+# (ім'я =HYPERLINK(...) стало б посиланням у таблиці маркетингу), тому в CSV перед ними ставимо '.
+# import_users --from-export цей префікс знімає (в CSV з інших джерел апостроф - частина значення)
+import csv
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.db.models import F
+
+from .models import PROFILE_FIELDS, CustomUser
+
+FIELDS = ['id', 'email', 'username', 'first_name', 'last_name', 'phone', 'address1', 'address2', 'city',
+          'country', 'province', 'postal_code', 'marketing_consent1', 'marketing_consent2', 'email_confirmed',
+          'date_joined']
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+# Телефон і адреса - з UserProfile (LEFT JOIN), під старими назвами колонок
+COLUMNS = {field: F(f'profile__{field}') for field in PROFILE_FIELDS}
+USER_FIELDS = [field for field in FIELDS if field not in COLUMNS]
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def escape_formula(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def unescape_formula(value):
+    if isinstance(value, str) and value.startswith("'") and value[1:].startswith(FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+
+def _to_bool(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 't')
+
+
+def filter_users(params):
+    # params - словник з GET або опцій команди. Порожні / відсутні значення не фільтрують
+    queryset = CustomUser.objects.order_by('id')
+    for field in ('marketing_consent1', 'marketing_consent2', 'email_confirmed'):
+        if params.get(field) not in (None, ''):
+            queryset = queryset.filter(**{field: _to_bool(params[field])})
+    if params.get('country'):
+        queryset = queryset.filter(profile__country=params['country'])
+    return queryset
+
+
+class _Encoder:
+    def __init__(self, fmt, compress):
+        self.fmt = fmt
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer) if fmt == 'csv' else None
+        # wbits=31 - повноцінний .gz файл (заголовок і CRC), а не голий deflate
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        if self.writer:
+            self.writer.writerow(FIELDS)
+
+    def _bytes(self, final=False):
+        data = self.buffer.getvalue().encode()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        if self.compressor:
+            data = self.compressor.compress(data)
+            if final:
+                data += self.compressor.flush()
+        return data
+
+    def feed(self, row):
+        # row - словник з values(): спершу поля користувача, потім профілю, тому порядок колонок беремо з FIELDS.
+        # Повертає байти, коли буфер набрався, інакше b''
+        if self.writer:
+            self.writer.writerow([escape_formula(row[field]) for field in FIELDS])
+        else:
+            self.buffer.write(json.dumps({field: row[field] for field in FIELDS}, ensure_ascii=False, default=str))
+            self.buffer.write('\n')
+        if self.buffer.tell() >= settings.EXPORT_BUFFER_SIZE:
+            return self._bytes()
+        return b''
+
+    def finish(self):
+        return self._bytes(final=True)
+
+
+def iter_export(queryset, fmt='csv', compress=False, chunk_size=None):
+    encoder = _Encoder(fmt, compress)
+    for row in queryset.values(*USER_FIELDS, **COLUMNS).iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE):
+        data = encoder.feed(row)
+        if data:
+            yield data
+    data = encoder.finish()
+    if data:
+        yield data
+
+
+async def aiter_export(queryset, fmt='csv', compress=False, chunk_size=None):
+    encoder = _Encoder(fmt, compress)
+    # values(), а не values_list(): у values_list aiterator() виконує SQL ще в циклі подій (SynchronousOnlyOperation)
+    async for row in queryset.values(*USER_FIELDS, **COLUMNS).aiterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE):
+        data = encoder.feed(row)
+        if data:
+            yield data
+    data = encoder.finish()
+    if data:
+        yield data
+
+
+def filename(fmt, compress):
+    return f'users.{fmt}' + ('.gz' if compress else '')
+
+
+def content_type(fmt, compress):
+    return 'application/gzip' if compress else FORMATS[fmt]
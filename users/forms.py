@@ -1,13 +1,18 @@
+import re
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
-from django.contrib.auth import get_user_model, authenticate
+from django.contrib.auth import get_user_model, authenticate, aauthenticate
 from django.core.validators import RegexValidator
-from django.utils.html import strip_tags
+from django.db import IntegrityError, transaction
+
+from .models import PROFILE_FIELDS
+from .sanitize import sanitize_fields
 
 User = get_user_model() # Бере з налаштувань AUTH_USER_MODEL і працює разом з ним
 
 class CustomUserCreationForm(UserCreationForm):
-    email = forms.EmailField(required=True, max_length=150,
+    email = forms.EmailField(required=True, max_length=100, # Як у моделі: модельна валідація email тут виключена
                              widget=forms.EmailInput(attrs={'class': 'input-register form-control', 'placeholder':'Ваш email'}))
     username = forms.CharField(required=True, max_length=150,
                                widget=forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder':'Ваш тег'}))
@@ -30,19 +35,59 @@ class CustomUserCreationForm(UserCreationForm):
         model = User
         fields = ('email', 'first_name', 'last_name', 'username', 'password1', 'password2', 'marketing_consent1', 'marketing_consent2')
 
-    def clean_email(self): # Метод для перехоплення тих емейлів які вже були зареєстровані
-        email = self.cleaned_data.get('email') # Берем емейл який користувач вписав
-        if User.objects.filter(email=email).exists(): # Якщо емейл знаходиться в бд
-            raise forms.ValidationError("Цей email вже використовується.")
-        return email
+    # Унікальність email і username (без урахування регістру) тримають UniqueConstraint в БД.
+    # Замість п'яти SELECT перед збереженням (clean_email, clean_username, validate_unique, constraints)
+    # пробуємо один INSERT, а порушення унікальності перетворюємо на помилку поля форми
+    UNIQUE_ERRORS = {
+        'username': 'Цей тег вже використовується.',
+        'email': 'Цей email вже використовується.',
+    }
+    # Назва порушеного обмеження -> поле. По назві, а не по тексту помилки: в тексті Postgres є ще й саме значення
+    # (DETAIL: Key (lower(email::text))=(myusername@x.com)), і email зі словом "username" потрапляв би не в те поле
+    UNIQUE_CONSTRAINTS = {
+        'users_customuser_email_ci_uniq': 'email',
+        'users_customuser_username_ci_uniq': 'username',
+        'users_customuser_email_key': 'email', # unique=True полів моделі (Postgres)
+        'users_customuser_username_key': 'username',
+        'users_customuser.email': 'email', # unique=True полів моделі (SQLite)
+        'users_customuser.username': 'username',
+    }
+
+    def clean_username(self):
+        return self.cleaned_data.get('username') # Без запиту username__iexact з UserCreationForm
+
+    def _get_validation_exclusions(self):
+        # Поля, виключені тут, не потрапляють в validate_unique() і validate_constraints() моделі.
+        # Формат і довжину email / username вже перевірили поля форми
+        return super()._get_validation_exclusions() | set(self.UNIQUE_ERRORS)
 
     def save(self, commit=True): # перевизначений метод save(). commit=True (за замовчуванням) → об’єкт збережеться в базу. commit=False → об’єкт створиться, але не буде збережений
         user = super().save(commit=False) # викликається стандартний save() батьківського класу (ModelForm). commit=False означає: створити об’єкт user, але не зберігати його ще в БД. Це робиться, щоб мати змогу дописати поля перед збереженням.
         user.marketing_consent1 = self.cleaned_data.get('marketing_consent1') # це перевірені та очищені дані з форми. Значення з чекбоксів / полів форми записуються в модель user
         user.marketing_consent2 = self.cleaned_data.get('marketing_consent2') #
         if commit: #
-            user.save() # об’єкт реально зберігається в базу даних
-        return user # Повертається об’єкт user (збережений або ні — залежить від commit).
+            try:
+                with transaction.atomic(): # Savepoint: після IntegrityError транзакція запиту (ATOMIC_REQUESTS) лишається робочою
+                    user.save() # Один INSERT, email_confirmed=False вже за замовчуванням моделі
+            except IntegrityError as e:
+                self._add_unique_error(e) # Користувач не збережений (pk None), помилка в self.errors
+        return user # Повертається об’єкт user (збережений або ні — залежить від commit і form.errors).
+
+    def _add_unique_error(self, error):
+        field = self.UNIQUE_CONSTRAINTS.get(_constraint_name(error))
+        if field is None:
+            raise error
+        self.add_error(field, self.UNIQUE_ERRORS[field])
+
+
+def _constraint_name(error):
+    # Postgres (psycopg): назва обмеження / індексу в diag.
+    # SQLite: "UNIQUE constraint failed: index 'users_customuser_email_ci_uniq'" або "...: users_customuser.email"
+    diag = getattr(error.__cause__, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name
+    match = re.search(r"UNIQUE constraint failed: (?:index '([^']+)'|([\w.]+)$)", str(error))
+    return match and (match.group(1) or match.group(2))
 
 class CustomUserLoginForm(AuthenticationForm):
     username = forms.CharField(required=True, max_length=150, label='Email',
@@ -50,18 +95,37 @@ class CustomUserLoginForm(AuthenticationForm):
     password = forms.CharField(required=True, max_length=150, label='Password',
                                widget=forms.PasswordInput(attrs={'autofocus': True, 'class': 'input-register form-control', 'placeholder':'Пароль'}))
 
+    _defer_authenticate = False # True тільки в ais_valid(), там пароль перевіряємо асинхронно
+
     def clean(self):
         email = self.cleaned_data.get('username') # Беремо емейл з форми
         password = self.cleaned_data.get('password') # Беремо емейл з форми
 
-        if email and password: # Перевіряємо, що обидва поля заповнені
+        if email and password and not self._defer_authenticate: # Перевіряємо, що обидва поля заповнені
             self.user_cache = authenticate(self.request, username=email, password=password) # Пробуємо знайти користувача з такими даними
-            if self.user_cache is None: # Якщо користувача не знайдено
-                raise forms.ValidationError('Невірний email або пароль користувача.')
-            elif not self.user_cache.is_active: # Якщо акаунт вимкнений
-                raise forms.ValidationError('Ваш акаунт неактивний!')
+            self._check_user_cache()
         return self.cleaned_data # Повертаємо очищені та перевірені дані
 
+    def _check_user_cache(self):
+        if self.user_cache is None: # Якщо користувача не знайдено
+            raise forms.ValidationError('Невірний email або пароль користувача.')
+        elif not self.user_cache.is_active: # Якщо акаунт вимкнений
+            raise forms.ValidationError('Ваш акаунт неактивний!')
+
+    async def ais_valid(self):
+        # Async версія is_valid() для async_views: поля чистимо як зазвичай,
+        # а пароль перевіряємо через aauthenticate(), без блокування циклу подій
+        self._defer_authenticate = True
+        if not self.is_valid():
+            return False
+        self.user_cache = await aauthenticate(
+            self.request, username=self.cleaned_data['username'], password=self.cleaned_data['password'])
+        try:
+            self._check_user_cache()
+        except forms.ValidationError as error:
+            self.add_error(None, error)
+        return not self.errors
+
 class CustomUserUpdateForm(forms.ModelForm):
     phone = forms.CharField(required=False,
                             validators=[RegexValidator(r'^\+?1?\d{9,15}$', "Введіть правильний номер телефону")],
@@ -78,11 +142,22 @@ class CustomUserUpdateForm(forms.ModelForm):
     email = forms.EmailField(required=True,
                              max_length=150,
                              widget=forms.EmailInput(attrs={'class': 'input-register form-control', 'placeholder': 'Ваш email'}))
+    # Поля профілю (UserProfile) - не колонки User, тому оголошені явно і зберігаються в save()
+    address1 = forms.CharField(required=False, max_length=255,
+                               widget=forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Адреса 1'}))
+    address2 = forms.CharField(required=False, max_length=255,
+                               widget=forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Адреса 2'}))
+    city = forms.CharField(required=False, max_length=255,
+                           widget=forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Місто'}))
+    country = forms.CharField(required=False, max_length=150)
+    province = forms.CharField(required=False, max_length=255,
+                               widget=forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Область'}))
+    postal_code = forms.CharField(required=False, max_length=15,
+                                  widget=forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Поштовий код'}))
 
     class Meta:
         model = User
-        fields = ('first_name', 'last_name','phone', 'username',  'email',
-                  'address1', 'address2', 'city', 'country', 'province', 'postal_code', 'marketing_consent1', 'marketing_consent2')
+        fields = ('first_name', 'last_name', 'username',  'email', 'marketing_consent1', 'marketing_consent2')
         # Перелік полів моделі User, які будуть відображені та оброблені у формі
 
         widgets = {
@@ -90,16 +165,22 @@ class CustomUserUpdateForm(forms.ModelForm):
             'first_name': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Ім`я'}),
             'last_name': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Прізвище'}),
             'username': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Тег'}),
-            'phone': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Номер телефону'}),
-            'address1': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Адреса 1'}),
-            'address2': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Адреса 2'}),
-            'city': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Місто'}),
-            'province': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Область'}),
-            'postal_code': forms.TextInput(attrs={'class': 'input-register form-control', 'placeholder': 'Поштовий код'}),
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        profile = self.instance.get_profile() # Профіль вантажиться тільки тут, на формі (в async представленнях - заздалегідь)
+        for field in PROFILE_FIELDS:
+            self.initial.setdefault(field, getattr(profile, field))
+
+    def save(self, commit=True):
+        for field in PROFILE_FIELDS:
+            setattr(self.instance, field, self.cleaned_data.get(field) or None) # Порожнє поле - NULL, як і раніше
+        return super().save(commit) # user.save() збереже і профіль
+
     def clean_email(self):
         email = self.cleaned_data.get('email') # Беремо email, який користувач ввів у форму
-        if email and User.objects.filter(email=email).exclude(id=self.instance.id).exists():
+        if email and User.objects.filter_by_email(email).exclude(id=self.instance.id).exists():
             # Перевіряємо, чи існує інший користувач з таким email,
             # але виключаємо поточного користувача (self.instance.id)
             raise forms.ValidationError("Цей email вже використовується.")
@@ -112,10 +193,8 @@ class CustomUserUpdateForm(forms.ModelForm):
         if not cleaned_data.get('email'): # Якщо email не передали або він порожній
             cleaned_data['email'] = self.instance.email # Беремо email з існуючого користувача (щоб не затерти його)
 
-            for field in ['phone', 'address1', 'address2', 'city', 'country', 'province', 'postal_code']: # Проходимося по текстових полях
-                if cleaned_data.get(field): # Якщо поле заповнене
-                    cleaned_data[field] = strip_tags(cleaned_data[field])
-                    # Видаляємо HTML-теги (захист від XSS)
+        # Видаляємо HTML-теги з текстових полів (захист від XSS) - завжди, а не тільки коли email порожній
+        sanitize_fields(cleaned_data, PROFILE_FIELDS)
         return cleaned_data
         # Повертаємо очищені дані
 
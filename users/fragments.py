@@ -0,0 +1,60 @@
+# Кеш HTML фрагментів профілю (HTMX partials).
+# Ключ = назва фрагмента + id користувача + версія рядка. Версія - відбиток значень усіх колонок
+# CustomUser (зміну профілю відбиває CustomUser.profile_updated_at), тому після update_account_details
+# ключ змінюється сам і старий фрагмент вже не прочитається,
+# а старі записи витісняються по TIMEOUT / політиці бекенду кешу (CACHES['fragments'])
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'render_ms': 0.0}
+
+
+def row_version(user):
+    values = tuple(getattr(user, field.attname) for field in user._meta.concrete_fields)
+    return hashlib.md5(repr(values).encode(), usedforsecurity=False).hexdigest()[:16]
+
+
+def _key(name, user):
+    return f'users:fragment:{name}:{user.pk}:{row_version(user)}'
+
+
+def _record(counter, render_ms=0.0):
+    with _stats_lock:
+        _stats[counter] += 1
+        _stats['render_ms'] += render_ms
+
+
+def get_or_render(name, user, render):
+    # render - функція без аргументів, яка рендерить фрагмент при промаху
+    cache = caches[settings.FRAGMENT_CACHE_ALIAS]
+    key = _key(name, user)
+    html = cache.get(key)
+    if html is not None:
+        _record('hits')
+        return html
+
+    started = time.perf_counter()
+    html = render()
+    _record('misses', (time.perf_counter() - started) * 1000)
+    cache.set(key, html) # TIMEOUT береться з CACHES[FRAGMENT_CACHE_ALIAS]
+    return html
+
+
+def bypass(render):
+    _record('bypassed')
+    return render()
+
+
+def stats():
+    # Лічильники поточного процесу. saved_ms - скільки рендеру зекономили хіти (за середнім часом промаху)
+    with _stats_lock:
+        snapshot = dict(_stats)
+    avg_render_ms = snapshot['render_ms'] / snapshot['misses'] if snapshot['misses'] else 0.0
+    snapshot['avg_render_ms'] = avg_render_ms
+    snapshot['saved_ms'] = snapshot['hits'] * avg_render_ms
+    return snapshot
@@ -0,0 +1,180 @@
+# Хешування паролів в окремому пулі процесів.
+# PBKDF2 займає сотні мілісекунд CPU і раніше рахувався прямо в потоці запиту,
+# тому під час хвилі логінів воркери не встигали віддавати навіть дешеві сторінки.
+# Тепер хеш рахується в обмеженому пулі, а в запиті ми тільки чекаємо на результат.
+import asyncio
+import base64
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    PBKDF2PasswordHasher, check_password, get_hasher, identify_hasher, make_password,
+)
+from django.utils.crypto import constant_time_compare, pbkdf2
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = None # Обмежує кількість задач в черзі пулу
+
+_stats_lock = threading.Lock()
+_stats = {'pending': 0, 'submitted': 0, 'completed': 0, 'restarts': 0, 'total_ms': 0.0, 'compute_ms': 0.0, 'max_ms': 0.0}
+
+
+def _pbkdf2_sha256(password, salt, iterations):
+    # Виконується в дочірньому процесі, тому тільки чиста криптографія без налаштувань джанго
+    started = time.perf_counter()
+    digest = pbkdf2(password, salt, iterations, digest=hashlib.sha256)
+    return base64.b64encode(digest).decode('ascii').strip(), time.perf_counter() - started
+
+
+def _get_pool():
+    global _pool, _pool_pid, _slots
+    # Пул свій у кожного процесу (gunicorn / celery prefork форкають вже після імпорту модуля)
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = _new_pool()
+                _pool_pid = os.getpid()
+                _slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_MAX_PENDING)
+    return _pool
+
+
+def _new_pool():
+    return ProcessPoolExecutor(
+        max_workers=settings.PASSWORD_HASH_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'), # fork з багатопотокового сервера небезпечний
+    )
+
+
+def _restart_pool(broken):
+    # Дочірній процес помер (OOM, segfault) - пул зламаний назавжди, кожен submit() кидає BrokenProcessPool.
+    # Створюємо новий. _slots не чіпаємо: дозволи задач старого пулу повернуть їх done-колбеки
+    global _pool
+    with _pool_lock:
+        if _pool is broken: # Інший потік міг вже перезапустити
+            logger.warning('Password hash pool is broken, restarting')
+            broken.shutdown(wait=False, cancel_futures=True)
+            _pool = _new_pool()
+            with _stats_lock:
+                _stats['restarts'] += 1
+        return _pool
+
+
+def _submit(password, salt, iterations):
+    pool = _get_pool()
+    with _stats_lock:
+        _stats['pending'] += 1
+        _stats['submitted'] += 1
+    submitted_at = time.perf_counter()
+    try:
+        try:
+            future = pool.submit(_pbkdf2_sha256, password, salt, iterations)
+        except BrokenProcessPool:
+            future = _restart_pool(pool).submit(_pbkdf2_sha256, password, salt, iterations) # Тільки одна спроба
+    except Exception:
+        _slots.release()
+        with _stats_lock:
+            _stats['pending'] -= 1
+        raise
+
+    def _done(future):
+        _slots.release()
+        elapsed_ms = (time.perf_counter() - submitted_at) * 1000
+        with _stats_lock:
+            _stats['pending'] -= 1
+            _stats['completed'] += 1
+            _stats['total_ms'] += elapsed_ms
+            _stats['max_ms'] = max(_stats['max_ms'], elapsed_ms)
+            if not future.exception():
+                _stats['compute_ms'] += future.result()[1] * 1000
+
+    future.add_done_callback(_done)
+    return future
+
+
+def pbkdf2_sha256(password, salt, iterations):
+    # Синхронна точка входу: блокуємо тільки поточний потік, CPU працює в пулі
+    _get_pool()
+    if not _slots.acquire(blocking=False):
+        logger.warning(f'Password hash pool is saturated, {stats()["pending"]} hashes pending')
+        _slots.acquire()
+    return _submit(password, salt, iterations).result()[0]
+
+
+async def apbkdf2_sha256(password, salt, iterations):
+    # Асинхронна точка входу: цикл подій не блокується ні чергою, ні хешуванням
+    _get_pool()
+    if not _slots.acquire(blocking=False):
+        logger.warning(f'Password hash pool is saturated, {stats()["pending"]} hashes pending')
+        await sync_to_async(_slots.acquire, thread_sensitive=False)()
+    result, _ = await asyncio.wrap_future(_submit(password, salt, iterations))
+    return result
+
+
+def stats():
+    # Глибина черги і латенсі пулу (для логів / метрик)
+    with _stats_lock:
+        snapshot = dict(_stats)
+    completed = snapshot['completed'] or 1
+    snapshot['avg_ms'] = snapshot['total_ms'] / completed
+    snapshot['avg_wait_ms'] = (snapshot['total_ms'] - snapshot['compute_ms']) / completed
+    return snapshot
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # Той самий алгоритм pbkdf2_sha256 (старі хеші сумісні), але рахується в пулі процесів
+    def encode(self, password, salt, iterations=None):
+        self._check_encode_args(password, salt)
+        iterations = iterations or self.iterations
+        hash = pbkdf2_sha256(password, salt, iterations)
+        return '%s$%d$%s$%s' % (self.algorithm, iterations, salt, hash)
+
+    async def aencode(self, password, salt, iterations=None):
+        self._check_encode_args(password, salt)
+        iterations = iterations or self.iterations
+        hash = await apbkdf2_sha256(password, salt, iterations)
+        return '%s$%d$%s$%s' % (self.algorithm, iterations, salt, hash)
+
+    async def averify(self, password, encoded):
+        decoded = self.decode(encoded)
+        encoded_2 = await self.aencode(password, decoded['salt'], decoded['iterations'])
+        return constant_time_compare(encoded, encoded_2)
+
+
+async def amake_password(password):
+    hasher = get_hasher()
+    if isinstance(hasher, PooledPBKDF2PasswordHasher) and isinstance(password, (str, bytes)):
+        return await hasher.aencode(password, hasher.salt())
+    return await sync_to_async(make_password, thread_sensitive=False)(password)
+
+
+async def acheck_password(password, encoded):
+    # Повертає (чи підходить пароль, чи треба перехешувати)
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False, False
+    if password is None or not isinstance(hasher, PooledPBKDF2PasswordHasher):
+        must_update = []
+        is_correct = await sync_to_async(check_password, thread_sensitive=False)(
+            password, encoded, setter=lambda raw: must_update.append(True))
+        return is_correct, bool(must_update)
+
+    is_correct = await hasher.averify(password, encoded)
+    preferred = get_hasher()
+    must_update = hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+    if not is_correct and must_update:
+        # Як і check_password() джанго: вирівнюємо час відповіді для застарілих хешів
+        await sync_to_async(hasher.harden_runtime, thread_sensitive=False)(password, encoded)
+    return is_correct, is_correct and must_update
@@ -0,0 +1,62 @@
+# Пакетна генерація посилань активації / скидання пароля.
+# Для нагадувань непідтвердженим користувачам треба сотні тисяч посилань: користувачі читаються
+# keyset пачками (тільки потрібні для токена поля), токен рахується з готового HMAC стану (tokens.py),
+# а URL збирається з шаблону замість reverse() на кожного користувача
+from django.conf import settings
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .tokens import account_activation_token, password_reset_token
+
+KINDS = {
+    # вид -> (генератор токенів, ім'я урла, шаблон листа, змінна з посиланням в шаблоні)
+    'activation': (account_activation_token, 'users:account_activation_confirm', 'account_activation', 'activation_url'),
+    'reset': (password_reset_token, 'users:password_reset_confirm', 'password_reset', 'reset_url'),
+}
+
+# Поля, з яких рахуються токени (_make_hash_value) і будується лист
+TOKEN_FIELDS = ['id', 'email', 'first_name', 'password', 'last_login', 'email_confirmed']
+
+
+def _url_template(kind):
+    # reverse() один раз з маркерами замість uid і токена
+    _, url_name, _, _ = KINDS[kind]
+    url = reverse(url_name, kwargs={'uidb64': 'UIDB64', 'token': 'TOKEN'})
+    return settings.SITE_URL + url.replace('UIDB64', '{uid}').replace('TOKEN', '{token}')
+
+
+def iter_chunks(queryset, chunk_size=2000):
+    # Keyset по id: кожна пачка - окремий короткий запит, без OFFSET і без серверного курсора
+    queryset = queryset.only(*TOKEN_FIELDS).order_by('id')
+    last_id = 0
+    while True:
+        users = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not users:
+            return
+        yield users
+        last_id = users[-1].id
+
+
+def mint(kind, users):
+    # Повертає [(user, url)] для пачки користувачів.
+    # Timestamp один на пачку, а часова мітка в токені - це та ж секунда для всіх посилань
+    generator = KINDS[kind][0]
+    template = _url_template(kind)
+    timestamp = generator._num_seconds(generator._now())
+    return [
+        (user, template.format(
+            uid=urlsafe_base64_encode(force_bytes(user.pk)),
+            token=generator._make_token_with_timestamp(user, timestamp, generator.secret),
+        ))
+        for user in users
+    ]
+
+
+def recipients(kind, minted):
+    # (email, context) для emails.send() - в outbox кладемо тільки те, що потрібно шаблону
+    _, _, _, url_variable = KINDS[kind]
+    return [
+        (user.email, {'user': {'email': user.email, 'first_name': user.first_name}, url_variable: url})
+        for user, url in minted
+    ]
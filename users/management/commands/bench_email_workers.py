@@ -0,0 +1,87 @@
+# Навантажувальний тест відправки листів на локальний SMTP (users/smtp_standin.py).
+# В процесі: ті самі таски, що виконує воркер, в режимі solo (по одній) і в пулі потоків
+#   python manage.py bench_email_workers --messages 2000 --connect-latency 0.2 --pools solo,threads:20,threads:50
+# --backends smtp,pooled порівнює з'єднання на кожен лист з пулом users/smtp_pool.py
+# Наскрізно: таски йдуть в брокер, їх виконують запущені воркери (профілі в not.txt), а листи
+# приймає стенд-ін цієї команди. Воркери запускати з EMAIL_HOST=127.0.0.1 EMAIL_PORT=<port> EMAIL_USE_TLS=0
+#   python manage.py bench_email_workers --broker --messages 2000 --port 1025
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import override_settings
+
+from users.bench import format_summary, summarize
+from users.smtp_standin import SMTPStandIn
+from users.tasks import send_welcome_email
+
+
+BACKENDS = {
+    'smtp': 'django.core.mail.backends.smtp.EmailBackend',
+    'pooled': 'users.smtp_pool.PooledSMTPEmailBackend',
+}
+
+
+class Command(BaseCommand):
+    help = 'Листів за секунду при різних пулах воркера на локальному SMTP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--pools', default='solo,threads:10,threads:50', help='solo або threads:<concurrency>')
+        parser.add_argument('--connect-latency', type=float, default=0.1, help="Затримка з'єднання (SMTP + TLS), секунди")
+        parser.add_argument('--message-latency', type=float, default=0.01)
+        parser.add_argument('--backends', default='smtp,pooled', help="smtp - з'єднання на лист, pooled - users.smtp_pool")
+        parser.add_argument('--broker', action='store_true', help='Через брокер і запущені воркери')
+        parser.add_argument('--port', type=int, default=0)
+        parser.add_argument('--timeout', type=float, default=300)
+
+    def handle(self, *args, **options):
+        server = SMTPStandIn(port=options['port'], connect_latency=options['connect_latency'],
+                             message_latency=options['message_latency']).start()
+        try:
+            if options['broker']:
+                self._run_broker(server, options['messages'], options['timeout'])
+            else:
+                for backend in options['backends'].split(','):
+                    with override_settings(EMAIL_BACKEND=BACKENDS[backend],
+                                           EMAIL_HOST=server.host, EMAIL_PORT=server.port, EMAIL_USE_TLS=False,
+                                           EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD=''):
+                        for pool in options['pools'].split(','):
+                            self._run_pool(server, f'{backend} {pool}', options['messages'])
+        finally:
+            server.stop()
+
+    def _run_pool(self, server, name, total):
+        # .run() - тіло таски без брокера, рівно те, що виконує воркер
+        pool = name.split(' ')[-1]
+        concurrency = 1 if pool == 'solo' else int(pool.split(':')[1])
+
+        def one_task(n):
+            started = time.perf_counter()
+            send_welcome_email.run(f'bench-{n}@example.com', 'Bench')
+            connections.close_all() # Як celery після кожної таски
+            return time.perf_counter() - started
+
+        server.reset()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(one_task, range(total)))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(format_summary(f'{name} ({server.messages} delivered, {server.connections} conn)',
+                                         summarize(latencies, elapsed)))
+
+    def _run_broker(self, server, total, timeout):
+        # Таска маршрутизується в email_bulk через CELERY_TASK_ROUTES
+        server.reset()
+        started = time.perf_counter()
+        for n in range(total):
+            send_welcome_email.apply_async((f'bench-{n}@example.com', 'Bench'))
+        enqueued = time.perf_counter() - started
+        self.stdout.write(f'Enqueued {total} tasks in {enqueued:.2f}s, waiting for workers on port {server.port}')
+
+        while server.messages < total and time.perf_counter() - started < timeout:
+            time.sleep(0.5)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{server.messages}/{total} delivered in {elapsed:.2f}s: '
+                          f'{server.messages / elapsed:.1f} msg/s, {server.connections} SMTP connections')
@@ -0,0 +1,72 @@
+# Вартість очистки текстових полів на одне поле: strip_tags() як було в CustomUser.clean / формі проти users/sanitize.py.
+# Результати мають збігатись з strip_tags значення в значення, інакше команда падає
+# python manage.py bench_sanitize --iterations 200000
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.html import strip_tags
+
+from users import sanitize
+from users.models import PROFILE_FIELDS
+
+SAMPLES = {
+    'postal code': lambda n: '79000',
+    'phone': lambda n: '+380501234567',
+    'address': lambda n: 'вул. Шевченка, 12, кв. 5',
+    'markup repeated': lambda n: '<b>Київ</b>',
+    'markup unique': lambda n: f'<a href="https://example.com/{n}">Львів {n}</a>', # Кожне значення нове, кеш не допомагає
+}
+
+
+def _strip_tags(value):
+    # Як було: strip_tags на кожне непорожнє значення
+    return strip_tags(value) if value else value
+
+
+def _row(n):
+    # Типовий рядок профілю: одне поле з розміткою на сотню рядків
+    return {
+        'phone': '+380501234567', 'address1': 'вул. Шевченка, 12', 'address2': None, 'city': 'Київ',
+        'country': 'Україна', 'province': '<i>Київська</i>' if n % 100 == 0 else 'Київська', 'postal_code': '01001',
+    }
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк очистки полів від HTML: strip_tags проти users/sanitize.py'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        for name, sample in SAMPLES.items():
+            values = [sample(n) for n in range(iterations)]
+            if [_strip_tags(value) for value in values[:1000]] != [sanitize.sanitize(value) for value in values[:1000]]:
+                raise CommandError(f'{name}: результат відрізняється від strip_tags')
+            before = self._run(f'{name} strip_tags', values, len(values), lambda values: [_strip_tags(v) for v in values])
+            after = self._run(f'{name} sanitize', values, len(values), lambda values: [sanitize.sanitize(v) for v in values])
+            self.stdout.write(f'{"":<40} x{before / after:.1f}')
+
+        rows = [_row(n) for n in range(iterations // len(PROFILE_FIELDS))]
+        fields = len(rows) * len(PROFILE_FIELDS)
+
+        def old_clean(rows):
+            for row in rows:
+                for field in PROFILE_FIELDS:
+                    if row[field]:
+                        row[field] = strip_tags(row[field])
+
+        before = self._run('row of 7 fields strip_tags', [dict(row) for row in rows], fields, old_clean)
+        after = self._run('row of 7 fields sanitize_rows', [dict(row) for row in rows], fields,
+                          lambda rows: sanitize.sanitize_rows(rows, PROFILE_FIELDS))
+        self.stdout.write(f'{"":<40} x{before / after:.1f}')
+        self.stdout.write(f'cache: {sanitize.cache_info()}')
+
+    def _run(self, name, items, fields, operation):
+        # Час на поле рахуємо по всьому прогону: perf_counter на кожне значення коштував би більше за саму очистку
+        started = time.perf_counter()
+        operation(items)
+        elapsed = time.perf_counter() - started
+        per_field_us = elapsed / fields * 1_000_000
+        self.stdout.write(f'{name:<40} n={fields:<7} {per_field_us:8.3f}us/field {fields / elapsed:12.0f} fields/s')
+        return per_field_us
@@ -0,0 +1,58 @@
+# Пропускна здатність make_token / check_token: стандартний генератор джанго проти генераторів з tokens.py.
+# Токени мають збігатись байт в байт, інакше старі посилання з листів перестануть працювати
+# python manage.py bench_tokens --iterations 50000
+import time
+
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from users.bench import format_summary, summarize
+from users.models import CustomUser
+from users.tokens import EmailActivationTokenGenerator, account_activation_token, password_reset_token
+
+
+class DjangoActivationTokenGenerator(PasswordResetTokenGenerator):
+    # Та сама схема токена, що в EmailActivationTokenGenerator, але через salted_hmac()
+    _make_hash_value = EmailActivationTokenGenerator._make_hash_value
+
+
+def _users(count):
+    # Користувачі тільки в пам'яті, БД не потрібна
+    now = timezone.now()
+    return [
+        CustomUser(pk=n, email=f'bench-token-{n}@example.com', password=f'pbkdf2_sha256$1$salt${n}', last_login=now)
+        for n in range(1, count + 1)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк генерації і перевірки токенів активації / скидання пароля'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        users = _users(options['iterations'])
+        pairs = [
+            ('reset', PasswordResetTokenGenerator(), password_reset_token),
+            ('activation', DjangoActivationTokenGenerator(), account_activation_token),
+        ]
+        for name, baseline, fast in pairs:
+            if [baseline.make_token(user) for user in users[:100]] != [fast.make_token(user) for user in users[:100]]:
+                raise CommandError(f'{name}: токени відрізняються від стандартного генератора')
+
+            for label, generator in (('django', baseline), ('precomputed', fast)):
+                tokens = self._run(f'{name} make_token {label}', users, generator.make_token)
+                self._run(f'{name} check_token {label}', list(zip(users, tokens)),
+                          lambda pair: generator.check_token(*pair))
+
+    def _run(self, name, items, operation):
+        latencies, results = [], []
+        started = time.perf_counter()
+        for item in items:
+            op_started = time.perf_counter()
+            results.append(operation(item))
+            latencies.append(time.perf_counter() - op_started)
+        self.stdout.write(format_summary(name, summarize(latencies, time.perf_counter() - started)))
+        return results
@@ -0,0 +1,104 @@
+# План і латенсі гарячих запитів до таблиці користувачів з індексами з 0005 і без них.
+# Індекси знімаються всередині транзакції, яка потім відкочується (DDL в postgres транзакційний),
+# тому таблиця після прогону та сама. DROP INDEX тримає ACCESS EXCLUSIVE lock до кінця транзакції -
+# запускати тільки на копії бази, не на проді.
+# python manage.py bench_user_lookups --seed 1000000 --runs 200
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from users.bench import format_summary, summarize
+from users.models import CustomUser
+
+SEED_PREFIX = 'bench-lookup-'
+
+
+def _queries(sample_emails, sample_ids):
+    # Ті самі форми запитів, що в views.py, forms.py і campaigns.py
+    return {
+        'email lookup (reset / clean_email)': lambda: CustomUser.objects.filter_by_email(
+            random.choice(sample_emails).upper()).first(),
+        'pk lookup (token views)': lambda: CustomUser.objects.filter(pk=random.choice(sample_ids)).first(),
+        'consent1 keyset page': lambda: list(CustomUser.objects.filter(
+            marketing_consent1=True, is_active=True, id__gt=random.choice(sample_ids))
+            .order_by('id').values_list('id', flat=True)[:2000]),
+        'unconfirmed keyset page': lambda: list(CustomUser.objects.filter(
+            email_confirmed=False, id__gt=random.choice(sample_ids))
+            .order_by('id').values_list('id', flat=True)[:2000]),
+    }
+
+
+def _explain_querysets(sample_emails, sample_ids):
+    return {
+        'email lookup (reset / clean_email)': CustomUser.objects.filter_by_email(sample_emails[0].upper())[:1],
+        'consent1 keyset page': CustomUser.objects.filter(marketing_consent1=True, is_active=True, id__gt=sample_ids[0])
+        .order_by('id').values_list('id', flat=True)[:2000],
+        'unconfirmed keyset page': CustomUser.objects.filter(email_confirmed=False, id__gt=sample_ids[0])
+        .order_by('id').values_list('id', flat=True)[:2000],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк пошуку користувачів (email, pk, розсилки) з індексами і без них'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Догенерувати тестових користувачів до цієї кількості')
+        parser.add_argument('--runs', type=int, default=200, help='Кількість запитів на кожен вимір')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self._seed(options['seed'], options['batch_size'])
+
+        sample = list(CustomUser.objects.order_by('?').values_list('id', 'email')[:1000])
+        if not sample:
+            self.stderr.write('Таблиця користувачів порожня, запустіть з --seed')
+            return
+        sample_ids = [user_id for user_id, _ in sample]
+        sample_emails = [email for _, email in sample]
+        self.stdout.write(f'Users in table: {CustomUser.objects.count()}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('With indexes'))
+        self._measure(sample_emails, sample_ids, options['runs'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Without indexes'))
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Унікальний constraint на lower(email) - теж звичайний CREATE UNIQUE INDEX
+                for index in [*CustomUser._meta.indexes, *CustomUser._meta.constraints]:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+            self._measure(sample_emails, sample_ids, options['runs'])
+            transaction.set_rollback(True) # Індекси повертаються разом з відкатом
+
+    def _measure(self, sample_emails, sample_ids, runs):
+        for name, queryset in _explain_querysets(sample_emails, sample_ids).items():
+            options = {'analyze': True} if connection.vendor == 'postgresql' else {}
+            self.stdout.write(f'-- {name}\n{queryset.explain(**options)}')
+
+        for name, query in _queries(sample_emails, sample_ids).items():
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(runs):
+                query_started = time.perf_counter()
+                query()
+                latencies.append(time.perf_counter() - query_started)
+            self.stdout.write(format_summary(name, summarize(latencies, time.perf_counter() - started)))
+
+    def _seed(self, target, batch_size):
+        # Пароль непридатний ('!...'), щоб не рахувати мільйон PBKDF2 хешів заради бенчмарку
+        existing = CustomUser.objects.count()
+        start = CustomUser.objects.filter(username__startswith=SEED_PREFIX).count()
+        for offset in range(start, start + max(target - existing, 0), batch_size):
+            users = [
+                CustomUser(
+                    email=f'{SEED_PREFIX}{n}@Example.com', username=f'{SEED_PREFIX}{n}',
+                    first_name='Bench', last_name=str(n), password='!',
+                    marketing_consent1=n % 5 == 0, marketing_consent2=n % 20 == 0, email_confirmed=n % 10 != 0,
+                )
+                for n in range(offset, min(offset + batch_size, start + target - existing))
+            ]
+            CustomUser.objects.bulk_create(users, batch_size=batch_size)
+            self.stdout.write(f'Seeded {offset + len(users) - start} users', ending='\r')
+        self.stdout.write('')
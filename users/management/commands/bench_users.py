@@ -0,0 +1,140 @@
+# Наскрізний бенчмарк users: реєстрація, логін, профіль і HTMX ендпоінти під конкурентним навантаженням.
+# Листи - locmem, celery - eager, rate limit вимкнений. Запускати на локальній базі, не на проді.
+# python manage.py bench_users --seed 1000 --requests 500 --concurrency 20 --save-baseline bench_baseline.json
+# python manage.py bench_users --requests 500 --concurrency 20 --baseline bench_baseline.json --threshold 0.2
+import itertools
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import current_app
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from users.bench import compare, format_summary, summarize
+from users.models import CustomUser
+from users.outbox import dispatch_pending
+
+SEED_PREFIX = 'bench-users-'
+PASSWORD = 'Bench-password-42'
+SCENARIOS = ['register', 'login', 'profile', 'account_details', 'update_account_details']
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк ендпоінтів users з порівнянням з baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Скільки тестових користувачів мати в базі')
+        parser.add_argument('--requests', type=int, default=300, help='Запитів на кожен сценарій')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--baseline', help='JSON з попереднього прогону, з яким порівнюємо')
+        parser.add_argument('--save-baseline', help='Зберегти результати цього прогону як baseline')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Допустиме погіршення (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        users = self._seed(max(options['seed'], options['concurrency']))
+        results = {}
+
+        eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True # Листи відправляються прямо при dispatch_pending()
+        try:
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                                   RATELIMIT_ENABLED=False, ALLOWED_HOSTS=['testserver']):
+                for scenario in options['scenarios'].split(','):
+                    summary = self._run(scenario, users, options['requests'], options['concurrency'])
+                    results[scenario] = summary
+                    self.stdout.write(format_summary(scenario, summary) +
+                                      (f" errors={summary['errors']}" if summary['errors'] else ''))
+                    dispatch_pending() # Розбираємо outbox, щоб він не ріс між сценаріями
+        finally:
+            current_app.conf.task_always_eager = eager
+            CustomUser.objects.filter(username__startswith=f'{SEED_PREFIX}reg-').delete()
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Baseline saved to {options['save_baseline']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            failed = {scenario: compare(summary, baseline[scenario], options['threshold'])
+                      for scenario, summary in results.items() if scenario in baseline}
+            failed = {scenario: regressions for scenario, regressions in failed.items() if regressions}
+            if failed:
+                raise CommandError('Регресія: ' + '; '.join(f"{s}: {', '.join(r)}" for s, r in failed.items()))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
+
+    def _seed(self, count):
+        # Один хеш пароля на всіх: сотні PBKDF2 заради підготовки даних не потрібні
+        existing = list(CustomUser.objects.filter(username__startswith=f'{SEED_PREFIX}user-').order_by('id')[:count])
+        if len(existing) < count:
+            password = make_password(PASSWORD)
+            CustomUser.objects.bulk_create([
+                CustomUser(email=f'{SEED_PREFIX}user-{n}@example.com', username=f'{SEED_PREFIX}user-{n}',
+                           first_name='Bench', last_name=str(n), password=password)
+                for n in range(len(existing), count)
+            ], batch_size=1000, ignore_conflicts=True)
+            existing = list(CustomUser.objects.filter(username__startswith=f'{SEED_PREFIX}user-').order_by('id')[:count])
+        return existing
+
+    def _request(self, scenario, client, user):
+        # Повертає (відповідь, очікуваний статус)
+        if scenario == 'register':
+            suffix = uuid.uuid4().hex[:12]
+            return client.post('/users/register/', {
+                'email': f'{SEED_PREFIX}reg-{suffix}@example.com', 'username': f'{SEED_PREFIX}reg-{suffix}',
+                'first_name': 'Bench', 'last_name': 'Register', 'password1': PASSWORD, 'password2': PASSWORD,
+            }), 302
+        if scenario == 'login':
+            return client.post('/users/login/', {'username': user.email, 'password': PASSWORD}), 302
+        if scenario == 'update_account_details':
+            return client.post('/users/update_account_details/', {
+                'first_name': f'Bench{uuid.uuid4().hex[:6]}', 'last_name': user.last_name,
+                'username': user.username, 'email': user.email,
+            }, HTTP_HX_REQUEST='true'), 200
+        return client.get(f'/users/{scenario}/'), 200
+
+    def _run(self, scenario, users, total, concurrency):
+        # Потік = окремий клієнт з окремим користувачем (update одного рядка з кількох потоків - це вже тест блокувань)
+        local = threading.local()
+        user_pool = itertools.cycle(users)
+        pool_lock = threading.Lock()
+
+        def one_request(_):
+            if not hasattr(local, 'client'):
+                with pool_lock:
+                    local.user = next(user_pool)
+                local.client = Client()
+                if scenario not in ('register', 'login'):
+                    local.client.force_login(local.user)
+            if scenario in ('register', 'login'):
+                local.client.cookies.clear() # Кожна реєстрація / логін з чистою сесією
+            with CaptureQueriesContext(connections['default']) as queries:
+                started = time.perf_counter()
+                try:
+                    response, expected = self._request(scenario, local.client, local.user)
+                    failed = response.status_code != expected
+                except Exception as e:
+                    # Client прокидає винятки представлення. Рахуємо як помилку, а не зупиняємо весь прогін
+                    self.stderr.write(f'{scenario}: {e.__class__.__name__}: {e}')
+                    failed = True
+                latency = time.perf_counter() - started
+            return latency, len(queries), failed
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            rows = list(executor.map(one_request, range(total)))
+        elapsed = time.perf_counter() - started
+        connections.close_all()
+
+        summary = summarize([row[0] for row in rows], elapsed)
+        summary['queries'] = sum(row[1] for row in rows) / len(rows) if rows else 0.0
+        summary['errors'] = sum(1 for row in rows if row[2])
+        return summary
@@ -0,0 +1,92 @@
+# Порівняння WSGI (views.py) і ASGI (async_views.py) шляхів на однакових запитах
+# python manage.py bench_views --requests 1000 --concurrency 100
+import asyncio
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import include, path
+
+from users import async_views, views
+from users.bench import format_summary, summarize
+from users.models import CustomUser
+from users.urls import build_urlpatterns
+
+BENCH_EMAIL = 'bench-views@example.com'
+
+
+def _urlconf(views_module):
+    # Окремий urlconf під кожен модуль представлень, щоб ганяти обидва шляхи в одному процесі
+    urlconf = types.ModuleType(f'bench_urls_{views_module.__name__}')
+    urlconf.urlpatterns = [
+        path('users/', include((build_urlpatterns(views_module), 'users'), namespace='users')),
+    ]
+    return urlconf
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк sync (WSGI) проти async (ASGI) представлень під конкурентним навантаженням'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Кількість запитів на кожен шлях')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--paths', default='profile,account_details,edit_account_details')
+
+    def handle(self, *args, **options):
+        user, created = CustomUser.objects.get_or_create(
+            email=BENCH_EMAIL, defaults={'username': 'bench-views', 'first_name': 'Bench', 'last_name': 'Views'},
+        )
+        if created:
+            user.set_unusable_password()
+            user.save()
+
+        paths = [f'/users/{name}/' for name in options['paths'].split(',')]
+        for mode, module, runner in (('wsgi', views, self._run_wsgi), ('asgi', async_views, self._run_asgi)):
+            with override_settings(ROOT_URLCONF=_urlconf(module), ALLOWED_HOSTS=['testserver']):
+                for url in paths:
+                    latencies, errors, elapsed = runner(user, url, options['requests'], options['concurrency'])
+                    line = format_summary(f'{mode} {url}', summarize(latencies, elapsed))
+                    self.stdout.write(line + (f' errors={errors}' if errors else ''))
+
+    def _run_wsgi(self, user, url, total, concurrency):
+        # Класична модель: потік на запит, кожен потік зі своїм клієнтом і з'єднанням до БД
+        local = threading.local()
+
+        def one_request(_):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+                local.client.force_login(user)
+            started = time.perf_counter()
+            response = local.client.get(url)
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one_request, range(total)))
+        elapsed = time.perf_counter() - started
+        connections.close_all()
+        return [r[0] for r in results], sum(1 for r in results if r[1] != 200), elapsed
+
+    def _run_asgi(self, user, url, total, concurrency):
+        # Один цикл подій тримає всі конкурентні запити
+        async def run():
+            client = AsyncClient()
+            await client.aforce_login(user)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one_request():
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.get(url)
+                    return time.perf_counter() - started, response.status_code
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(one_request() for _ in range(total)))
+            return results, time.perf_counter() - started
+
+        results, elapsed = asyncio.run(run())
+        return [r[0] for r in results], sum(1 for r in results if r[1] != 200), elapsed
@@ -0,0 +1,229 @@
+# Масовий імпорт користувачів з CSV / NDJSON
+# python manage.py import_users users.csv --chunk-size 2000 --workers 8 [--copy] [--from-export]
+import csv
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, get_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+
+from users.export import unescape_formula
+from users.hashers import PooledPBKDF2PasswordHasher
+from users.models import CustomUser, UserProfile
+from users.sanitize import sanitize_rows
+
+BOOLEAN_FIELDS = ('marketing_consent1', 'marketing_consent2', 'email_confirmed')
+OPTIONAL_FIELDS = ('phone', 'address1', 'address2', 'city', 'country', 'province', 'postal_code') # Поля UserProfile
+
+
+def _init_worker():
+    # Процеси пулу можуть стартувати через spawn, тоді джанго треба налаштувати заново
+    import django
+    django.setup()
+
+
+def _hash_password(raw_password):
+    # Процес імпорту вже сам є пулом для хешування. PooledPBKDF2PasswordHasher підняв би в кожному з них
+    # ще й свій spawn пул, тому той самий pbkdf2_sha256 рахуємо прямо тут
+    hasher = get_hasher()
+    if isinstance(hasher, PooledPBKDF2PasswordHasher):
+        hasher = PBKDF2PasswordHasher()
+    return make_password(raw_password, hasher=hasher)
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y', 't')
+
+
+class Command(BaseCommand):
+    help = 'Імпорт користувачів з CSV або NDJSON з паралельним хешуванням паролів'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Шлях до файлу або "-" для stdin')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='За замовчуванням визначається по розширенню')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Кількість процесів для хешування паролів')
+        parser.add_argument('--copy', action='store_true',
+                            help='Завантажувати через PostgreSQL COPY замість bulk_create')
+        parser.add_argument('--from-export', action='store_true',
+                            help="CSV з export_users: зняти апостроф, яким експорт екранує формули ('=..., '+...)")
+
+    def handle(self, *args, **options):
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy працює тільки з PostgreSQL')
+
+        fmt = options['format'] or ('ndjson' if options['path'].endswith(('.ndjson', '.jsonl')) else 'csv')
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8', newline='')
+
+        self.verbosity = options['verbosity']
+        self.seen_emails = set() # Дублікати всередині самого файлу
+        self.seen_usernames = set()
+        self.stats = {'processed': 0, 'created': 0, 'duplicates': 0, 'invalid': 0}
+        started = time.monotonic()
+
+        try:
+            rows = self._read_rows(stream, fmt, options['from_export'])
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+                while True:
+                    chunk = list(islice(rows, options['chunk_size']))
+                    if not chunk:
+                        break
+                    self._import_chunk(chunk, pool, options)
+
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f"processed={self.stats['processed']} created={self.stats['created']} "
+                        f"duplicates={self.stats['duplicates']} invalid={self.stats['invalid']} "
+                        f"rate={self.stats['processed'] / elapsed:.0f} rows/s"
+                    )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {time.monotonic() - started:.1f}s: created {self.stats['created']} users"
+        ))
+
+    def _read_rows(self, stream, fmt, from_export=False):
+        # Читаємо файл потоком, в пам'яті тримаємо тільки поточний чанк
+        if fmt == 'csv':
+            for row in csv.DictReader(stream):
+                if from_export: # В інших файлах '+1 555... - саме таке значення, апостроф не чіпаємо
+                    row = {field: unescape_formula(value) for field, value in row.items()}
+                yield row
+        else:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _build_users(self, chunk):
+        users, raw_passwords = [], []
+        sanitize_rows(chunk, OPTIONAL_FIELDS) # Чистимо адресні поля від HTML так само як і при реєстрації, всю пачку разом
+        for row in chunk:
+            self.stats['processed'] += 1
+            email = CustomUser.objects.normalize_email((row.get('email') or '').strip())
+            username = (row.get('username') or '').strip() or email.split('@')[0]
+            try:
+                validate_email(email)
+            except ValidationError:
+                self.stats['invalid'] += 1
+                if self.verbosity > 1:
+                    self.stderr.write(f'Invalid email: {email!r}')
+                continue
+
+            if email.lower() in self.seen_emails or username in self.seen_usernames:
+                self.stats['duplicates'] += 1
+                continue
+            self.seen_emails.add(email.lower())
+            self.seen_usernames.add(username)
+
+            user = CustomUser(
+                email=email,
+                username=username,
+                first_name=(row.get('first_name') or '').strip(),
+                last_name=(row.get('last_name') or '').strip(),
+                password=row.get('password_hash') or '', # Вже захешовані паролі переносимо як є
+                **{field: row.get(field) or None for field in OPTIONAL_FIELDS},
+                **{field: _to_bool(row.get(field)) for field in BOOLEAN_FIELDS},
+            )
+            users.append(user)
+            raw_passwords.append(None if user.password else row.get('password') or None)
+        return users, raw_passwords
+
+    def _exclude_existing(self, users, raw_passwords):
+        # Одним запитом на чанк перевіряємо які email / username вже є в БД
+        existing_emails = set(CustomUser.objects.annotate(email_lower=Lower('email')).filter(
+            email_lower__in=[user.email.lower() for user in users]).values_list('email_lower', flat=True))
+        existing_usernames = set(CustomUser.objects.filter(
+            username__in=[user.username for user in users]).values_list('username', flat=True))
+        fresh = [(user, raw) for user, raw in zip(users, raw_passwords)
+                 if user.email.lower() not in existing_emails and user.username not in existing_usernames]
+        self.stats['duplicates'] += len(users) - len(fresh)
+        return [user for user, _ in fresh], [raw for _, raw in fresh]
+
+    def _import_chunk(self, chunk, pool, options):
+        users, raw_passwords = self._build_users(chunk)
+        # Дублікати відсіюємо до хешування, щоб не витрачати на них CPU
+        users, raw_passwords = self._exclude_existing(users, raw_passwords)
+        if not users:
+            return
+
+        # Хешування - найдорожча частина, розкидаємо її по процесах. Порожній пароль = unusable, без пулу
+        to_hash = [(user, raw) for user, raw in zip(users, raw_passwords) if raw]
+        hashed = pool.map(_hash_password, [raw for _, raw in to_hash],
+                          chunksize=max(1, len(to_hash) // (options['workers'] * 4)))
+        for (user, _), encoded in zip(to_hash, hashed):
+            user.password = encoded
+        for user in users:
+            if not user.password:
+                user.set_unusable_password()
+
+        with transaction.atomic():
+            if options['copy']:
+                self._copy_insert(users)
+            else:
+                # ignore_conflicts - на випадок якщо хтось зареєструвався паралельно з імпортом,
+                # такі рядки просто пропускаються
+                CustomUser.objects.bulk_create(users, batch_size=options['chunk_size'], ignore_conflicts=True)
+            inserted = self._inserted_ids(users)
+            self._insert_profiles(users, inserted, options['chunk_size'])
+        self.stats['duplicates'] += len(users) - len(inserted)
+        self.stats['created'] += len(inserted)
+
+    def _inserted_ids(self, users):
+        # З ignore_conflicts bulk_create не повертає id і не каже, скільки рядків пропущено через ON CONFLICT,
+        # тому беремо їх одним запитом по email. Пароль солений (unusable теж випадковий), тож збіг хешу
+        # відрізняє наш рядок від паралельної реєстрації з тим самим email
+        by_email = {user.email.lower(): user for user in users}
+        rows = CustomUser.objects.alias(email_lower=Lower('email')).filter(
+            email_lower__in=list(by_email)).values_list('id', 'email', 'password')
+        return {email.lower(): user_id for user_id, email, password in rows if password == by_email[email.lower()].password}
+
+    def _insert_profiles(self, users, inserted, batch_size):
+        # Профілі тільки тим, у кого в файлі є телефон / адреса і чий рядок справді вставлено
+        profiles = []
+        for user in users:
+            profile = user.get_profile()
+            if user.email.lower() in inserted and not profile.is_empty():
+                profiles.append(UserProfile(user_id=inserted[user.email.lower()],
+                                            **{field: getattr(profile, field) for field in OPTIONAL_FIELDS}))
+        UserProfile.objects.bulk_create(profiles, batch_size=batch_size)
+
+    def _copy_insert(self, users):
+        # COPY в тимчасову таблицю, а звідти INSERT ... ON CONFLICT DO NOTHING,
+        # щоб дублікат не валив весь чанк
+        fields = [field for field in CustomUser._meta.concrete_fields if not field.primary_key]
+        table = connection.ops.quote_name(CustomUser._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        # csv пише None як "" (в лапках), а COPY читає "" як порожній рядок. FORCE_NULL робить з нього NULL,
+        # але тільки для nullable колонок: порожнє ім'я лишається порожнім рядком
+        nullable = ', '.join(connection.ops.quote_name(field.column) for field in fields if field.null)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for user in users:
+            writer.writerow([field.get_db_prep_save(getattr(user, field.attname), connection) for field in fields])
+        buffer.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE users_import_staging ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            cursor.copy_expert(
+                f'COPY users_import_staging ({columns}) FROM STDIN WITH (FORMAT csv, FORCE_NULL ({nullable}))', buffer
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) SELECT {columns} FROM users_import_staging ON CONFLICT DO NOTHING'
+            )
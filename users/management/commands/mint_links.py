@@ -0,0 +1,61 @@
+# Посилання активації / скидання пароля для великої кількості користувачів.
+# python manage.py mint_links --kind activation --unconfirmed --output links.csv
+# python manage.py mint_links --kind activation --unconfirmed --outbox   - нагадування листами через EmailOutbox
+import csv
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users import links
+from users.models import CustomUser
+from users.outbox import enqueue_email
+from users.tasks import send_prepared_links
+
+
+class Command(BaseCommand):
+    help = 'Генерує посилання активації або скидання пароля пачками і пише їх в файл або в outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=list(links.KINDS), default='activation')
+        parser.add_argument('--unconfirmed', action='store_true', help='Тільки користувачі з непідтвердженою поштою')
+        parser.add_argument('--output', help='CSV файл (user_id,email,url), "-" - stdout')
+        parser.add_argument('--outbox', action='store_true', help='Поставити листи в EmailOutbox')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if bool(options['output']) == options['outbox']:
+            raise CommandError('Потрібно вказати або --output, або --outbox')
+
+        queryset = CustomUser.objects.filter(is_active=True)
+        if options['unconfirmed']:
+            queryset = queryset.filter(email_confirmed=False) # Частковий індекс users_cu_unconfirmed_idx
+
+        output = None
+        if options['output']:
+            output = sys.stdout if options['output'] == '-' else open(options['output'], 'w', newline='')
+            writer = csv.writer(output)
+            writer.writerow(['user_id', 'email', 'url'])
+
+        total = 0
+        try:
+            for users in links.iter_chunks(queryset, options['chunk_size']):
+                minted = links.mint(options['kind'], users)
+                if output:
+                    writer.writerows((user.pk, user.email, url) for user, url in minted)
+                else:
+                    self._enqueue(options['kind'], minted)
+                total += len(minted)
+                self.stderr.write(f'Minted {total} links', ending='\r')
+        finally:
+            if output and output is not sys.stdout:
+                output.close()
+        self.stderr.write(f'Minted {total} {options["kind"]} links')
+
+    def _enqueue(self, kind, minted):
+        # Один рядок outbox = одна таска = CAMPAIGN_CHUNK_SIZE листів через одне SMTP з'єднання
+        size = settings.CAMPAIGN_CHUNK_SIZE
+        with transaction.atomic():
+            for start in range(0, len(minted), size):
+                enqueue_email(send_prepared_links, kind, links.recipients(kind, minted[start:start + size]))
@@ -0,0 +1,37 @@
+# Очистка результатів celery тасок пачками.
+# python manage.py purge_task_results                - прострочені users.TaskResult
+# python manage.py purge_task_results --legacy       - ще й старі рядки django_celery_results (до users/results.py)
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from users.results import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Видаляє прострочені результати celery тасок пачками, без довгих блокувань таблиці'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=settings.TASK_RESULT_PURGE_CHUNK)
+        parser.add_argument('--sleep', type=float, default=0.0, help='Пауза між пачками (секунди)')
+        parser.add_argument('--legacy', action='store_true', help='Видалити всі рядки django_celery_results')
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(options['chunk_size'], options['sleep'])
+        self.stdout.write(f'Deleted {deleted} expired task results')
+
+        if options['legacy']:
+            deleted = self._purge_legacy(options['chunk_size'], options['sleep'])
+            self.stdout.write(f'Deleted {deleted} legacy django_celery_results rows')
+
+    def _purge_legacy(self, chunk_size, sleep):
+        import time
+        from django_celery_results.models import TaskResult
+
+        deleted = 0
+        while True:
+            ids = list(TaskResult.objects.order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return deleted
+            deleted += TaskResult.objects.filter(id__in=ids).delete()[0]
+            if sleep:
+                time.sleep(sleep)
@@ -0,0 +1,29 @@
+# Локальний SMTP для навантажувальних тестів, раз на секунду друкує кількість прийнятих листів
+# python manage.py smtp_standin --port 1025 --connect-latency 0.2
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.smtp_standin import SMTPStandIn
+
+
+class Command(BaseCommand):
+    help = 'Запускає локальний SMTP сервер, який приймає і рахує листи'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--connect-latency', type=float, default=0.0, help="Затримка з'єднання, секунди")
+        parser.add_argument('--message-latency', type=float, default=0.0, help='Затримка на кожен лист, секунди')
+
+    def handle(self, *args, **options):
+        server = SMTPStandIn(options['host'], options['port'], options['connect_latency'], options['message_latency']).start()
+        self.stdout.write(f'Listening on {server.host}:{server.port}')
+        last = 0
+        try:
+            while True:
+                time.sleep(1)
+                self.stdout.write(f'{server.messages} messages ({server.messages - last}/s), {server.connections} connections')
+                last = server.messages
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,377 @@
+# Метрики в текстовому форматі Prometheus (/metrics).
+# Кожен процес (gunicorn / uvicorn воркер, celery prefork дитина) рахує лічильники і гістограми в пам'яті,
+# а раз на METRICS_FLUSH_INTERVAL секунд скидає знімок в METRICS_DIR/<pid>.json.
+# /metrics зливає знімки всіх процесів, тому не важливо, який воркер обробив запит на метрики.
+# Процес видаляє свій файл при завершенні. Знімки, що не оновлювались довше METRICS_STALE_AFTER
+# (процес впав або його вбили), не враховуються і видаляються: інакше лічильники мертвих воркерів сумувались би
+# вічно, а новий процес з тим самим pid рахувався б разом зі старим. Живий процес оновлює знімок і в простої.
+# Після рестарту воркера сума лічильників зменшується - Prometheus вважає це скиданням лічильника
+import atexit
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_process_shutdown
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, float('inf'))
+
+_lock = threading.Lock()
+_counters = {} # (name, labels) -> value
+_histograms = {} # (name, labels) -> [кількість по кошиках..., сума, кількість]
+_buckets = {} # name -> кошики гістограми
+_help = {}
+_collectors = [] # (функція, shared)
+_last_flush = 0.0
+_heartbeat_pid = None # Процес, в якому вже працює потік оновлення знімка
+_heartbeat_lock = threading.Lock()
+
+_query_count = contextvars.ContextVar('metrics_query_count', default=None)
+
+
+def _reset_after_fork():
+    # Дитина prefork успадковує лічильники батька, а вони вже є в файлі батька
+    global _last_flush
+    _counters.clear()
+    _histograms.clear()
+    _last_flush = 0.0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def inc(name, labels=None, value=1, help=''):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        _help.setdefault(name, help)
+    _maybe_flush()
+
+
+def observe(name, value, labels=None, buckets=LATENCY_BUCKETS, help=''):
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            _buckets[name] = buckets
+            _help.setdefault(name, help)
+            histogram = _histograms[key] = [0] * len(buckets) + [0.0, 0]
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+    _maybe_flush()
+
+
+def register_collector(collect, shared=False):
+    # collect() повертає [(name, type, labels, value)] на момент збору.
+    # shared=False - значення свої в кожному процесі (сумуються), True - спільні (Redis), беруться один раз
+    _collectors.append((collect, shared))
+
+
+def _safe(collect):
+    # Недоступний Redis (debounce) не повинен ламати весь /metrics
+    try:
+        return list(collect())
+    except Exception:
+        return []
+
+
+def _snapshot():
+    with _lock:
+        counters = [[name, list(labels), value] for (name, labels), value in _counters.items()]
+        histograms = [[name, list(labels), list(values)] for (name, labels), values in _histograms.items()]
+        buckets = {name: list(buckets) for name, buckets in _buckets.items()}
+        help = dict(_help)
+    gauges = []
+    for collect, shared in _collectors:
+        if not shared:
+            gauges.extend([name, kind, _labels(labels), value] for name, kind, labels, value in _safe(collect))
+    return {'counters': counters, 'histograms': histograms, 'buckets': buckets, 'help': help, 'samples': gauges}
+
+
+def _path():
+    return os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json')
+
+
+def _ensure_heartbeat():
+    # Процес без запитів не скидає знімок сам, а застарілий знімок /metrics відкидає
+    global _heartbeat_pid
+    if _heartbeat_pid == os.getpid():
+        return
+    with _heartbeat_lock:
+        if _heartbeat_pid != os.getpid(): # Після fork потік батька в дитині не працює
+            _heartbeat_pid = os.getpid()
+            threading.Thread(target=_heartbeat_loop, name='metrics-heartbeat', daemon=True).start()
+
+
+def _heartbeat_loop():
+    pid = os.getpid()
+    while _heartbeat_pid == pid:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        _maybe_flush()
+
+
+def flush():
+    global _last_flush
+    _last_flush = time.monotonic()
+    _ensure_heartbeat()
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = _path()
+    temporary = f'{path}.{threading.get_ident()}.tmp' # Свій файл у кожного потоку, що скидає знімок
+    with open(temporary, 'w') as file:
+        json.dump(_snapshot(), file)
+    os.replace(temporary, path) # Атомарно: /metrics ніколи не читає наполовину записаний файл
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL:
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _merge():
+    counters, histograms, buckets, help, samples = {}, {}, {}, {}, {}
+    stale_before = time.time() - settings.METRICS_STALE_AFTER
+    for filename in os.listdir(settings.METRICS_DIR):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(settings.METRICS_DIR, filename)
+        try:
+            if os.path.getmtime(path) < stale_before:
+                os.remove(path) # Процес, що не прибрав за собою (впав / kill -9)
+                continue
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue # Процес якраз перезаписує файл або файл вже прибрали
+        buckets.update(snapshot['buckets'])
+        help.update(snapshot['help'])
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(values))
+            for index, value in enumerate(values):
+                merged[index] += value
+        for name, kind, labels, value in snapshot['samples']:
+            key = (name, kind, tuple(map(tuple, labels)))
+            samples[key] = samples.get(key, 0) + value
+    for collect, shared in _collectors:
+        if shared:
+            for name, kind, labels, value in _safe(collect):
+                samples[(name, kind, _labels(labels))] = value
+    return counters, histograms, buckets, help, samples
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_le(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def render():
+    flush() # Свіжі дані поточного процесу
+    counters, histograms, buckets, help, samples = _merge()
+    lines = []
+
+    def header(name, kind):
+        if help.get(name):
+            lines.append(f'# HELP {name} {help[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    for name in sorted({name for name, _ in counters}):
+        header(name, 'counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    for name in sorted({name for name, _ in histograms}):
+        header(name, 'histogram')
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets[name], values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", _format_le(bound))])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {values[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {values[-1]}')
+    for name, kind in sorted({(name, kind) for name, kind, _ in samples}):
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, _, labels), value in sorted(samples.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# --- Представлення: латенсі і кількість SQL запитів по кожному маршруту ---
+
+def _count_query(execute, sql, params, many, context):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1 # Список, а не int: так інкремент видно і з потоків sync_to_async
+    return execute(sql, params, many, context)
+
+
+def _install_query_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_counter)
+
+
+def _record_request(request, response, started, queries):
+    match = getattr(request, 'resolver_match', None)
+    labels = {'view': match.view_name if match else 'unmatched', 'method': request.method,
+              'status': f'{response.status_code // 100}xx'}
+    observe('users_http_request_duration_seconds', time.perf_counter() - started, labels,
+            help='Час обробки запиту')
+    observe('users_http_request_db_queries', queries[0], {'view': labels['view']}, QUERY_BUCKETS,
+            help='SQL запитів на один HTTP запит')
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            queries = [0]
+            token = _query_count.set(queries)
+            started = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                _query_count.reset(token)
+            _record_request(request, response, started, queries)
+            return response
+    else:
+        def middleware(request):
+            queries = [0]
+            token = _query_count.set(queries)
+            started = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                _query_count.reset(token)
+            _record_request(request, response, started, queries)
+            return response
+    return middleware
+
+
+# --- Celery: затримка черги, тривалість і результат тасок ---
+
+@before_task_publish.connect
+def _stamp_enqueued_at(headers=None, **kwargs):
+    if headers is not None:
+        headers['enqueued_at'] = time.time()
+
+
+@task_prerun.connect
+def _task_started(task=None, **kwargs):
+    task.request.metrics_started = time.perf_counter()
+    enqueued_at = task.request.get('enqueued_at')
+    if enqueued_at:
+        observe('users_celery_task_queue_delay_seconds', max(0.0, time.time() - enqueued_at), {'task': task.name},
+                help='Від публікації в брокер до старту таски')
+
+
+@task_postrun.connect
+def _task_finished(task=None, state=None, **kwargs):
+    started = getattr(task.request, 'metrics_started', None)
+    if started is not None:
+        observe('users_celery_task_duration_seconds', time.perf_counter() - started, {'task': task.name},
+                help='Тривалість виконання таски')
+    inc('users_celery_tasks_total', {'task': task.name, 'state': state or 'UNKNOWN'},
+        help='Виконані таски за станом (SUCCESS / FAILURE / RETRY)')
+
+
+def _remove_on_exit(**kwargs):
+    global _heartbeat_pid
+    _heartbeat_pid = None
+    try:
+        os.remove(_path())
+    except OSError:
+        pass
+
+
+atexit.register(_remove_on_exit)
+worker_process_shutdown.connect(_remove_on_exit)
+
+
+# --- Статистика підсистем, що вже рахується в процесі ---
+
+def _collect_hashers():
+    from . import hashers
+
+    stats = hashers.stats()
+    yield 'users_password_hash_pending', 'gauge', None, stats['pending']
+    yield 'users_password_hash_completed', 'counter', None, stats['completed']
+    yield 'users_password_hash_wait_ms_total', 'counter', None, stats['total_ms'] - stats['compute_ms']
+    yield 'users_password_hash_compute_ms_total', 'counter', None, stats['compute_ms']
+
+
+def _collect_fragments():
+    from . import fragments
+
+    stats = fragments.stats()
+    for result in ('hits', 'misses', 'bypassed'):
+        yield 'users_fragment_cache_total', 'counter', {'result': result}, stats[result]
+
+
+def _collect_debounce():
+    from . import debounce
+
+    for task, suppressed in debounce.stats().items():
+        yield 'users_debounce_suppressed_total', 'counter', {'task': task}, suppressed
+
+
+def _collect_smtp_pool():
+    from . import smtp_pool
+
+    for server, stats in smtp_pool.stats().items():
+        yield 'users_smtp_pool_connections_total', 'counter', {'server': server}, stats['connects']
+        yield 'users_smtp_pool_reconnects_total', 'counter', {'server': server}, stats['reconnects']
+        yield 'users_smtp_pool_in_use', 'gauge', {'server': server}, stats['in_use']
+        yield 'users_smtp_pool_idle', 'gauge', {'server': server}, stats['idle']
+
+
+def _collect_sessions():
+    from . import sessions
+
+    stats = sessions.stats()
+    yield 'users_session_writes_total', 'counter', {'result': 'written'}, stats['writes']
+    yield 'users_session_writes_total', 'counter', {'result': 'skipped'}, stats['skipped_writes']
+    yield 'users_session_activity_updates_total', 'counter', None, stats['activity_updates']
+
+
+register_collector(_collect_hashers)
+register_collector(_collect_sessions)
+register_collector(_collect_smtp_pool)
+register_collector(_collect_fragments)
+register_collector(_collect_debounce, shared=True)
@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Назва')),
+                ('audience', models.CharField(choices=[('marketing_consent1', 'Розсилка пропозицій'), ('marketing_consent2', 'Персоналізована розсилка пропозицій')], max_length=50, verbose_name='Аудиторія')),
+                ('subject', models.CharField(max_length=255, verbose_name='Тема листа')),
+                ('body', models.TextField(verbose_name='Текст листа')),
+                ('status', models.CharField(choices=[('draft', 'Чернетка'), ('running', 'Відправляється'), ('paused', 'На паузі'), ('finished', 'Завершена')], default='draft', max_length=20)),
+                ('rate_per_minute', models.PositiveIntegerField(default=600, verbose_name='Листів за хвилину')),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('scheduled_count', models.PositiveIntegerField(default=0)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CampaignDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В черзі'), ('sending', 'Відправляється'), ('sent', 'Відправлено'), ('failed', 'Помилка'), ('skipped', 'Пропущено')], default='pending', max_length=20)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='users.campaign')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='campaign_deliveries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['campaign', 'status', 'id'], name='users_campdeliv_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('campaign', 'user'), name='users_campaigndelivery_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:19
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+# Часткові індекси під аудиторії розсилок і UniqueConstraint(Lower('email')).
+# На Postgres будуються CONCURRENTLY (як 0009 / 0010), щоб не блокувати запис в users_customuser,
+# на інших БД - звичайними операціями schema_editor. Стан моделі - ті самі AddIndex / AddConstraint
+INDEXES = [
+    models.Index(condition=models.Q(('marketing_consent1', True)), fields=['id'], name='users_cu_consent1_idx'),
+    models.Index(condition=models.Q(('marketing_consent2', True)), fields=['id'], name='users_cu_consent2_idx'),
+    models.Index(condition=models.Q(('email_confirmed', False)), fields=['id'], name='users_cu_unconfirmed_idx'),
+]
+EMAIL_CI_UNIQ = models.UniqueConstraint(Lower('email'), name='users_customuser_email_ci_uniq')
+
+PG_INDEXES = [
+    ('users_cu_consent1_idx', '(id) WHERE marketing_consent1'),
+    ('users_cu_consent2_idx', '(id) WHERE marketing_consent2'),
+    ('users_cu_unconfirmed_idx', '(id) WHERE NOT email_confirmed'),
+]
+
+
+def check_duplicate_emails(apps, schema_editor):
+    # Поле email унікальне тільки з урахуванням регістру, а normalize_email переводить в нижній регістр
+    # тільки домен - Ivan@x.com і ivan@x.com могли зареєструватись обидва. Унікальний індекс на таких
+    # даних впаде посеред деплою, тому зупиняємось заздалегідь зі списком акаунтів для злиття
+    CustomUser = apps.get_model('users', 'CustomUser')
+    duplicates = list(
+        CustomUser.objects.annotate(email_ci=Lower('email')).values('email_ci')
+        .annotate(count=Count('id')).filter(count__gt=1).order_by('email_ci').values_list('email_ci', flat=True)
+    )
+    if not duplicates:
+        return
+    accounts = (CustomUser.objects.annotate(email_ci=Lower('email')).filter(email_ci__in=duplicates[:50])
+                .order_by('email_ci', 'id').values_list('id', 'email'))
+    raise RuntimeError(
+        f'{len(duplicates)} emails differ only by case, merge or rename these accounts '
+        f'before users_customuser_email_ci_uniq can be built:\n'
+        + '\n'.join(f'  id={user_id} {email}' for user_id, email in accounts)
+    )
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        CustomUser = apps.get_model('users', 'CustomUser')
+        for index in INDEXES:
+            schema_editor.add_index(CustomUser, index)
+        schema_editor.add_constraint(CustomUser, EMAIL_CI_UNIQ)
+        return
+    for name, definition in PG_INDEXES:
+        # CONCURRENTLY не блокує запис в таблицю користувачів, поки індекс будується
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON users_customuser {definition}')
+    # Невдала CONCURRENTLY збірка залишає INVALID індекс, який IF NOT EXISTS пропустив би, а унікальність
+    # він не гарантує. Тому унікальний індекс завжди будуємо заново
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {EMAIL_CI_UNIQ.name}')
+    schema_editor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY {EMAIL_CI_UNIQ.name} ON users_customuser ((lower(email)))')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        CustomUser = apps.get_model('users', 'CustomUser')
+        schema_editor.remove_constraint(CustomUser, EMAIL_CI_UNIQ)
+        for index in INDEXES:
+            schema_editor.remove_index(CustomUser, index)
+        return
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {EMAIL_CI_UNIQ.name}')
+    for name, definition in PG_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False # CREATE INDEX CONCURRENTLY не можна виконувати в транзакції
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0004_campaigns'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_indexes, drop_indexes)],
+            state_operations=[
+                *[migrations.AddIndex(model_name='customuser', index=index) for index in INDEXES],
+                migrations.AddConstraint(model_name='customuser', constraint=EMAIL_CI_UNIQ),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_email_ci_and_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskResult',
+            fields=[
+                ('task_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('status', models.CharField(max_length=50)),
+                ('result', models.JSONField(null=True)),
+                ('traceback', models.TextField(null=True)),
+                ('date_done', models.DateTimeField(null=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
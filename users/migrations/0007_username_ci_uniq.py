@@ -0,0 +1,63 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:33
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+# UniqueConstraint(Lower('username')). Як і в 0005: на Postgres унікальний індекс будується CONCURRENTLY,
+# щоб не блокувати запис в users_customuser, на інших БД - звичайним add_constraint
+USERNAME_CI_UNIQ = models.UniqueConstraint(Lower('username'), name='users_customuser_username_ci_uniq')
+
+
+def check_duplicate_usernames(apps, schema_editor):
+    # Поле username було унікальним тільки з урахуванням регістру (Ivan і ivan). Зупиняємось до побудови
+    # індексу зі списком акаунтів, які треба перейменувати, а не падаємо посеред деплою
+    CustomUser = apps.get_model('users', 'CustomUser')
+    duplicates = list(
+        CustomUser.objects.annotate(username_ci=Lower('username')).values('username_ci')
+        .annotate(count=Count('id')).filter(count__gt=1).order_by('username_ci').values_list('username_ci', flat=True)
+    )
+    if not duplicates:
+        return
+    accounts = (CustomUser.objects.annotate(username_ci=Lower('username')).filter(username_ci__in=duplicates[:50])
+                .order_by('username_ci', 'id').values_list('id', 'username'))
+    raise RuntimeError(
+        f'{len(duplicates)} usernames differ only by case, rename these accounts '
+        f'before users_customuser_username_ci_uniq can be built:\n'
+        + '\n'.join(f'  id={user_id} {username}' for user_id, username in accounts)
+    )
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.add_constraint(apps.get_model('users', 'CustomUser'), USERNAME_CI_UNIQ)
+        return
+    # Невдала CONCURRENTLY збірка залишає INVALID індекс, тому будуємо заново, а не IF NOT EXISTS
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {USERNAME_CI_UNIQ.name}')
+    schema_editor.execute(
+        f'CREATE UNIQUE INDEX CONCURRENTLY {USERNAME_CI_UNIQ.name} ON users_customuser ((lower(username)))'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.remove_constraint(apps.get_model('users', 'CustomUser'), USERNAME_CI_UNIQ)
+        return
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {USERNAME_CI_UNIQ.name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False # CREATE INDEX CONCURRENTLY не можна виконувати в транзакції
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0006_task_results'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_usernames, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_index, drop_index)],
+            state_operations=[migrations.AddConstraint(model_name='customuser', constraint=USERNAME_CI_UNIQ)],
+        ),
+    ]
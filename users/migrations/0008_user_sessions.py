@@ -0,0 +1,54 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:35
+
+from django.core import signing
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_live_sessions(apps, schema_editor):
+    # Переносимо ще живі сесії з django_session, щоб після деплою нікого не розлогінило.
+    # Сіль та сама ('django.contrib.sessions.SessionStore'), тому session_data копіюється як є
+    Session = apps.get_model('sessions', 'Session')
+    UserSession = apps.get_model('users', 'UserSession')
+    sessions = Session.objects.filter(expire_date__gte=timezone.now()).order_by('session_key')
+    batch = []
+    for session in sessions.iterator(chunk_size=2000):
+        try:
+            data = signing.loads(session.session_data, salt='django.contrib.sessions.SessionStore',
+                                 serializer=signing.JSONSerializer)
+            user_id = int(data['_auth_user_id']) if data.get('_auth_user_id') else None
+        except (signing.BadSignature, ValueError):
+            continue # Зіпсована або підписана старим SECRET_KEY, все одно не прочиталась би
+        batch.append(UserSession(session_key=session.session_key, session_data=session.session_data,
+                                 expire_date=session.expire_date, user_id=user_id))
+        if len(batch) >= 2000:
+            UserSession.objects.bulk_create(batch)
+            batch = []
+    UserSession.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sessions', '0001_initial'),
+        ('users', '0007_username_ci_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSession',
+            fields=[
+                ('session_key', models.CharField(max_length=40, primary_key=True, serialize=False, verbose_name='session key')),
+                ('session_data', models.TextField(verbose_name='session data')),
+                ('expire_date', models.DateTimeField(db_index=True, verbose_name='expire date')),
+                ('user_id', models.BigIntegerField(db_index=True, null=True)),
+                ('last_activity', models.DateTimeField(null=True)),
+            ],
+            options={
+                'verbose_name': 'session',
+                'verbose_name_plural': 'sessions',
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(copy_live_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:40
+
+from django.db import migrations
+
+# Індекси під пошук адмінки за префіксом (users/changelist.py: lower(поле) LIKE 'term%').
+# text_pattern_ops потрібен, бо звичайний btree індекс з не-C collation не підходить для LIKE.
+# Тільки для Postgres (opclass і CONCURRENTLY), на SQLite пропускаємо
+SEARCH_INDEXES = [
+    ('users_cu_email_prefix_idx', 'email'),
+    ('users_cu_username_prefix_idx', 'username'),
+    ('users_cu_first_name_prefix_idx', 'first_name'),
+    ('users_cu_last_name_prefix_idx', 'last_name'),
+    ('users_cu_city_prefix_idx', 'city'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, column in SEARCH_INDEXES:
+        # CONCURRENTLY не блокує запис в таблицю користувачів, поки індекс будується
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON users_customuser (lower({column}) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, column in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False # CREATE INDEX CONCURRENTLY не можна виконувати в транзакції
+
+    dependencies = [
+        ('users', '0008_user_sessions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:55
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# GIN індекси pg_trgm під пошук користувачів (users/search.py, оператор %> по кожному полю).
+# TrigramExtension сама пропускає не-Postgres БД, індекси - теж тільки для Postgres
+SEARCH_FIELDS = ['first_name', 'last_name', 'username', 'email', 'city', 'phone']
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        # CONCURRENTLY не блокує запис в таблицю користувачів, поки індекс будується
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS users_cu_{field}_trgm_idx '
+            f'ON users_customuser USING gin ({field} gin_trgm_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS users_cu_{field}_trgm_idx')
+
+
+class Migration(migrations.Migration):
+    atomic = False # CREATE INDEX CONCURRENTLY не можна виконувати в транзакції
+
+    dependencies = [
+        ('users', '0009_admin_search_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
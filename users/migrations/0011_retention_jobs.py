@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_user_search_trgm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Назва')),
+                ('action', models.CharField(choices=[('anonymize', 'Анонімізувати'), ('purge', 'Видалити')], max_length=20, verbose_name='Дія')),
+                ('filters', models.JSONField(blank=True, default=dict, verbose_name='Фільтри')),
+                ('status', models.CharField(choices=[('draft', 'Чернетка'), ('running', 'Виконується'), ('paused', 'На паузі'), ('finished', 'Завершено'), ('failed', 'Помилка')], default='draft', max_length=20)),
+                ('chunk_size', models.PositiveIntegerField(default=500, verbose_name='Користувачів за пачку')),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('processed_count', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
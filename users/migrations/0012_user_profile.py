@@ -0,0 +1,85 @@
+# Generated by Django 6.0.1 on 2026-10-18 07:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+PROFILE_FIELDS = ['phone', 'address1', 'address2', 'city', 'country', 'province', 'postal_code']
+
+
+def copy_profiles(apps, schema_editor):
+    # Один INSERT ... SELECT на стороні БД, без проходу по рядках в Python.
+    # Профіль отримують тільки користувачі, у яких заповнене хоч одне поле
+    columns = ', '.join(PROFILE_FIELDS)
+    filled = ' OR '.join(f"COALESCE({field}, '') <> ''" for field in PROFILE_FIELDS)
+    schema_editor.execute(
+        f'INSERT INTO users_userprofile (user_id, {columns}) SELECT id, {columns} FROM users_customuser WHERE {filled}'
+    )
+
+
+def restore_columns(apps, schema_editor):
+    assignments = ', '.join(
+        f'{field} = (SELECT p.{field} FROM users_userprofile p WHERE p.user_id = users_customuser.id)'
+        for field in PROFILE_FIELDS
+    )
+    schema_editor.execute(
+        f'UPDATE users_customuser SET {assignments} WHERE id IN (SELECT user_id FROM users_userprofile)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_retention_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='profile', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('phone', models.CharField(blank=True, max_length=15, null=True, verbose_name='Номер телефону')),
+                ('address1', models.CharField(blank=True, max_length=255, null=True, verbose_name='Адреса')),
+                ('address2', models.CharField(blank=True, max_length=255, null=True, verbose_name='Вулиця')),
+                ('city', models.CharField(blank=True, max_length=255, null=True, verbose_name='Місто')),
+                ('country', models.CharField(blank=True, max_length=150, null=True, verbose_name='Країна')),
+                ('province', models.CharField(blank=True, max_length=255, null=True, verbose_name='Область')),
+                ('postal_code', models.CharField(blank=True, max_length=15, null=True, verbose_name='Поштовий код')),
+            ],
+        ),
+        migrations.RunPython(copy_profiles, restore_columns),
+        # Колонки (і індекси 0009 / 0010 на city, phone) видаляються з users_customuser, нові індекси - в 0013
+        migrations.RemoveField(
+            model_name='customuser',
+            name='address1',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='address2',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='city',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='country',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='phone',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='postal_code',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='province',
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='profile_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
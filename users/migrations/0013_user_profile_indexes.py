@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:05
+
+from django.db import migrations
+
+# Індекси пошуку по полях, що переїхали в users_userprofile (ті самі, що 0009 / 0010 мали на users_customuser):
+# префікс lower(city) для адмінки (users/changelist.py) і pg_trgm для users/search.py. Тільки для Postgres
+INDEXES = [
+    ('users_up_city_prefix_idx', '(lower(city) text_pattern_ops)'),
+    ('users_up_city_trgm_idx', 'USING gin (city gin_trgm_ops)'),
+    ('users_up_phone_trgm_idx', 'USING gin (phone gin_trgm_ops)'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in INDEXES:
+        # CONCURRENTLY не блокує запис в таблицю профілів, поки індекс будується
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON users_userprofile {definition}')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False # CREATE INDEX CONCURRENTLY не можна виконувати в транзакції
+
+    dependencies = [
+        ('users', '0012_user_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
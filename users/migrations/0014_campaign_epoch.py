@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_user_profile_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='epoch',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_campaign_epoch'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='customuser',
+            options={'permissions': [('export_customuser', 'Може вивантажувати користувачів')], 'verbose_name': 'user', 'verbose_name_plural': 'users'},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_customuser_export_permission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='retentionjob',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
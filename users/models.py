@@ -1,6 +1,68 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.utils.html import strip_tags
+from django.contrib.sessions.base_session import AbstractBaseSession
+from django.utils import timezone
+from django.core.exceptions import FieldError, ValidationError
+
+from .sanitize import sanitize_instance
+
+# Поля профілю, які раніше були колонками users_customuser
+PROFILE_FIELDS = ['phone', 'address1', 'address2', 'city', 'country', 'province', 'postal_code']
+
+
+class UserProfile(models.Model):
+    # Телефон і адреса окремою таблицею один-до-одного. AuthenticationMiddleware на кожен запит
+    # читає (і кешує, user_cache.py) рядок CustomUser, а ці поля потрібні тільки сторінкам профілю,
+    # тому вони вантажаться окремим запитом лише там, де до них звертаються (CustomUser.get_profile).
+    # Рядок створюється при першому збереженні непорожніх даних, у більшості користувачів його немає
+    user = models.OneToOneField('CustomUser', on_delete=models.CASCADE, primary_key=True, related_name='profile')
+    phone = models.CharField(verbose_name='Номер телефону', max_length=15, blank=True, null=True)
+
+    address1 = models.CharField(verbose_name='Адреса', max_length=255, blank=True, null=True) #  null=True щоб в БД була пуста клітинка
+    address2 = models.CharField(verbose_name='Вулиця', max_length=255, blank=True, null=True) #  null=True щоб в БД була пуста клітинка
+    city = models.CharField(verbose_name='Місто', max_length=255, blank=True, null=True)
+    country = models.CharField(verbose_name='Країна', max_length=150, blank=True, null=True)
+    province = models.CharField(verbose_name='Область', max_length=255, blank=True, null=True)
+    postal_code = models.CharField(verbose_name='Поштовий код', max_length=15, blank=True, null=True)
+
+    def __str__(self):
+        return f'Профіль {self.user_id}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._remember()
+
+    def _remember(self):
+        # Значення як в БД. Відкладені (only()) поля в __dict__ немає - їх ніхто і не міняв
+        self._loaded = {field: self.__dict__[field] for field in PROFILE_FIELDS if field in self.__dict__}
+
+    def changed_fields(self, fields=PROFILE_FIELDS):
+        loaded = getattr(self, '_loaded', {})
+        return [field for field in fields
+                if field in self.__dict__ and (field not in loaded or loaded[field] != self.__dict__[field])]
+
+    def is_empty(self):
+        return not any(getattr(self, field) for field in PROFILE_FIELDS)
+
+
+def _profile_attribute(name):
+    # property, а не власний дескриптор: CustomUser(city=...) в конструкторі приймає тільки поля і property
+    def getter(self):
+        return getattr(self.get_profile(), name)
+
+    def setter(self, value):
+        setattr(self.get_profile(), name, value)
+
+    getter.short_description = UserProfile._meta.get_field(name).verbose_name # Заголовок колонки в адмінці
+    return property(getter, setter)
+
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, first_name, last_name, username, password=None, **extra_fields): # Поля які будемо використовувати для реєстрації
@@ -30,24 +92,40 @@ class CustomUserManager(BaseUserManager):
             username = email.split('@')[0]
         return self.create_user(email, first_name, username, last_name, password, **extra_fields)
 
+    def filter_by_email(self, email):
+        # Email порівнюємо без урахування регістру. Саме вираз lower(email) покритий унікальним індексом
+        # users_customuser_email_ci_uniq, тому запит йде по індексу, а не скануванням
+        return self.alias(email_lower=Lower('email')).filter(email_lower=email.lower())
+
+    def get_by_natural_key(self, username):
+        # Логін по email: Test@Mail.com і test@mail.com - один і той самий користувач
+        return self.filter_by_email(username).get()
+
+    async def aget_by_natural_key(self, username):
+        return await self.filter_by_email(username).aget()
+
 
 class CustomUser(AbstractUser):
     email = models.EmailField(unique=True, verbose_name='Email', max_length=100)
     first_name = models.CharField(verbose_name='Ім`я', max_length=100)
     last_name = models.CharField(verbose_name='Прізвище', max_length=100)
     username = models.CharField(verbose_name='Нікнейм', max_length=150, unique=True)
-    phone = models.CharField(verbose_name='Номер телефону', max_length=15, blank=True, null=True)
-
-    address1 = models.CharField(verbose_name='Адреса', max_length=255, blank=True, null=True) #  null=True щоб в БД була пуста клітинка
-    address2 = models.CharField(verbose_name='Вулиця', max_length=255, blank=True, null=True) #  null=True щоб в БД була пуста клітинка
-    city = models.CharField(verbose_name='Місто', max_length=255, blank=True, null=True)
-    country = models.CharField(verbose_name='Країна', max_length=150, blank=True, null=True)
-    province = models.CharField(verbose_name='Область', max_length=255, blank=True, null=True)
-    postal_code = models.CharField(verbose_name='Поштовий код', max_length=15, blank=True, null=True)
+    # Телефон і адреса - в UserProfile, тут тільки атрибути-проксі (user.city читає / пише профіль)
+    phone = _profile_attribute('phone')
+    address1 = _profile_attribute('address1')
+    address2 = _profile_attribute('address2')
+    city = _profile_attribute('city')
+    country = _profile_attribute('country')
+    province = _profile_attribute('province')
+    postal_code = _profile_attribute('postal_code')
+    # Згоди лишаються в рядку користувача: по них розсилки сканують таблицю частковими індексами (campaigns.py)
     marketing_consent1 = models.BooleanField(default=False) # Розсилка на рекламу
     marketing_consent2 = models.BooleanField(default=False)
 
     email_confirmed = models.BooleanField(default=False)
+    # Час останньої зміни профілю. Пишеться тим самим UPDATE, що й користувач, і входить у версію рядка,
+    # від якої залежить ключ кешу фрагментів (fragments.row_version) - інакше зміна лише адреси їх не скинула б
+    profile_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     """
      За замовчуванням якщо ми навіть створимо модель, Джанго потребуватиме нікнейм для реєстрації 
@@ -59,17 +137,230 @@ class CustomUser(AbstractUser):
     USERNAME_FIELD = 'email' # Необхідно взяти юзернейм і помііняти на емейл, Щоб джанго в своїй моделі замінив юзернейм на емейл який нам необхіно використати
     REQUIRED_FIELDS = ['first_name', 'last_name'] # Посторонні поля які будуть використовувати для реєстрації (Ми їх хлчемо бачити в реєстрації)
 
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Унікальність email без урахування регістру (і індекс для filter_by_email)
+            models.UniqueConstraint(Lower('email'), name='users_customuser_email_ci_uniq'),
+            # Тег теж без урахування регістру. Реєстрація не перевіряє його запитом, а ловить IntegrityError
+            models.UniqueConstraint(Lower('username'), name='users_customuser_username_ci_uniq'),
+        ]
+        indexes = [
+            # Часткові індекси під keyset скани розсилок (campaigns.py) і непідтверджених користувачів
+            models.Index(fields=['id'], condition=models.Q(marketing_consent1=True), name='users_cu_consent1_idx'),
+            models.Index(fields=['id'], condition=models.Q(marketing_consent2=True), name='users_cu_consent2_idx'),
+            models.Index(fields=['id'], condition=models.Q(email_confirmed=False), name='users_cu_unconfirmed_idx'),
+        ]
+        permissions = [
+            ('export_customuser', 'Може вивантажувати користувачів'), # Всі персональні дані одним файлом (/users/export/)
+        ]
+
     def __str__(self):
         return self.email
 
+    def get_profile(self):
+        # Профіль вантажиться одним запитом при першому зверненні і далі береться з кешу об'єкта.
+        # Якщо рядка ще немає - порожній профіль в пам'яті, в БД він потрапить тільки з даними (save())
+        try:
+            return self.profile
+        except UserProfile.DoesNotExist:
+            self.profile = UserProfile(user=self)
+            return self.profile
+
+    async def aget_profile(self):
+        # В async представленнях лінивий запит з шаблону дав би SynchronousOnlyOperation, вантажимо заздалегідь
+        if not CustomUser.profile.is_cached(self):
+            profile = await UserProfile.objects.filter(user_id=self.pk).afirst() if self.pk else None
+            self.profile = profile or UserProfile(user=self)
+        return self.profile
+
+    def save(self, **kwargs):
+        # update_fields може містити поля профілю (save(update_fields=['city'])) - їх пишемо в UserProfile
+        update_fields = kwargs.get('update_fields')
+        profile_fields = None
+        if update_fields is not None:
+            profile_fields = [field for field in update_fields if field in PROFILE_FIELDS]
+            update_fields = [field for field in update_fields if field not in PROFILE_FIELDS]
+        profile, profile_fields = self._profile_to_save(profile_fields)
+        if profile is not None:
+            # Версія рядка для кешу фрагментів (fragments.py) - тільки якщо дані профілю справді змінились
+            self.profile_updated_at = timezone.now()
+            if update_fields is not None:
+                update_fields.append('profile_updated_at')
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        super().save(**kwargs)
+        if profile is None:
+            return
+        if profile._state.adding:
+            profile.save(force_insert=True) # Без пробного UPDATE. user_id візьметься з щойно збереженого користувача
+        else:
+            profile.save(update_fields=profile_fields) # Тільки змінені колонки
+
+    def _profile_to_save(self, update_fields):
+        # (профіль, поля для UPDATE) або (None, None), якщо писати в профіль нічого
+        if update_fields == [] or not CustomUser.profile.is_cached(self):
+            return None, None # Профіль не чіпали - зайвого запиту немає
+        profile = self.get_profile() # Вже в кеші об'єкта, без запиту
+        if profile._state.adding:
+            return (None, None) if profile.is_empty() else (profile, None) # Порожній профіль не створюємо
+        changed = profile.changed_fields(update_fields or PROFILE_FIELDS)
+        return (profile, changed) if changed else (None, None)
+
     def clean(self):
-        # Метод clean() у моделі викликається перед збереженням об'єкта
-        for field in ['phone', 'address1', 'address2', 'city', 'country', 'province',
-                      'postal_code']:  # Проходимося по всіх полях, які можуть містити текст
-            value = getattr(self, field)
-            # Отримуємо значення поля з об'єкта моделі
-            if value:
-                # Якщо поле не порожнє
-                setattr(self, field, strip_tags(value))
-                # Очищаємо значення від HTML і записуємо назад у модель
+        # Метод clean() у моделі викликається перед збереженням об'єкта.
+        # Очищаємо текстові поля від HTML і записуємо назад у модель (users/sanitize.py, те саме, що у формі й імпорті)
+        sanitize_instance(self, PROFILE_FIELDS)
+
+
+class EmailOutbox(models.Model):
+    # Черга листів. Рядок пишеться в тій самій транзакції, що й користувач (ATOMIC_REQUESTS),
+    # тому диспетчер бачить його тільки після коміту і таска не стартує раніше, ніж з'явиться юзер
+    task_name = models.CharField(max_length=255) # Повна назва celery таски, напр. users.tasks.send_welcome_email
+    args = models.JSONField(default=list) # Аргументи таски
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{self.task_name}{tuple(self.args)}'
+
+
+class Campaign(models.Model):
+    # Маркетингова розсилка по користувачах з marketing_consent1 / marketing_consent2
+    AUDIENCE_CHOICES = [
+        ('marketing_consent1', 'Розсилка пропозицій'),
+        ('marketing_consent2', 'Персоналізована розсилка пропозицій'),
+    ]
+    STATUS_DRAFT = 'draft'
+    STATUS_RUNNING = 'running'
+    STATUS_PAUSED = 'paused'
+    STATUS_FINISHED = 'finished'
+    STATUS_CHOICES = [
+        (STATUS_DRAFT, 'Чернетка'),
+        (STATUS_RUNNING, 'Відправляється'),
+        (STATUS_PAUSED, 'На паузі'),
+        (STATUS_FINISHED, 'Завершена'),
+    ]
+
+    name = models.CharField(verbose_name='Назва', max_length=255)
+    audience = models.CharField(verbose_name='Аудиторія', max_length=50, choices=AUDIENCE_CHOICES)
+    subject = models.CharField(verbose_name='Тема листа', max_length=255)
+    body = models.TextField(verbose_name='Текст листа')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_DRAFT)
+    rate_per_minute = models.PositiveIntegerField(verbose_name='Листів за хвилину', default=600) # Ліміт SMTP провайдера
+    cursor = models.BigIntegerField(default=0) # id останнього користувача, для якого вже створено доставку (keyset)
+    # Росте на кожну паузу / resume. Таски несуть epoch, з яким їх поставили, і застарілі просто виходять,
+    # інакше після resume старий ланцюжок з countdown працював би паралельно з новим і перевищував rate_per_minute
+    epoch = models.PositiveIntegerField(default=0, editable=False)
+    scheduled_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class CampaignDelivery(models.Model):
+    # Один рядок = один лист одному користувачу. unique (campaign, user) + статус не дають відправити двічі
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending' # Взято воркером. Якщо воркер впав - лист НЕ перевідправляємо
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_SKIPPED = 'skipped' # Користувач відкликав згоду до відправки
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В черзі'),
+        (STATUS_SENDING, 'Відправляється'),
+        (STATUS_SENT, 'Відправлено'),
+        (STATUS_FAILED, 'Помилка'),
+        (STATUS_SKIPPED, 'Пропущено'),
+    ]
+
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='deliveries')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='campaign_deliveries')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'user'], name='users_campaigndelivery_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['campaign', 'status', 'id'], name='users_campdeliv_status_idx'),
+        ]
+
+
+class TaskResult(models.Model):
+    # Компактний результат celery таски (users/results.py). Тільки для тасок з ignore_result=False,
+    # живе до expires_at, потім видаляється purge_task_results / celery.backend_cleanup
+    task_id = models.CharField(max_length=255, primary_key=True)
+    status = models.CharField(max_length=50)
+    result = models.JSONField(null=True)
+    traceback = models.TextField(null=True)
+    date_done = models.DateTimeField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+class RetentionJob(models.Model):
+    # Масова анонімізація / видалення акаунтів (users/retention.py). Користувачі обробляються пачками
+    # по id (keyset), кожна пачка - окрема коротка транзакція, cursor - id останнього обробленого
+    ACTION_ANONYMIZE = 'anonymize'
+    ACTION_PURGE = 'purge'
+    ACTION_CHOICES = [
+        (ACTION_ANONYMIZE, 'Анонімізувати'),
+        (ACTION_PURGE, 'Видалити'),
+    ]
+    STATUS_DRAFT = 'draft'
+    STATUS_RUNNING = 'running'
+    STATUS_PAUSED = 'paused'
+    STATUS_FINISHED = 'finished'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_DRAFT, 'Чернетка'),
+        (STATUS_RUNNING, 'Виконується'),
+        (STATUS_PAUSED, 'На паузі'),
+        (STATUS_FINISHED, 'Завершено'),
+        (STATUS_FAILED, 'Помилка'),
+    ]
+
+    name = models.CharField(verbose_name='Назва', max_length=255)
+    action = models.CharField(verbose_name='Дія', max_length=20, choices=ACTION_CHOICES)
+    # Умови відбору в синтаксисі filter(), напр. {"last_login__lt": "2023-01-01", "email_confirmed": false}.
+    # Персонал і суперкористувачі не обробляються ніколи
+    filters = models.JSONField(verbose_name='Фільтри', default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_DRAFT)
+    chunk_size = models.PositiveIntegerField(verbose_name='Користувачів за пачку', default=500) # Підлаштовується під RETENTION_CHUNK_SECONDS
+    cursor = models.BigIntegerField(default=0)
+    processed_count = models.PositiveIntegerField(default=0)
+    # Росте на кожен старт / паузу / resume. Таска пачки несе generation, з яким її поставили, і застаріла виходить:
+    # інакше resume в межах паузи між пачками запускав би другий ланцюжок і RETENTION_CHUNK_PAUSE не тримався б
+    generation = models.PositiveIntegerField(default=0, editable=False)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        # Без фільтрів job обробив би всіх користувачів, крім персоналу
+        if not isinstance(self.filters, dict) or not self.filters:
+            raise ValidationError({'filters': 'Вкажіть хоча б одну умову відбору.'})
+        try:
+            CustomUser.objects.filter(**self.filters)
+        except (FieldError, TypeError, ValueError, ValidationError) as e:
+            raise ValidationError({'filters': f'Невірні фільтри: {e}'})
+
+
+class UserSession(AbstractBaseSession):
+    # Сесії для users.sessions (SESSION_ENGINE). Те саме, що django_session, плюс власник сесії:
+    # по user_id можна знайти / видалити всі сесії користувача без декодування session_data
+    user_id = models.BigIntegerField(null=True, db_index=True)
+    last_activity = models.DateTimeField(null=True) # Оновлюється пачками (users/sessions.py), з точністю до кількох десятків секунд
+
+    @classmethod
+    def get_session_store_class(cls):
+        from .sessions import SessionStore
 
+        return SessionStore
@@ -0,0 +1,79 @@
+# Transactional outbox для листів.
+# Замість .delay() прямо в запиті (похід в Redis на кожну реєстрацію) пишемо рядок в EmailOutbox
+# в тій самій транзакції, а диспетчер пачками передає закомічені рядки в celery
+from celery import current_app, group, signature
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+from . import debounce, metrics
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(task, *args, debounce_key=None):
+    # task - celery таска (send_welcome_email, ...), args - ті самі аргументи що й для .delay().
+    # debounce_key (id користувача) - повтор тієї ж таски в межах TASK_DEBOUNCE_WINDOWS відкидається, повертаємо None
+    if debounce_key is None:
+        return EmailOutbox.objects.create(task_name=task.name, args=list(args))
+    if not debounce.acquire(task.name, debounce_key):
+        return None
+    try:
+        row = EmailOutbox.objects.create(task_name=task.name, args=list(args))
+    except Exception:
+        debounce.release(task.name, debounce_key) # Лист не записали - вікно не займаємо
+        raise
+    debounce.release_on_rollback(task.name, debounce_key)
+    return row
+
+
+async def aenqueue_email(task, *args, debounce_key=None):
+    # Те саме для async представлень
+    if debounce_key is None:
+        return await EmailOutbox.objects.acreate(task_name=task.name, args=list(args))
+    if not await debounce.aacquire(task.name, debounce_key):
+        return None
+    try:
+        return await EmailOutbox.objects.acreate(task_name=task.name, args=list(args)) # Async представлення без транзакції
+    except Exception:
+        await debounce.arelease(task.name, debounce_key)
+        raise
+
+
+def dispatch_batch(batch_size=None):
+    # Забираємо одну пачку рядків і відправляємо в брокер одним продюсером.
+    # skip_locked дозволяє запускати кілька диспетчерів паралельно, вони не беруть ті самі рядки
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        rows = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        # Один group = одне з'єднання з брокером на всю пачку
+        group(signature(row.task_name, args=row.args, app=current_app) for row in rows).apply_async()
+        # Якщо публікація впала, транзакція відкотиться і рядки залишаться на наступний прохід
+        EmailOutbox.objects.filter(id__in=[row.id for row in rows]).delete()
+
+    now = timezone.now()
+    for row in rows:
+        metrics.observe('users_outbox_dispatch_delay_seconds', (now - row.created_at).total_seconds(),
+                        {'task': row.task_name}, help='Від запису в outbox до публікації в брокер')
+
+    logger.info(f'Email outbox: dispatched {len(rows)} tasks')
+    return len(rows)
+
+
+def dispatch_pending(batch_size=None, max_batches=None):
+    # Вигрібаємо чергу поки вона не порожня (або поки не дійдемо до ліміту пачок)
+    max_batches = max_batches or settings.EMAIL_OUTBOX_MAX_BATCHES
+    total = 0
+    for _ in range(max_batches):
+        dispatched = dispatch_batch(batch_size)
+        total += dispatched
+        if not dispatched:
+            break
+    return total
@@ -0,0 +1,242 @@
+# Token bucket обмеження для логіну, реєстрації і скидання пароля.
+# Без нього хвиля credential stuffing одразу перетворювалась на PBKDF2 в пулі хешування і SMTP листи.
+# Ліміт перевіряється до форми і до транзакції запиту, тому відкинутий запит коштує один похід в Redis
+# і дешеву 429 відповідь, без жодного запиту в БД.
+# Ліміти по кожному представленню - settings.RATELIMITS, ключі:
+#   'ip'          - адреса клієнта
+#   'post:<поле>' - значення поля форми (email), без урахування регістру
+import functools
+import hashlib
+import ipaddress
+import logging
+import threading
+import time
+import weakref
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Поповнення і списання токена атомарно в Redis. Час беремо з Redis, а не з годинника веб-сервера,
+# щоб кілька серверів з різним часом рахували одне відро однаково
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+def parse_rate(rate):
+    # '5/m' -> (5 токенів в відрі, поповнення 5 / 60 токена за секунду)
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period]
+
+
+class LocalTokenBucket:
+    # Відра в пам'яті процесу. Для тестів і одного процесу, між gunicorn воркерами ліміт не спільний
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / rate
+            if len(self._buckets) > settings.RATELIMIT_LOCAL_MAX_KEYS:
+                self._prune(now)
+        return allowed, retry_after
+
+    async def ahit(self, key, capacity, rate):
+        return self.hit(key, capacity, rate) # Без I/O, цикл подій не блокується
+
+    def _prune(self, now):
+        # Відро, що за цей час вже б наповнилось, нічим не відрізняється від відсутнього
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if now - updated > 3600:
+                del self._buckets[key]
+
+
+class RedisTokenBucket:
+    # Спільні відра для всіх процесів і серверів
+    def __init__(self):
+        import redis
+        import redis.asyncio
+
+        self._client = redis.Redis.from_url(settings.RATELIMIT_REDIS_URL, socket_timeout=0.1)
+        self._script = self._client.register_script(TOKEN_BUCKET_LUA)
+        self._async_clients = weakref.WeakKeyDictionary() # redis.asyncio клієнт прив'язаний до циклу подій
+        self._async_lock = threading.Lock()
+
+    def hit(self, key, capacity, rate):
+        allowed, retry_after = self._script(keys=[key], args=[capacity, rate])
+        return bool(allowed), float(retry_after)
+
+    async def ahit(self, key, capacity, rate):
+        import asyncio
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            if loop not in self._async_clients:
+                client = redis.asyncio.Redis.from_url(settings.RATELIMIT_REDIS_URL, socket_timeout=0.1)
+                self._async_clients[loop] = client.register_script(TOKEN_BUCKET_LUA)
+            script = self._async_clients[loop]
+        allowed, retry_after = await script(keys=[key], args=[capacity, rate])
+        return bool(allowed), float(retry_after)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.RATELIMIT_BACKEND)()
+    return _backend
+
+
+@functools.lru_cache(maxsize=1)
+def _trusted_networks(proxies):
+    return [ipaddress.ip_network(proxy, strict=False) for proxy in proxies]
+
+
+def _is_trusted(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _trusted_networks(tuple(settings.RATELIMIT_TRUSTED_PROXIES)))
+
+
+def client_ip(request):
+    remote_addr = request.META.get('REMOTE_ADDR', '')
+    if not settings.RATELIMIT_IP_HEADER or not _is_trusted(remote_addr):
+        return remote_addr # Заголовок від будь-кого, крім нашого проксі, - підробка
+    # Ліві адреси X-Forwarded-For пише сам клієнт, тому їм не віримо. Йдемо справа, пропускаючи наші проксі:
+    # перша чужа адреса - та, з якої до нас прийшов запит
+    forwarded = request.META.get(settings.RATELIMIT_IP_HEADER, '')
+    for address in reversed(forwarded.split(',')):
+        address = address.strip()
+        if not _is_trusted(address):
+            try:
+                return str(ipaddress.ip_address(address))
+            except ValueError:
+                break # Сміття в заголовку - рахуємо по самому проксі
+    return remote_addr
+
+
+def _keys(scope, request):
+    # Повертає (ключ в Redis, ліміт) для кожного правила, значення яких є в запиті
+    for key_type, rate in settings.RATELIMITS.get(scope, []):
+        if key_type == 'ip':
+            value = client_ip(request)
+        elif key_type.startswith('post:'):
+            value = request.POST.get(key_type[5:], '').strip().lower()
+        else:
+            raise ValueError(f'Unknown rate limit key {key_type}')
+        if value:
+            digest = hashlib.md5(value.encode()).hexdigest() # Email в ключах Redis не зберігаємо
+            yield f'rl:{scope}:{key_type}:{digest}', parse_rate(rate)
+
+
+def _too_many_requests(scope, retry_after):
+    logger.warning(f'Rate limit hit for {scope}')
+    response = HttpResponse('Забагато спроб. Спробуйте пізніше.', status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(max(1, round(retry_after)))
+    return response
+
+
+def check(scope, request):
+    # None - запит пропускаємо, інакше 429 відповідь
+    if not settings.RATELIMIT_ENABLED or request.method != 'POST':
+        return None
+    backend = get_backend()
+    for key, (capacity, rate) in _keys(scope, request):
+        try:
+            allowed, retry_after = backend.hit(key, capacity, rate)
+        except Exception as e:
+            # Redis недоступний - краще пропустити запит, ніж покласти логін
+            logger.error(f'Rate limit backend failed: {str(e)}')
+            return None
+        if not allowed:
+            return _too_many_requests(scope, retry_after)
+    return None
+
+
+async def acheck(scope, request):
+    if not settings.RATELIMIT_ENABLED or request.method != 'POST':
+        return None
+    backend = get_backend()
+    for key, (capacity, rate) in _keys(scope, request):
+        try:
+            allowed, retry_after = await backend.ahit(key, capacity, rate)
+        except Exception as e:
+            logger.error(f'Rate limit backend failed: {str(e)}')
+            return None
+        if not allowed:
+            return _too_many_requests(scope, retry_after)
+    return None
+
+
+def ratelimit(scope):
+    # @ratelimit('login') - обмежує POST запити представлення за правилами settings.RATELIMITS['login']
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                response = await acheck(scope, request)
+                if response is not None:
+                    return response
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        # ATOMIC_REQUESTS відкрив би транзакцію (BEGIN / COMMIT) ще до перевірки ліміту.
+        # Тому транзакцію відкриваємо самі, вже після check(), а для хендлера позначаємо view як non_atomic
+        non_atomic = getattr(view, '_non_atomic_requests', set())
+        aliases = {db.alias for db in connections.all() if db.settings_dict['ATOMIC_REQUESTS'] and db.alias not in non_atomic}
+        atomic_view = view
+        for alias in aliases:
+            atomic_view = transaction.atomic(using=alias)(atomic_view)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = check(scope, request)
+            if response is not None:
+                return response
+            return atomic_view(request, *args, **kwargs)
+        wrapper._non_atomic_requests = non_atomic | aliases
+        return wrapper
+    return decorator
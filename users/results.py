@@ -0,0 +1,173 @@
+# Result backend celery замість 'django-db'.
+# django_celery_results писав рядок TaskResult (з args, kwargs, worker, ...) на кожен лист, і ніхто їх не читав.
+# Тепер листи взагалі нічого не зберігають (CELERY_TASK_IGNORE_RESULT), а таски з ignore_result=False
+# пишуть компактний рядок users.TaskResult з expires_at. Результати накопичуються в буфері процесу
+# і вставляються пачкою одним INSERT ... ON CONFLICT, а не по INSERT + SELECT на кожну таску.
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from celery import states
+from celery.backends.base import BaseBackend
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_backends = [] # Всі буфери процесу, щоб злити їх при зупинці воркера
+
+
+def purge_expired(chunk_size=None, sleep=0.0):
+    # Видаляє прострочені результати пачками по первинному ключу.
+    # Кожна пачка - окремий короткий DELETE, тому таблиця не блокується надовго
+    from .models import TaskResult
+
+    chunk_size = chunk_size or settings.TASK_RESULT_PURGE_CHUNK
+    now = timezone.now()
+    deleted = 0
+    while True:
+        task_ids = list(TaskResult.objects.filter(expires_at__lt=now).values_list('task_id', flat=True)[:chunk_size])
+        if not task_ids:
+            return deleted
+        deleted += TaskResult.objects.filter(task_id__in=task_ids).delete()[0]
+        if sleep:
+            time.sleep(sleep) # Даємо автовакууму і реплікам наздогнати
+
+
+class CompactResultBackend(BaseBackend):
+    def __init__(self, app, expires=None, **kwargs):
+        super().__init__(app, **kwargs)
+        self.expires = self.prepare_expires(expires, type=float)
+        self._buffer = {} # task_id -> TaskResult, пізніший стан тієї ж таски перезаписує ранній
+        self._buffer_since = None
+        self._lock = threading.Lock()
+        self._flusher = None
+        _backends.append(self)
+
+    def _store_result(self, task_id, result, state, traceback=None, request=None, **kwargs):
+        from .models import TaskResult
+
+        now = timezone.now()
+        row = TaskResult(
+            task_id=task_id,
+            status=state,
+            result=result, # Вже закодований encode_result(): json значення або словник винятку
+            traceback=traceback if state in states.EXCEPTION_STATES else None,
+            date_done=now if state in states.READY_STATES else None,
+            expires_at=now + timedelta(seconds=self.expires or 0),
+        )
+        with self._lock:
+            self._buffer[task_id] = row
+            if self._buffer_since is None:
+                self._buffer_since = time.monotonic()
+            full = len(self._buffer) >= settings.TASK_RESULT_BATCH_SIZE
+        if full:
+            self.flush()
+        else:
+            self._ensure_flusher()
+        return result
+
+    def _get_task_meta_for(self, task_id):
+        from .models import TaskResult
+
+        with self._lock:
+            row = self._buffer.get(task_id)
+        if row is None:
+            row = TaskResult.objects.filter(task_id=task_id, expires_at__gte=timezone.now()).first()
+        if row is None:
+            return {'task_id': task_id, 'status': states.PENDING, 'result': None}
+        return self.meta_from_decoded({
+            'task_id': row.task_id,
+            'status': row.status,
+            'result': row.result,
+            'traceback': row.traceback,
+            'children': [],
+            'date_done': row.date_done,
+        })
+
+    def _forget(self, task_id):
+        from .models import TaskResult
+
+        with self._lock:
+            self._buffer.pop(task_id, None)
+        TaskResult.objects.filter(task_id=task_id).delete()
+
+    def cleanup(self):
+        # Викликається celery.backend_cleanup з beat (раз на добу, бо CELERY_RESULT_EXPIRES задано)
+        deleted = purge_expired()
+        logger.info(f'Purged {deleted} expired task results')
+
+    def process_cleanup(self):
+        # Кінець таски в воркері: зливаємо буфер, якщо він вже достатньо старий
+        with self._lock:
+            due = self._buffer_since is not None and \
+                time.monotonic() - self._buffer_since >= settings.TASK_RESULT_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        from .models import TaskResult
+
+        with self._lock:
+            rows = list(self._buffer.values())
+            self._buffer = {}
+            self._buffer_since = None
+        if not rows:
+            return 0
+        try:
+            TaskResult.objects.bulk_create(
+                rows, batch_size=settings.TASK_RESULT_BATCH_SIZE,
+                update_conflicts=True, unique_fields=['task_id'],
+                update_fields=['status', 'result', 'traceback', 'date_done', 'expires_at'],
+            )
+        except Exception as e:
+            # Повертаємо в буфер (не затираючи новіші стани) і спробуємо при наступному flush
+            logger.error(f'Failed to store {len(rows)} task results: {str(e)}')
+            with self._lock:
+                for row in rows:
+                    self._buffer.setdefault(row.task_id, row)
+                self._buffer_since = self._buffer_since or time.monotonic()
+            raise
+        return len(rows)
+
+    def _ensure_flusher(self):
+        # Фоновий потік зливає буфер, коли воркер простоює і нових результатів немає
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, name='task-result-flusher', daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(settings.TASK_RESULT_FLUSH_INTERVAL)
+            with self._lock:
+                empty = not self._buffer
+            if empty:
+                break
+            try:
+                self.flush()
+            except Exception:
+                pass # Вже залоговано в flush(), рядки лишились в буфері
+        connection.close() # З'єднання цього потоку більше не потрібне
+        with self._lock:
+            self._flusher = None
+        if self._buffer: # Результат міг прийти між перевіркою і виходом з циклу
+            self._ensure_flusher()
+
+
+def flush_all(**kwargs):
+    for backend in _backends:
+        try:
+            backend.flush()
+        except Exception:
+            pass
+
+
+atexit.register(flush_all)
+worker_process_shutdown.connect(flush_all) # prefork діти виходять через os._exit, atexit там не спрацює
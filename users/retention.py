@@ -0,0 +1,178 @@
+# Масова анонімізація і видалення акаунтів (RetentionJob).
+# Замість однієї великої транзакції, що тримає блокування на тисячах рядків users_customuser і зупиняє логіни,
+# кожна пачка користувачів (id > cursor) обробляється окремою короткою транзакцією в celery таске,
+# а наступна пачка ставиться з паузою RETENTION_CHUNK_PAUSE. Курсор комітиться разом з пачкою,
+# тому після падіння воркера / паузи job продовжується рівно з того ж місця.
+# Розмір пачки підлаштовується: якщо пачка тримала транзакцію довше RETENTION_CHUNK_SECONDS - зменшуємо.
+# На Postgres ще й lock_timeout: якщо рядок заблокований запитом користувача, поступаємось і пробуємо пізніше.
+# Так само, якщо рядок самого job зайнятий (форма адмінки в ATOMIC_REQUESTS): пачку відкладаємо, ланцюжок не рветься.
+# Старт / пауза / resume збільшують RetentionJob.generation, тож після resume працює рівно один ланцюжок пачок
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, transaction
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast, Concat
+from django.utils import timezone
+
+from . import results, sessions, user_cache
+from .models import CampaignDelivery, CustomUser, RetentionJob, UserProfile
+
+logger = logging.getLogger(__name__)
+
+ANONYMIZED_DOMAIN = 'anonymized.invalid' # .invalid ніколи не резолвиться, листи туди не підуть
+LOCK_NOT_AVAILABLE = '55P03' # SQLSTATE і lock_timeout, і NOWAIT
+
+
+def audience(job):
+    # FieldError / ValidationError з невірних фільтрів зупиняє job зі статусом failed
+    if not job.filters:
+        raise ValidationError('Retention job without filters would match every user')
+    return CustomUser.objects.filter(**job.filters).exclude(is_staff=True).exclude(is_superuser=True)
+
+
+def anonymize(user_ids):
+    # Один UPDATE на пачку. email / username мають бути унікальними, тому будуємо їх з id
+    suffix = Cast('id', CharField())
+    updated = CustomUser.objects.filter(id__in=user_ids).update(
+        email=Concat(Value('deleted-'), suffix, Value(f'@{ANONYMIZED_DOMAIN}')),
+        username=Concat(Value('deleted-'), suffix),
+        first_name='',
+        last_name='',
+        password='!', # Непридатний пароль (is_password_usable), увійти неможливо
+        marketing_consent1=False,
+        marketing_consent2=False,
+        is_active=False,
+    )
+    UserProfile.objects.filter(user_id__in=user_ids).delete() # Телефон і адреса - весь профіль
+    # Листи розсилок, що ще чекають в черзі, вже не підуть
+    CampaignDelivery.objects.filter(user_id__in=user_ids, status=CampaignDelivery.STATUS_PENDING).update(
+        status=CampaignDelivery.STATUS_SKIPPED)
+    return updated
+
+
+def purge(user_ids):
+    # delete() забирає і залежні рядки (профіль, доставки розсилок, групи, записи журналу адмінки)
+    CustomUser.objects.filter(id__in=user_ids).delete()
+    return len(user_ids)
+
+
+ACTIONS = {
+    RetentionJob.ACTION_ANONYMIZE: anonymize,
+    RetentionJob.ACTION_PURGE: purge,
+}
+
+
+def start(job_id):
+    # Повертає кількість користувачів, що підпадають під фільтри, або None, якщо job вже не чернетка.
+    # ValidationError - фільтрів немає або вони невірні
+    job = RetentionJob.objects.get(pk=job_id)
+    job.clean()
+    matched = audience(job).count()
+    if _transition(job_id, [RetentionJob.STATUS_DRAFT]):
+        logger.info(f'Retention job {job_id} started: {job.action} {matched} users')
+        return matched
+    return None
+
+
+def pause(job_id):
+    RetentionJob.objects.filter(pk=job_id, status=RetentionJob.STATUS_RUNNING).update(
+        status=RetentionJob.STATUS_PAUSED, generation=F('generation') + 1)
+
+
+def resume(job_id):
+    return _transition(job_id, [RetentionJob.STATUS_PAUSED, RetentionJob.STATUS_FAILED])
+
+
+def _transition(job_id, statuses):
+    # Нову таску ставимо тільки якщо статус справді змінили: подвійний клік не запускає другий ланцюжок
+    with transaction.atomic():
+        updated = RetentionJob.objects.filter(pk=job_id, status__in=statuses).update(
+            status=RetentionJob.STATUS_RUNNING, last_error='', generation=F('generation') + 1)
+        if updated:
+            generation = RetentionJob.objects.values_list('generation', flat=True).get(pk=job_id)
+            _schedule(job_id, generation, countdown=0)
+    return bool(updated)
+
+
+def _schedule(job_id, generation, countdown):
+    from .tasks import run_retention_chunk
+
+    transaction.on_commit(lambda: run_retention_chunk.apply_async((job_id, generation), countdown=countdown))
+
+
+def _set_lock_timeout():
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL lock_timeout = %s', [f'{int(settings.RETENTION_LOCK_TIMEOUT * 1000)}ms'])
+
+
+def _lock_not_available(error):
+    cause = error.__cause__ # psycopg2 - pgcode, psycopg 3 - sqlstate
+    return LOCK_NOT_AVAILABLE in (getattr(cause, 'pgcode', None), getattr(cause, 'sqlstate', None))
+
+
+def run_chunk(job_id, generation=None):
+    # generation=None - таска поставлена ще до появи generation
+    started = time.perf_counter()
+    job = None
+    try:
+        with transaction.atomic():
+            # nowait: рядок job тримає інший запит - не чекаємо, а відкладаємо пачку (except нижче).
+            # Ланцюжок закінчує тільки інший generation або статус, інакше job лишився б running без тасок
+            job = RetentionJob.objects.select_for_update(nowait=True).filter(pk=job_id).first()
+            if job is None or job.status != RetentionJob.STATUS_RUNNING:
+                return 0
+            if generation is not None and generation != job.generation:
+                return 0 # Ланцюжок з до паузи / resume, його замінив новий
+            _set_lock_timeout()
+
+            user_ids = list(audience(job).filter(id__gt=job.cursor).order_by('id').values_list('id', flat=True)[:job.chunk_size])
+            if not user_ids:
+                job.status = RetentionJob.STATUS_FINISHED
+                job.finished_at = timezone.now()
+                job.save(update_fields=['status', 'finished_at'])
+                transaction.on_commit(results.purge_expired) # Заодно прибираємо прострочені результати тасок
+                logger.info(f'Retention job {job_id} finished: {job.processed_count} users')
+                return 0
+
+            sessions.delete_user_sessions(user_ids)
+            ACTIONS[job.action](user_ids)
+            job.cursor = user_ids[-1]
+            job.processed_count = F('processed_count') + len(user_ids)
+            job.chunk_size = _next_chunk_size(job.chunk_size, time.perf_counter() - started)
+            job.save(update_fields=['cursor', 'processed_count', 'chunk_size'])
+            # update() сигналів не викликає, кеш request.user чистимо самі
+            transaction.on_commit(lambda: user_cache.invalidate_users(user_ids))
+            _schedule(job_id, job.generation, settings.RETENTION_CHUNK_PAUSE)
+    except OperationalError as e:
+        if not _lock_not_available(e):
+            _fail(job_id, e) # Обрив з'єднання тощо: без нескінченних повторів, job можна продовжити з адмінки
+            raise
+        # Рядок зайнятий: пачку відкотили, пробуємо її ж пізніше з тим самим generation.
+        # Блокування job (job is None) коротке, а користувачам, що тримають свої рядки, даємо більше часу
+        logger.warning(f'Retention job {job_id} chunk postponed: {str(e)}')
+        countdown = settings.RETENTION_CHUNK_PAUSE if job is None else settings.RETENTION_CHUNK_PAUSE * 10
+        _schedule(job_id, generation, countdown)
+        return 0
+    except Exception as e:
+        _fail(job_id, e)
+        raise
+    logger.info(f'Retention job {job_id}: {job.action} {len(user_ids)} users up to id {user_ids[-1]}')
+    return len(user_ids)
+
+
+def _fail(job_id, error):
+    logger.error(f'Retention job {job_id} failed: {str(error)}')
+    RetentionJob.objects.filter(pk=job_id).update(status=RetentionJob.STATUS_FAILED, last_error=str(error))
+
+
+def _next_chunk_size(chunk_size, elapsed):
+    # Тримаємо транзакцію пачки в межах RETENTION_CHUNK_SECONDS
+    if elapsed > settings.RETENTION_CHUNK_SECONDS:
+        return max(settings.RETENTION_MIN_CHUNK_SIZE, chunk_size // 2)
+    if elapsed < settings.RETENTION_CHUNK_SECONDS / 4:
+        return min(settings.RETENTION_MAX_CHUNK_SIZE, chunk_size * 2)
+    return chunk_size
@@ -0,0 +1,56 @@
+# Очистка текстових полів користувача від HTML (захист від XSS) - одна для моделі, форм і імпорту.
+# strip_tags() джанго на кожне значення проходить обгортку keep_lazy_text, копію str() і regex по всьому рядку,
+# хоча майже всі значення (поштовий код, телефон, місто) розмітки не містять. Тут:
+#   - без '<' тегу бути не може: значення повертається як є, однією перевіркою (результат той самий, що й strip_tags)
+#   - значення з розміткою чистяться через HTMLParser один раз, повтори беруться з lru_cache
+#   - sanitize_rows() для імпорту: вся пачка рядків до створення об'єктів моделі
+# python manage.py bench_sanitize - вартість на поле до / після
+from functools import lru_cache
+
+from django.utils.html import strip_tags
+
+CACHE_SIZE = 4096 # Різних значень з розміткою, які пам'ятаємо (лише ті, що містять '<')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _strip_markup(value):
+    return strip_tags(value) # SuspiciousOperation (надто глибока вкладеність) не кешується і летить далі
+
+
+def sanitize(value):
+    if not value:
+        return value
+    if not isinstance(value, str):
+        value = str(value) # Як і strip_tags: числа з NDJSON (поштовий код) стають рядками
+    if '<' not in value:
+        return value
+    return _strip_markup(value)
+
+
+def sanitize_fields(data, fields):
+    # data - словник (cleaned_data форми, рядок імпорту). Порожні значення не чіпаємо
+    for field in fields:
+        value = data.get(field)
+        if value:
+            data[field] = sanitize(value)
+    return data
+
+
+def sanitize_instance(instance, fields):
+    for field in fields:
+        value = getattr(instance, field)
+        cleaned = sanitize(value)
+        if cleaned is not value: # Без розмітки атрибут назад не пишемо
+            setattr(instance, field, cleaned)
+    return instance
+
+
+def sanitize_rows(rows, fields):
+    # Пачка рядків імпорту, ще до створення об'єктів моделі (без user.clean() на кожного)
+    for row in rows:
+        sanitize_fields(row, fields)
+    return rows
+
+
+def cache_info():
+    return _strip_markup.cache_info()
@@ -0,0 +1,113 @@
+# Нечіткий пошук користувачів для підтримки (/users/search/?q=...).
+# На Postgres - pg_trgm: кожне поле порівнюється з запитом оператором %> (word_similarity),
+# під кожне поле є GIN індекс gin_trgm_ops (міграції 0010, 0013), тому "ivan petrenk" чи "petrneko@gm"
+# знаходиться без скану таблиці. Ранг - найкраща схожість серед полів.
+# На інших БД (SQLite в тестах) - icontains по тих самих полях і простий ранг.
+# Сторінки по keyset: курсор "<ранг>:<id>" останнього рядка, сортування (ранг, id) спаданням
+import math
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .models import PROFILE_FIELDS, CustomUser
+
+FIELDS = ['first_name', 'last_name', 'username', 'email', 'city', 'phone']
+PATHS = {field: f'profile__{field}' if field in PROFILE_FIELDS else field for field in FIELDS} # Місто і телефон - в UserProfile
+
+
+def _match(condition_for):
+    # Збіг по полях користувача або по полях профілю. OR між двома таблицями - це LEFT JOIN і скан,
+    # тому id з кожної таблиці шукаємо окремо по її індексах і об'єднуємо через UNION
+    user_side = Q()
+    profile_side = Q()
+    for field in FIELDS:
+        if field in PROFILE_FIELDS:
+            profile_side |= condition_for(PATHS[field])
+        else:
+            user_side |= condition_for(field)
+    matched = CustomUser.objects.filter(user_side).values('pk').union(CustomUser.objects.filter(profile_side).values('pk'))
+    return Q(pk__in=matched)
+
+
+def _trigram(queryset, query):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    condition = _match(lambda path: Q(**{f'{path}__trigram_word_similar': query}))
+    rank = Greatest(*(TrigramWordSimilarity(query, PATHS[field]) for field in FIELDS)) # NULL профілю Greatest пропускає
+    return queryset.filter(condition).annotate(rank=rank)
+
+
+def _contains(queryset, query):
+    condition = _match(lambda path: Q(**{f'{path}__icontains': query}))
+    prefix = Q()
+    for field in FIELDS:
+        prefix |= Q(**{f'{PATHS[field]}__istartswith': query})
+    rank = Case(
+        When(Q(email__iexact=query) | Q(username__iexact=query), then=Value(1.0)),
+        When(prefix, then=Value(0.5)),
+        default=Value(0.1),
+        output_field=FloatField(),
+    )
+    return queryset.filter(condition).annotate(rank=rank)
+
+
+def parse_cursor(cursor):
+    # ValueError - курсор зіпсований. nan / inf float() приймає, але з ними сторінка мовчки порожня
+    rank, user_id = cursor.split(':')
+    rank = float(rank)
+    if not math.isfinite(rank):
+        raise ValueError(f'Invalid cursor rank {rank}')
+    return rank, int(user_id)
+
+
+def _queryset(query, cursor, limit):
+    # select_related: user.city у відповіді береться з уже завантаженого профілю, без запиту на рядок
+    queryset = CustomUser.objects.select_related('profile').only('id', *PATHS.values())
+    if connections[queryset.db].vendor == 'postgresql':
+        queryset = _trigram(queryset, query)
+    else:
+        queryset = _contains(queryset, query)
+    if cursor:
+        rank, user_id = parse_cursor(cursor)
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=user_id))
+    return queryset.order_by('-rank', '-id')[:limit + 1] # Зайвий рядок показує, чи є наступна сторінка
+
+
+def _limit(limit):
+    try:
+        limit = int(limit or settings.USER_SEARCH_PAGE_SIZE)
+    except ValueError:
+        limit = settings.USER_SEARCH_PAGE_SIZE
+    return max(1, min(limit, settings.USER_SEARCH_MAX_PAGE_SIZE))
+
+
+def _page(users, limit):
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = f'{users[-1].rank!r}:{users[-1].pk}' # repr: float повертається в запит без втрат
+    return {
+        'results': [
+            {'id': user.pk, **{field: getattr(user, field) for field in FIELDS}, 'rank': round(user.rank, 3)}
+            for user in users
+        ],
+        'next_cursor': next_cursor,
+    }
+
+
+def search_users(query, cursor=None, limit=None):
+    query = (query or '').strip()
+    limit = _limit(limit)
+    if len(query) < settings.USER_SEARCH_MIN_LENGTH: # Коротші запити дають забагато збігів по триграмах
+        return {'results': [], 'next_cursor': None}
+    return _page(list(_queryset(query, cursor, limit)), limit)
+
+
+async def asearch_users(query, cursor=None, limit=None):
+    query = (query or '').strip()
+    limit = _limit(limit)
+    if len(query) < settings.USER_SEARCH_MIN_LENGTH:
+        return {'results': [], 'next_cursor': None}
+    return _page([user async for user in _queryset(query, cursor, limit)], limit)
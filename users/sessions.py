@@ -0,0 +1,215 @@
+# Session engine (SESSION_ENGINE = 'users.sessions').
+# За замовчуванням кожен запит читав рядок django_session з Postgres, а login() робив
+# exists() + INSERT порожньої сесії і ще UPDATE з даними в кінці запиту.
+# Тут:
+#   - гарячі сесії читаються з кешу (Redis), БД - тільки якщо в кеші немає або кеш недоступний (cached_db)
+#   - нова сесія вставляється одним INSERT вже з даними, коли SessionMiddleware її зберігає
+#   - збереження без змін в даних (modified=True, але значення ті самі) пропускається
+#   - last_activity оновлюється не на кожен запит, а пачкою раз на SESSION_ACTIVITY_FLUSH_INTERVAL
+#   - прострочені сесії видаляються пачками по ключу (clear_expired, clearsessions, таска clear_expired_sessions)
+import atexit
+import copy
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.base import VALID_KEY_CHARS, CreateError
+from django.contrib.sessions.backends.cached_db import KEY_PREFIX, SessionStore as CachedDBStore
+from django.core.cache import caches
+from django.db import connection
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .models import UserSession
+
+logger = logging.getLogger(__name__)
+
+_activity = {} # session_key -> час останнього запиту, ще не записаний в БД
+_activity_lock = threading.Lock()
+_flusher = None
+_stats = {'writes': 0, 'skipped_writes': 0, 'activity_updates': 0}
+
+
+def stats():
+    return dict(_stats)
+
+
+def _touch(session_key):
+    with _activity_lock:
+        _activity[session_key] = timezone.now() # Пізніший запит тієї ж сесії перезаписує ранній
+    _ensure_flusher()
+
+
+def flush_activity():
+    # Один UPDATE ... CASE на пачку сесій замість UPDATE на кожен запит
+    with _activity_lock:
+        pending = list(_activity.items())
+        _activity.clear()
+    if not pending:
+        return 0
+    rows = [UserSession(session_key=session_key, last_activity=seen) for session_key, seen in pending]
+    try:
+        UserSession.objects.bulk_update(rows, ['last_activity'], batch_size=settings.SESSION_ACTIVITY_BATCH_SIZE)
+    except Exception as e:
+        # Пачку не губимо: повертаємо в чергу до наступного flush. Якщо сесія вже встигла
+        # прийти знову, в _activity новіший час - його не перезаписуємо
+        logger.error(f'Failed to update activity of {len(rows)} sessions: {str(e)}')
+        with _activity_lock:
+            for session_key, seen in pending:
+                _activity.setdefault(session_key, seen)
+        return 0
+    _stats['activity_updates'] += len(rows)
+    return len(rows)
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _activity_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name='session-activity-flusher', daemon=True)
+            _flusher.start()
+
+
+def _flush_loop():
+    global _flusher
+    while True:
+        time.sleep(settings.SESSION_ACTIVITY_FLUSH_INTERVAL)
+        if not flush_activity():
+            break
+    connection.close() # З'єднання цього потоку більше не потрібне
+    with _activity_lock:
+        _flusher = None
+    if _activity: # Запит міг прийти між останнім flush і виходом з циклу, або flush не вдався
+        _ensure_flusher()
+
+
+atexit.register(flush_activity)
+
+
+def delete_user_sessions(user_ids):
+    # Розлогінює користувачів: рядки по індексу user_id і записи в кеші, інакше сесія жила б до TTL
+    sessions = UserSession.objects.filter(user_id__in=user_ids)
+    session_keys = list(sessions.values_list('session_key', flat=True))
+    if not session_keys:
+        return 0
+    sessions.delete()
+    try:
+        caches[settings.SESSION_CACHE_ALIAS].delete_many([KEY_PREFIX + session_key for session_key in session_keys])
+    except Exception as e:
+        logger.error(f'Failed to delete {len(session_keys)} cached sessions: {str(e)}')
+    return len(session_keys)
+
+
+class SessionStore(CachedDBStore):
+    def __init__(self, session_key=None):
+        self._loaded = None # Копія даних на момент завантаження, з нею порівнюємо при збереженні
+        self._pending_create = False # Ключ вже виданий, але рядка в БД ще немає
+        super().__init__(session_key)
+
+    @classmethod
+    def get_model_class(cls):
+        return UserSession
+
+    def create_model_instance(self, data):
+        obj = super().create_model_instance(data)
+        user_id = data.get(SESSION_KEY)
+        obj.user_id = int(user_id) if user_id else None
+        obj.last_activity = timezone.now() # Збереження сесії - теж активність
+        return obj
+
+    def _get_new_session_key(self):
+        # Без exists() (GET в кеш і SELECT) на кожну нову сесію: збіг 32 випадкових символів
+        # практично неможливий, а якщо трапиться - INSERT з must_create дасть CreateError і ми візьмемо інший ключ
+        return get_random_string(32, VALID_KEY_CHARS)
+
+    def _remember(self, data):
+        self._loaded = copy.deepcopy(data)
+
+    def _unchanged(self):
+        return self._loaded is not None and getattr(self, '_session_cache', None) == self._loaded
+
+    def load(self):
+        data = super().load()
+        self._remember(data)
+        if self.session_key and data.get(SESSION_KEY):
+            _touch(self.session_key)
+        return data
+
+    async def aload(self):
+        data = await super().aload()
+        self._remember(data)
+        if self.session_key and data.get(SESSION_KEY):
+            _touch(self.session_key)
+        return data
+
+    def create(self):
+        # Тільки новий ключ. Рядок з уже записаними даними (після login()) вставить save() в кінці запиту
+        self._session_key = self._get_new_session_key()
+        self._pending_create = True
+        self.modified = True
+        if not hasattr(self, '_session_cache'):
+            # Як _get_session(no_load=True) в create() джанго: за щойно виданим ключем нічого не завантажуємо.
+            # Інакше зайвий запит, а при збігу ключа - ще й чужі дані в новій сесії
+            self._session_cache = {}
+
+    async def acreate(self):
+        self.create() # Без I/O
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            self.create()
+        must_create = must_create or self._pending_create
+        if not must_create and self._unchanged():
+            _stats['skipped_writes'] += 1 # Ні БД, ні кеш не чіпаємо
+            return
+        while True:
+            try:
+                super().save(must_create=must_create)
+                break
+            except CreateError:
+                if not self._pending_create:
+                    raise
+                self._session_key = self._get_new_session_key()
+        self._pending_create = False
+        self._remember(self._session)
+        _stats['writes'] += 1
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            self.create()
+        must_create = must_create or self._pending_create
+        if not must_create and self._unchanged():
+            _stats['skipped_writes'] += 1
+            return
+        while True:
+            try:
+                await super().asave(must_create=must_create)
+                break
+            except CreateError:
+                if not self._pending_create:
+                    raise
+                self._session_key = self._get_new_session_key()
+        self._pending_create = False
+        self._remember(self._session)
+        _stats['writes'] += 1
+
+    @classmethod
+    def clear_expired(cls, chunk_size=None, sleep=0.0):
+        # Django робить один DELETE по всій таблиці. Тут пачки по первинному ключу (індекс по expire_date),
+        # кожна - короткий DELETE, тому таблиця не блокується надовго. Записи в кеші зникнуть самі по TTL
+        chunk_size = chunk_size or settings.SESSION_CLEANUP_CHUNK
+        now = timezone.now()
+        deleted = 0
+        while True:
+            session_keys = list(
+                UserSession.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:chunk_size]
+            )
+            if not session_keys:
+                return deleted
+            deleted += UserSession.objects.filter(session_key__in=session_keys).delete()[0]
+            if sleep:
+                time.sleep(sleep)
@@ -0,0 +1,15 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import user_cache
+from .models import CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_cache(sender, instance, **kwargs):
+    # Видаляємо одразу і ще раз після коміту: паралельний запит міг встигнути
+    # закешувати старий рядок, поки наша транзакція ще не закомічена
+    user_cache.invalidate_user(instance.pk)
+    transaction.on_commit(lambda: user_cache.invalidate_user(instance.pk))
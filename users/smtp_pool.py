@@ -0,0 +1,198 @@
+# Email backend з пулом SMTP з'єднань на asyncio (aiosmtplib).
+# Стандартний smtp.EmailBackend на кожен send_mail відкриває з'єднання, робить STARTTLS і LOGIN,
+# відправляє один лист і закриває все. Тут з'єднання вже залогінені і живуть між тасками,
+# а листи пачки йдуть паралельно по кількох з'єднаннях.
+# Цикл подій пулу працює у фоновому потоці процесу, тому backend можна викликати з будь-якого
+# синхронного коду (celery таски, представлення) так само, як звичайний EmailBackend
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import aiosmtplib
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.message import sanitize_address
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+_loop_lock = threading.Lock()
+_pools = {} # налаштування SMTP -> пул
+
+
+def _reset_after_fork():
+    # Потік циклу подій не переживає fork, в дитині все створюється заново
+    global _loop
+    _loop = None
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_loop():
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='smtp-pool', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+class _Connection:
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.monotonic()
+
+
+class SMTPPool:
+    def __init__(self, host, port, username, password, use_tls, use_ssl, timeout, size, idle_timeout):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = [] # Вільні з'єднання, останнє використане - в кінці
+        self._slots = None # asyncio.Semaphore створюється вже в циклі пулу
+        self._stats = {'connects': 0, 'reconnects': 0, 'sent': 0, 'failed': 0, 'in_use': 0, 'send_ms': 0.0}
+
+    async def _connect(self):
+        client = aiosmtplib.SMTP(
+            hostname=self.host, port=self.port, timeout=self.timeout,
+            use_tls=self.use_ssl, start_tls=bool(self.use_tls) and not self.use_ssl, # SSL з порту 465 або STARTTLS на 587
+        )
+        await client.connect()
+        if self.username and self.password:
+            await client.login(self.username, self.password)
+        self._stats['connects'] += 1
+        return _Connection(client)
+
+    async def _acquire(self):
+        # Беремо найсвіжіше з'єднання. Ті, що простояли довше idle_timeout, сервер вже міг закрити
+        while self._idle:
+            connection = self._idle.pop()
+            if time.monotonic() - connection.last_used < self.idle_timeout and connection.client.is_connected:
+                return connection
+            await self._close(connection)
+        return await self._connect()
+
+    def _release(self, connection):
+        connection.last_used = time.monotonic()
+        self._idle.append(connection)
+
+    async def _close(self, connection):
+        try:
+            await connection.client.quit()
+        except Exception:
+            connection.client.close()
+
+    async def _send_one(self, sender, recipients, body):
+        async with self._slots:
+            self._stats['in_use'] += 1
+            connection = None
+            started = time.perf_counter()
+            try:
+                connection = await self._acquire()
+                try:
+                    await connection.client.sendmail(sender, recipients, body)
+                except (aiosmtplib.SMTPServerDisconnected, ConnectionError):
+                    # Сервер закрив з'єднання (таймаут простою, рестарт) - одне перепідключення і повтор
+                    connection.client.close()
+                    self._stats['reconnects'] += 1
+                    connection = await self._connect()
+                    await connection.client.sendmail(sender, recipients, body)
+                self._release(connection)
+                self._stats['sent'] += 1
+                return True
+            except Exception:
+                self._stats['failed'] += 1
+                if connection is not None:
+                    connection.client.close()
+                raise
+            finally:
+                self._stats['in_use'] -= 1
+                self._stats['send_ms'] += (time.perf_counter() - started) * 1000
+
+    async def send_many(self, envelopes, fail_silently=False):
+        # envelopes - [(відправник, отримувачі, байти листа)], всі паралельно в межах розміру пулу
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        results = await asyncio.gather(
+            *(self._send_one(*envelope) for envelope in envelopes), return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors and not fail_silently:
+            raise errors[0]
+        return len(results) - len(errors)
+
+    async def close(self):
+        while self._idle:
+            await self._close(self._idle.pop())
+
+    def stats(self):
+        snapshot = dict(self._stats)
+        snapshot['idle'] = len(self._idle)
+        snapshot['avg_send_ms'] = snapshot['send_ms'] / (snapshot['sent'] + snapshot['failed'] or 1)
+        return snapshot
+
+
+def get_pool(host, port, username, password, use_tls, use_ssl, timeout):
+    key = (host, port, username, password, use_tls, use_ssl, timeout,
+           settings.EMAIL_POOL_SIZE, settings.EMAIL_POOL_IDLE_TIMEOUT)
+    if key not in _pools:
+        with _loop_lock:
+            if key not in _pools:
+                _pools[key] = SMTPPool(*key)
+    return _pools[key]
+
+
+def stats():
+    # Статистика всіх пулів процесу (для метрик)
+    return {f'{pool.host}:{pool.port}': pool.stats() for pool in list(_pools.values())}
+
+
+class PooledSMTPEmailBackend(BaseEmailBackend):
+    # Ті самі налаштування, що й у django.core.mail.backends.smtp.EmailBackend
+    def __init__(self, host=None, port=None, username=None, password=None, use_tls=None, use_ssl=None,
+                 timeout=None, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.pool = get_pool(
+            host or settings.EMAIL_HOST,
+            port or settings.EMAIL_PORT,
+            settings.EMAIL_HOST_USER if username is None else username,
+            settings.EMAIL_HOST_PASSWORD if password is None else password,
+            settings.EMAIL_USE_TLS if use_tls is None else use_tls,
+            settings.EMAIL_USE_SSL if use_ssl is None else use_ssl,
+            settings.EMAIL_TIMEOUT if timeout is None else timeout,
+        )
+
+    def send_messages(self, email_messages):
+        envelopes = []
+        for message in email_messages:
+            recipients = message.recipients()
+            if not recipients:
+                continue
+            encoding = message.encoding or settings.DEFAULT_CHARSET
+            envelopes.append((
+                sanitize_address(message.from_email, encoding),
+                [sanitize_address(address, encoding) for address in recipients],
+                message.message().as_bytes(linesep='\r\n'),
+            ))
+        if not envelopes:
+            return 0
+        future = asyncio.run_coroutine_threadsafe(self.pool.send_many(envelopes, self.fail_silently), _get_loop())
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f'Pooled SMTP send failed: {str(e)}')
+            if not self.fail_silently:
+                raise
+            return 0
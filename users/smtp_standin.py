@@ -0,0 +1,117 @@
+# Мінімальний SMTP сервер на asyncio для навантажувальних тестів відправки листів.
+# Нічого не доставляє, тільки приймає листи і рахує їх. latency імітує віддаленого провайдера:
+# затримка перед привітанням (з'єднання + TLS) і після кожного DATA.
+# Для тестів пулу: reject - адреси, які RCPT відхиляє, drop_connections() - сервер закриває з'єднання.
+# TLS не підтримує, тому при тестах EMAIL_USE_TLS = False
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPStandIn:
+    def __init__(self, host='127.0.0.1', port=1025, connect_latency=0.0, message_latency=0.0, reject=()):
+        self.host = host
+        self.port = port
+        self.connect_latency = connect_latency
+        self.message_latency = message_latency
+        self.reject = {address.lower() for address in reject}
+        self.messages = 0
+        self.connections = 0
+        self.started_at = None
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._open = set()
+        self._dropped = set()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._open.add(writer)
+        if self.connect_latency:
+            await asyncio.sleep(self.connect_latency)
+        writer.write(b'220 standin ESMTP\r\n')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line or writer in self._dropped:
+                    break # Обрив без відповіді: клієнт отримає SMTPServerDisconnected
+                command = line[:4].upper()
+                if command == b'EHLO':
+                    writer.write(b'250-standin\r\n250-8BITMIME\r\n250 SIZE 52428800\r\n')
+                elif command == b'DATA':
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    await writer.drain()
+                    while (await reader.readline()) not in (b'.\r\n', b'.\n', b''):
+                        pass
+                    if self.message_latency:
+                        await asyncio.sleep(self.message_latency)
+                    self.messages += 1
+                    writer.write(b'250 OK queued\r\n')
+                elif command == b'RCPT' and self._rejected(line):
+                    writer.write(b'550 No such user\r\n')
+                elif command == b'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b'250 OK\r\n') # HELO, MAIL, RCPT, RSET, NOOP
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass # Клієнт обірвав з'єднання або сервер зупиняється, а пул клієнта ще тримає з'єднання
+        finally:
+            self._open.discard(writer)
+            self._dropped.discard(writer)
+            writer.close()
+
+    def _rejected(self, line):
+        address = line.decode(errors='replace').partition(':')[2].split()[0].strip('<>').lower() # RCPT TO:<адреса> [параметри]
+        return address in self.reject
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1] # Для port=0
+        self.started_at = time.perf_counter()
+        self._ready.set()
+        logger.info(f'SMTP stand-in listening on {self.host}:{self.port}')
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self):
+        # Запуск у фоновому потоці (для бенчмарків в тому ж процесі)
+        def run():
+            try:
+                asyncio.run(self.serve())
+            except asyncio.CancelledError:
+                pass
+
+        self._thread = threading.Thread(target=run, name='smtp-standin', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        def shutdown():
+            # Одним викликом: після закриття сервера asyncio.run() може встигнути закрити цикл
+            self._server.close()
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+
+        if self._loop and self._server:
+            self._loop.call_soon_threadsafe(shutdown)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def drop_connections(self):
+        # Як сервер, що закрив з'єднання по таймауту простою чи при рестарті: клієнт дізнається про це
+        # тільки на наступній команді, тобто вже посеред відправки листа
+        self._dropped.update(self._open)
+
+    def reset(self):
+        self.messages = 0
+        self.connections = 0
+        self.started_at = time.perf_counter()
@@ -1,39 +1,17 @@
 # Логіка роботи відправки листів
 from celery import shared_task
-from django.core.mail import send_mail # Стандартна функція від джанго для розсилки
 from django.conf import settings
 import logging
 
+from . import emails # Реєстр шаблонів листів
+
 logger = logging.getLogger(__name__) # Логування щоб бачити в терміналі чи відправився лист
 
 @shared_task # Передаємо завдання на виконання celery і брокером між цим повіомленням і самим селері виступає редіс. Через нього видаємо і отримуємо результат
 def send_welcome_email(email, first_name): #
-    subject = 'Ласкаво просимо на нашу платформу!' # Назва, тема
-    # Вітальне повідомлення
-    message = f""" 
-    Вітаємо {first_name}!
-    
-    Дякуємо, що ви приєдналися до нашої платформи. Ми раді бачити Вас тут!
-    
-    З найкращими побажаннями,
-    Адміністрація!
-    """
-
-    html_message = f"""
-    <h1>Вітаємо, {first_name}!!</h1>
-    <p>Дякуємо, що ви приєдналися до нашої платформи. Ми раді бачити Вас тут!</p>
-    <p>З найкращими побажаннями,<br>Адміністрація!</p>
-    """
-    # Пробуємо відправити наш лист
+    # Пробуємо відправити наш лист. Тема і текст листа - шаблон 'welcome' з реєстру emails.py
     try:
-        send_mail( #
-            subject, # Заголовок
-            message, # Саме повідомлення
-            settings.DEFAULT_FROM_EMAIL, # Беремо нашу пошту з налаштувань
-            [email], # Сам емейл, кому відправити
-            fail_silently=False,
-            html_message=html_message, # ГТМЛ повідомлення
-        )
+        emails.send('welcome', [(email, {'first_name': first_name})])
         logger.info(f'Welcome email sent {email}, - {first_name}')
 
     except Exception as e: # В разі невдачі виводимо помилку в термінал
@@ -41,7 +19,7 @@ def send_welcome_email(email, first_name): #
         raise
 
 
-@shared_task
+@shared_task(acks_late=True) # Ack після відправки: якщо воркер email_fast впав посеред листа, таска повториться
 def send_account_activation_email(email, user_id):
     from .models import CustomUser
     from django.urls import reverse # Для урл-ок
@@ -69,94 +47,105 @@ def send_account_activation_email(email, user_id):
 
         activation_url = f"{settings.SITE_URL}{reverse('users:account_activation_confirm', kwargs={'uidb64': uid, 'token': token})}"
 
-        # Надсилаємо повідомлення
-        subject = 'Активація акаунту'  # Назва, тема
-        # Вітальне повідомлення
-        message = f""" 
-            Вітаємо {user.first_name or user.email}!
-    
-            Натисніть на посилання для активації вашого акаунту {user.email}
-            {activation_url}
-            
-            Якщо ви не робили запиту, ігноруйте це повідомлення.
-            
-            З найкращими побажаннями,
-            Адміністрація!
-            """
-
-        html_message = f"""
-            <h1>Активація акаунту</h1>
-            <h1>Вітаємо {user.first_name or user.email}!</h1>
-            <p>Натисніть на посилання для активації вашого акаунту <b> {user.email} </b></p>
-            <a href="{activation_url}">{activation_url}</a>
-            <p>Якщо ви не робили запиту, ігноруйте це повідомлення.</p>
-            <p>З найкращими побажаннями,<br>Адміністрація!</p>
-            """
-        send_mail(  #
-            subject,  # Заголовок
-            message,  # Саме повідомлення
-            settings.DEFAULT_FROM_EMAIL,  # Беремо нашу пошту з налаштувань
-            [email],  # Сам емейл, кому відправити
-            fail_silently=False,
-            html_message=html_message,  # ГТМЛ повідомлення
-        )
+        # Надсилаємо повідомлення за шаблоном 'account_activation'
+        emails.send('account_activation', [(email, {'user': user, 'activation_url': activation_url})])
         logger.info(f'Activation email sent {email}')
 
     except Exception as e: # В разі невдачі виводимо помилку в термінал
         logger.error(f'Activation email - {email} failed: {str(e)}')
         raise
 
-@shared_task
+@shared_task(acks_late=True) # Як і активація: краще повторний лист, ніж загублений
 def send_password_reset_email(email, user_id):
     from .models import CustomUser
     from django.urls import reverse  # Для урл-ок
-    from django.contrib.auth.tokens import default_token_generator
+    from .tokens import password_reset_token
     from django.utils.http import urlsafe_base64_encode  # Для генерації спец ключа який буде відправлений користувачу і де згенерується посилання
     from django.utils.encoding import force_bytes  # унікальне для користувача для відновлення пароля
 
     logger.info(f'Starting password reset email for {email}, user_id: {user_id}')  # Логуємо початок
     try:  # Пробуємо
         user = CustomUser.objects.get(pk=user_id)  # Беремо користувача, який це відправив
-        token = default_token_generator.make_token(user)  # Робимо токен унікальний на основі користувача
+        token = password_reset_token.make_token(user)  # Робимо токен унікальний на основі користувача
         uid = urlsafe_base64_encode(force_bytes(user.pk))  # Робимо унікальне юід. Кодуємо стандартною джанго функцією. Кодуємо користувача
         # Створюємо ресет посилання. Домен, Посилання відновлення пароля, унікальний ключ. Зашифроване юід і створений токен
         # 2 унікальних ключа з яких згенерується унікальне посилання для кожного користувача і ніколи в житі не буде повторюватись,
 
         reset_url = f"{settings.SITE_URL}{reverse('users:password_reset_confirm', kwargs={'uidb64': uid, 'token': token})}"
 
-        # Надсилаємо повідомлення
-        subject = 'Запит для скидання пароля'  # Назва, тема
-        # Вітальне повідомлення
-        message = f""" 
-            Вітаємо {user.first_name or user.email}!
-
-            Натисніть на посилання для скидання пароля на вашому акаунті {user.email}
-            {reset_url}
-
-            Якщо ви не робили запиту, ігноруйте це повідомлення.
-
-            З найкращими побажаннями,
-            Адміністрація!
-            """
-
-        html_message = f"""
-            <h1>Запит для скидання пароля</h1>
-            <h1>Вітаємо {user.first_name or user.email}!</h1>
-            <p>Натисніть на посилання для скидання пароля на вашому акаунті <b> {user.email} </b></p>
-            <a href="{reset_url}">{reset_url}</a>
-            <p>Якщо ви не робили запиту, ігноруйте це повідомлення.</p>
-            <p>З найкращими побажаннями,<br>Адміністрація!</p>
-            """
-        send_mail(  #
-            subject,  # Заголовок
-            message,  # Саме повідомлення
-            settings.DEFAULT_FROM_EMAIL,  # Беремо нашу пошту з налаштувань
-            [email],  # Сам емейл, кому відправити
-            fail_silently=False,
-            html_message=html_message,  # ГТМЛ повідомлення
-        )
+        # Надсилаємо повідомлення за шаблоном 'password_reset'
+        emails.send('password_reset', [(email, {'user': user, 'reset_url': reset_url})])
         logger.info(f'Reset password email sent {email}')
 
     except Exception as e:  # В разі невдачі виводимо помилку в термінал
         logger.error(f'Reset password email - {email} failed: {str(e)}')
-        raise
\ No newline at end of file
+        raise
+
+
+@shared_task
+def send_prepared_links(kind, recipients):
+    # Пачка листів з уже згенерованими посиланнями (manage.py mint_links --outbox), одне SMTP з'єднання
+    from .links import KINDS
+
+    template = KINDS[kind][2]
+    try:
+        emails.send(template, [(email, context) for email, context in recipients])
+        logger.info(f'Sent {len(recipients)} {kind} links')
+    except Exception as e:
+        logger.error(f'{kind} links batch of {len(recipients)} failed: {str(e)}')
+        raise
+
+
+@shared_task
+def dispatch_email_outbox():
+    # Запускається celery beat кожні кілька секунд. Передає закомічені листи з EmailOutbox в черги
+    from .outbox import dispatch_pending
+
+    return dispatch_pending()
+
+
+@shared_task
+def clear_expired_sessions():
+    from .sessions import SessionStore
+
+    deleted = SessionStore.clear_expired()
+    logger.info(f'Cleared {deleted} expired sessions')
+    return deleted
+
+
+@shared_task
+def resume_campaign(campaign_id):
+    from . import campaigns
+
+    campaigns.resume(campaign_id)
+
+
+@shared_task
+def resume_campaign_page(campaign_id, epoch=None, after_id=0):
+    # Повторно роздає наступну сторінку листів, що лишились pending після паузи / падіння
+    from . import campaigns
+
+    return campaigns.resume_page(campaign_id, epoch, after_id)
+
+
+@shared_task(ignore_result=False) # Кількість запланованих листів видно в результаті (з TTL, users/results.py)
+def schedule_campaign_page(campaign_id, epoch=None):
+    # Створює доставки для наступної сторінки аудиторії і роздає їх пачками
+    from . import campaigns
+
+    return campaigns.schedule_page(campaign_id, epoch)
+
+
+@shared_task(acks_late=True, ignore_result=False) # Якщо воркер впав посеред пачки, таска повториться, а вже взяті листи не перевідправляться
+def send_campaign_chunk(campaign_id, user_ids, epoch=None):
+    from . import campaigns
+
+    return campaigns.send_chunk(campaign_id, user_ids, epoch)
+
+
+@shared_task
+def run_retention_chunk(job_id, generation=None):
+    # Одна пачка анонімізації / видалення. Наступну пачку таска ставить сама після коміту
+    from . import retention
+
+    return retention.run_chunk(job_id, generation)
@@ -0,0 +1,37 @@
+# {% fragmentcache "account_details" user %} ... {% endfragmentcache %}
+# {% fragmentcache "edit_account_details" user bypass=form.is_bound %} - з помилками форми не кешуємо
+from django import template
+from django.template.base import token_kwargs
+
+from users import fragments
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, name, user, bypass):
+        self.nodelist = nodelist
+        self.name = name
+        self.user = user
+        self.bypass = bypass
+
+    def render(self, context):
+        user = self.user.resolve(context)
+        render = lambda: self.nodelist.render(context)
+        if getattr(user, 'pk', None) is None or (self.bypass is not None and self.bypass.resolve(context)):
+            return fragments.bypass(render)
+        return fragments.get_or_render(self.name.resolve(context), user, render)
+
+
+@register.tag('fragmentcache')
+def do_fragmentcache(parser, token):
+    bits = token.split_contents()
+    if len(bits) not in (3, 4):
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a name, a user and an optional bypass=<condition>")
+    nodelist = parser.parse(('endfragmentcache',))
+    parser.delete_first_token()
+
+    kwargs = token_kwargs(bits[3:], parser) if len(bits) == 4 else {}
+    if len(bits) == 4 and 'bypass' not in kwargs:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' only accepts the bypass=<condition> option")
+    return FragmentCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), kwargs.get('bypass'))
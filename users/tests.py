@@ -1,3 +1,434 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import io
+import tempfile
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import Permission
+from django.contrib.sessions.backends.cached_db import KEY_PREFIX
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.mail import EmailMessage
+from django.db import DatabaseError, IntegrityError, OperationalError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.crypto import pbkdf2
+
+from . import hashers, ratelimit, retention, sessions, smtp_pool
+from .forms import CustomUserCreationForm, _constraint_name
+from .models import CustomUser, RetentionJob, UserSession
+from .smtp_standin import SMTPStandIn
+
+
+def _registration(**overrides):
+    data = {
+        'email': 'new@example.com', 'username': 'new', 'first_name': 'Нова', 'last_name': 'Людина',
+        'password1': 'Sup3r-secret-pass', 'password2': 'Sup3r-secret-pass',
+    }
+    data.update(overrides)
+    return data
+
+
+class RegistrationUniqueTests(TestCase):
+    # Дублікати ловить UniqueConstraint в БД (один INSERT), а форма показує помилку на потрібному полі
+    @classmethod
+    def setUpTestData(cls):
+        CustomUser.objects.create_user('myusername@example.com', 'Є', 'Користувач', 'taken', 'Sup3r-secret-pass')
+
+    def test_duplicate_email_is_reported_on_email(self):
+        # В email є слово "username" - помилка все одно на полі email
+        form = CustomUserCreationForm(_registration(email='MyUsername@example.com'))
+        self.assertTrue(form.is_valid())
+        user = form.save()
+        self.assertIsNone(user.pk)
+        self.assertEqual(list(form.errors), ['email'])
+
+    def test_duplicate_username_is_reported_on_username(self):
+        form = CustomUserCreationForm(_registration(username='TAKEN'))
+        self.assertTrue(form.is_valid())
+        user = form.save()
+        self.assertIsNone(user.pk)
+        self.assertEqual(list(form.errors), ['username'])
+
+    def test_new_user_is_saved(self):
+        form = CustomUserCreationForm(_registration())
+        self.assertTrue(form.is_valid())
+        self.assertIsNotNone(form.save().pk)
+        self.assertFalse(form.errors)
+
+    @override_settings(RATELIMIT_ENABLED=False)
+    def test_register_view_shows_error_without_login(self):
+        response = self.client.post('/users/register/', _registration(email='MYUSERNAME@example.com'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('email', response.context['form'].errors)
+        self.assertNotIn('_auth_user_id', self.client.session)
+        self.assertEqual(CustomUser.objects.count(), 1)
+
+    def test_postgres_constraint_name(self):
+        # psycopg кладе назву обмеження в diag, текст помилки не читаємо
+        error = IntegrityError('duplicate key value violates unique constraint "users_customuser_email_ci_uniq"\n'
+                               'DETAIL:  Key (lower(username::text))=(x) already exists.')
+        error.__cause__ = Exception()
+        error.__cause__.diag = SimpleNamespace(constraint_name='users_customuser_email_ci_uniq')
+        self.assertEqual(CustomUserCreationForm.UNIQUE_CONSTRAINTS[_constraint_name(error)], 'email')
+
+
+class ProfileSaveTests(TestCase):
+    # profile_updated_at - версія рядка в кеші фрагментів, міняється тільки разом з даними профілю
+    @classmethod
+    def setUpTestData(cls):
+        user = CustomUser.objects.create_user('profile@example.com', 'Є', 'Користувач', 'profile', 'Sup3r-secret-pass')
+        user.city = 'Київ'
+        user.save()
+
+    def _user(self):
+        user = CustomUser.objects.get(email='profile@example.com')
+        user.get_profile()
+        return user
+
+    def test_unchanged_profile_keeps_version(self):
+        user = self._user()
+        before = user.profile_updated_at
+        user.first_name = 'Інше'
+        user.save()
+        self.assertEqual(CustomUser.objects.get(pk=user.pk).profile_updated_at, before)
+
+    def test_changed_profile_bumps_version(self):
+        user = self._user()
+        before = user.profile_updated_at
+        user.city = 'Львів'
+        user.save()
+        user = CustomUser.objects.get(pk=user.pk)
+        self.assertGreater(user.profile_updated_at, before)
+        self.assertEqual(user.city, 'Львів')
+
+
+class HashPoolTests(SimpleTestCase):
+    def tearDown(self):
+        if hashers._pool is not None:
+            hashers._pool.shutdown()
+
+    def test_broken_pool_is_restarted(self):
+        # Вбитий дочірній процес ламає ProcessPoolExecutor назавжди - без перезапуску кожен логін давав би 500
+        expected = base64.b64encode(pbkdf2('password', 'salt', 1000, digest=hashlib.sha256)).decode()
+        self.assertEqual(hashers.pbkdf2_sha256('password', 'salt', 1000), expected)
+        broken = hashers._pool
+        for process in list(broken._processes.values()):
+            process.kill()
+        deadline = time.monotonic() + 10
+        while not broken._broken and time.monotonic() < deadline:
+            time.sleep(0.05)
+        restarts = hashers.stats()['restarts']
+
+        self.assertEqual(hashers.pbkdf2_sha256('password', 'salt', 1000), expected)
+        self.assertIsNot(hashers._pool, broken)
+        self.assertEqual(hashers.stats()['restarts'], restarts + 1)
+
+
+@override_settings(
+    RATELIMIT_ENABLED=True,
+    RATELIMIT_IP_HEADER='HTTP_X_FORWARDED_FOR',
+    RATELIMIT_TRUSTED_PROXIES=['10.0.0.0/8'],
+    RATELIMITS={'login': [('ip', '3/m'), ('post:username', '2/m')]},
+)
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ratelimit, '_backend', ratelimit.LocalTokenBucket())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _login(self, username, remote_addr, forwarded=None):
+        extra = {'REMOTE_ADDR': remote_addr}
+        if forwarded is not None:
+            extra['HTTP_X_FORWARDED_FOR'] = forwarded
+        return RequestFactory().post('/users/login/', {'username': username}, **extra)
+
+    def test_spoofed_forwarded_for_is_ignored(self):
+        # Ліву адресу пише клієнт: нова адреса в кожному запиті не дає нового відра
+        request = self._login('a@example.com', '10.0.0.1', '1.2.3.4, 203.0.113.7')
+        self.assertEqual(ratelimit.client_ip(request), '203.0.113.7')
+        for attempt in range(3):
+            request = self._login(f'user{attempt}@example.com', '10.0.0.1', f'1.2.3.{attempt}, 203.0.113.7')
+            self.assertIsNone(ratelimit.check('login', request))
+        response = ratelimit.check('login', self._login('other@example.com', '10.0.0.1', '9.9.9.9, 203.0.113.7'))
+        self.assertEqual(response.status_code, 429)
+
+    def test_untrusted_remote_addr_uses_own_address(self):
+        request = self._login('a@example.com', '198.51.100.9', '203.0.113.7')
+        self.assertEqual(ratelimit.client_ip(request), '198.51.100.9')
+
+    def test_username_limit_is_independent_of_ip(self):
+        # Перебір паролів одного акаунта з різних адрес впирається в ліміт по email
+        self.assertIsNone(ratelimit.check('login', self._login('victim@example.com', '198.51.100.1')))
+        self.assertIsNone(ratelimit.check('login', self._login('Victim@Example.com', '198.51.100.2')))
+        response = ratelimit.check('login', self._login('victim@example.com', '198.51.100.3'))
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertIsNone(ratelimit.check('login', self._login('other@example.com', '198.51.100.3')))
+
+
+@override_settings(EMAIL_POOL_SIZE=3, EMAIL_POOL_IDLE_TIMEOUT=60)
+class PooledSMTPBackendTests(SimpleTestCase):
+    # Пул проти локального smtp_standin на вільному порту
+    def setUp(self):
+        self.server = SMTPStandIn(port=0, message_latency=0.02, reject=['nobody@example.com']).start()
+        self.addCleanup(self.server.stop)
+
+    def _backend(self, **kwargs):
+        backend = smtp_pool.PooledSMTPEmailBackend(
+            host='127.0.0.1', port=self.server.port, username='', password='', use_tls=False, use_ssl=False, **kwargs)
+        self.addCleanup(self._close, backend.pool)
+        return backend
+
+    def _close(self, pool):
+        asyncio.run_coroutine_threadsafe(pool.close(), smtp_pool._get_loop()).result()
+        smtp_pool._pools.clear()
+
+    def _messages(self, count, to='user{}@example.com'):
+        return [EmailMessage('Тема', 'Текст', 'noreply@example.com', [to.format(index)]) for index in range(count)]
+
+    def test_send_many_runs_in_parallel_on_pool_connections(self):
+        backend = self._backend()
+        self.assertEqual(backend.send_messages(self._messages(10)), 10)
+        self.assertEqual(self.server.messages, 10)
+        stats = backend.pool.stats()
+        self.assertEqual(stats['sent'], 10)
+        self.assertEqual(stats['connects'], 3) # Не більше EMAIL_POOL_SIZE, далі ті самі з'єднання
+        self.assertEqual(stats['idle'], 3)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_dropped_connection_is_reconnected_once(self):
+        backend = self._backend()
+        self.assertEqual(backend.send_messages(self._messages(1)), 1)
+        self.server.drop_connections()
+        self.assertEqual(backend.send_messages(self._messages(1)), 1)
+        self.assertEqual(self.server.messages, 2)
+        stats = backend.pool.stats()
+        self.assertEqual(stats['reconnects'], 1)
+        self.assertEqual(stats['connects'], 2)
+        self.assertEqual(stats['failed'], 0)
+
+    def test_fail_silently_counts_delivered_only(self):
+        backend = self._backend(fail_silently=True)
+        messages = self._messages(3) + self._messages(1, to='nobody@example.com')
+        self.assertEqual(backend.send_messages(messages), 3)
+        self.assertEqual(self.server.messages, 3)
+        self.assertEqual(backend.pool.stats()['failed'], 1)
+
+    def test_failure_raises_without_fail_silently(self):
+        backend = self._backend()
+        with self.assertRaises(Exception):
+            backend.send_messages(self._messages(1, to='nobody@example.com'))
+
+    @override_settings(EMAIL_POOL_IDLE_TIMEOUT=0.05)
+    def test_idle_connection_is_replaced(self):
+        backend = self._backend()
+        backend.send_messages(self._messages(1))
+        time.sleep(0.1)
+        backend.send_messages(self._messages(1))
+        stats = backend.pool.stats()
+        self.assertEqual(stats['connects'], 2)
+        self.assertEqual(stats['reconnects'], 0) # Прострочене з'єднання закрите ще до відправки
+        self.assertEqual(self.server.connections, 2)
+
+
+class SessionStoreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('session@example.com', 'Є', 'Користувач', 'session', 'Sup3r-secret-pass')
+
+    def setUp(self):
+        # Без фонового потоку: активність пишемо flush_activity() прямо в тесті
+        patcher = mock.patch.object(sessions, '_ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(sessions._activity.clear)
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+
+    def _logged_in(self):
+        store = sessions.SessionStore()
+        store[SESSION_KEY] = str(self.user.pk)
+        store.save()
+        return store.session_key
+
+    def test_new_session_is_one_insert_with_data(self):
+        store = sessions.SessionStore()
+        store.create()
+        store[SESSION_KEY] = str(self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            store.save()
+        statements = [query['sql'].split()[0].upper() for query in queries if 'users_usersession' in query['sql']]
+        self.assertEqual(statements, ['INSERT'])
+        row = UserSession.objects.get(session_key=store.session_key)
+        self.assertEqual(row.user_id, self.user.pk)
+        self.assertEqual(row.get_decoded()[SESSION_KEY], str(self.user.pk))
+
+    def test_unchanged_save_is_skipped(self):
+        store = sessions.SessionStore(self._logged_in())
+        store[SESSION_KEY] = str(self.user.pk) # modified=True, але дані ті самі
+        skipped = sessions.stats()['skipped_writes']
+        with self.assertNumQueries(0):
+            store.save()
+        self.assertEqual(sessions.stats()['skipped_writes'], skipped + 1)
+
+    def test_key_collision_takes_another_key(self):
+        taken = self._logged_in()
+        store = sessions.SessionStore()
+        with mock.patch.object(store, '_get_new_session_key', side_effect=[taken, 'k' * 32]):
+            store.create()
+            store['cart'] = [1]
+            store.save()
+        self.assertEqual(store.session_key, 'k' * 32)
+        self.assertEqual(UserSession.objects.get(session_key=taken).get_decoded()[SESSION_KEY], str(self.user.pk))
+        self.assertEqual(UserSession.objects.get(session_key='k' * 32).get_decoded(), {'cart': [1]})
+
+    def test_delete_user_sessions_clears_db_and_cache(self):
+        session_key = self._logged_in()
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+        self.assertIsNotNone(cache.get(KEY_PREFIX + session_key))
+        self.assertEqual(sessions.delete_user_sessions([self.user.pk]), 1)
+        self.assertFalse(UserSession.objects.filter(session_key=session_key).exists())
+        self.assertIsNone(cache.get(KEY_PREFIX + session_key))
+        self.assertEqual(sessions.SessionStore(session_key).load(), {})
+
+    def test_clear_expired_deletes_in_chunks(self):
+        expired = timezone.now() - timedelta(days=1)
+        UserSession.objects.bulk_create(
+            [UserSession(session_key=f'expired{index}', session_data='', expire_date=expired) for index in range(5)])
+        live = self._logged_in()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sessions.SessionStore.clear_expired(chunk_size=2), 5)
+        self.assertEqual(sum(query['sql'].startswith('DELETE') for query in queries), 3)
+        self.assertEqual(list(UserSession.objects.values_list('session_key', flat=True)), [live])
+
+    def test_failed_activity_flush_is_requeued(self):
+        session_key = self._logged_in()
+        sessions._activity.clear()
+        seen = timezone.now() - timedelta(minutes=5)
+        sessions._activity.update({session_key: seen, 'other': seen})
+        newer = timezone.now()
+
+        def fail(*args, **kwargs):
+            sessions._touch('other') # Запит тієї ж сесії поки пачка пишеться
+            sessions._activity['other'] = newer
+            raise DatabaseError('connection lost')
+
+        with mock.patch.object(UserSession.objects, 'bulk_update', side_effect=fail):
+            self.assertEqual(sessions.flush_activity(), 0)
+        self.assertEqual(sessions._activity, {session_key: seen, 'other': newer})
+
+        self.assertEqual(sessions.flush_activity(), 2)
+        self.assertEqual(UserSession.objects.get(session_key=session_key).last_activity, seen)
+        self.assertEqual(sessions._activity, {})
+
+
+class UserSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.support = CustomUser.objects.create_user(
+            'support@example.com', 'Підтримка', 'Команда', 'support', 'Sup3r-secret-pass', is_staff=True)
+        cls.support.user_permissions.add(Permission.objects.get(codename='view_customuser'))
+        cls.staff = CustomUser.objects.create_user(
+            'staff@example.com', 'Персонал', 'Без прав', 'staff', 'Sup3r-secret-pass', is_staff=True)
+        for index in range(7):
+            CustomUser.objects.create_user(f'petrenko{index}@example.com', 'Іван', 'Петренко', f'petrenko{index}')
+
+    def _search(self, user=None, **params):
+        self.client.force_login(user or self.support)
+        return self.client.get('/users/search/', params)
+
+    def test_cursor_pages_are_stable(self):
+        # Новий користувач між сторінками не зсуває їх: ні дублікатів, ні пропусків
+        seen = []
+        cursor = None
+        while True:
+            params = {'q': 'petrenko', 'limit': 3, **({'cursor': cursor} if cursor else {})}
+            page = self._search(**params).json()
+            seen += [row['id'] for row in page['results']]
+            if len(seen) == 3: # Після першої сторінки
+                CustomUser.objects.create_user('petrenko-new@example.com', 'Нова', 'Петренко', 'petrenko-new')
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        expected = list(CustomUser.objects.filter(username__startswith='petrenko').exclude(username='petrenko-new')
+                        .order_by('-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_is_rejected(self):
+        for cursor in ['nan:5', 'inf:5', '-inf:5', 'garbage', '0.5:x']:
+            with self.subTest(cursor=cursor):
+                response = self._search(q='petrenko', cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+
+    def test_short_query_returns_nothing(self):
+        query = 'petrenko'[:settings.USER_SEARCH_MIN_LENGTH - 1]
+        self.assertEqual(self._search(q=query).json(), {'results': [], 'next_cursor': None})
+
+    def test_staff_without_permission_is_forbidden(self):
+        self.assertEqual(self._search(self.staff, q='petrenko').status_code, 403)
+
+    def test_non_staff_is_redirected(self):
+        user = CustomUser.objects.get(username='petrenko0')
+        response = self._search(user, q='petrenko')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/admin/login/', response.url)
+
+
+class ImportFormulaTests(TestCase):
+    # Апостроф перед формулою ставить export_users, тому знімаємо його тільки з --from-export
+    def _import(self, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', newline='') as file:
+            file.write("email,username,first_name,phone,password_hash\n")
+            file.write("formula@example.com,formula,'=HYPERLINK(1),'+1 555 0100,!\n")
+            file.flush()
+            call_command('import_users', file.name, '--workers', '1', *args, stdout=io.StringIO())
+        return CustomUser.objects.select_related('profile').get(email='formula@example.com')
+
+    def test_other_csv_keeps_apostrophe(self):
+        user = self._import()
+        self.assertEqual(user.first_name, "'=HYPERLINK(1)")
+        self.assertEqual(user.phone, "'+1 555 0100")
+
+    def test_export_csv_is_unescaped(self):
+        user = self._import('--from-export')
+        self.assertEqual(user.first_name, '=HYPERLINK(1)')
+        self.assertEqual(user.phone, '+1 555 0100')
+
+
+class RetentionChunkErrorTests(TestCase):
+    def setUp(self):
+        self.job = RetentionJob.objects.create(
+            name='Неактивні', action=RetentionJob.ACTION_ANONYMIZE, filters={'is_active': False},
+            status=RetentionJob.STATUS_RUNNING, generation=4)
+        patcher = mock.patch.object(retention, '_schedule')
+        self.schedule = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _error(self, pgcode):
+        error = OperationalError('error')
+        error.__cause__ = Exception()
+        error.__cause__.pgcode = pgcode
+        return error
+
+    def test_locked_job_row_is_postponed_with_same_generation(self):
+        # Рядок job тримає форма адмінки: ланцюжок не рветься, job лишається running
+        with mock.patch.object(RetentionJob.objects, 'select_for_update', side_effect=self._error('55P03')):
+            self.assertEqual(retention.run_chunk(self.job.pk, 4), 0)
+        self.schedule.assert_called_once_with(self.job.pk, 4, settings.RETENTION_CHUNK_PAUSE)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, RetentionJob.STATUS_RUNNING)
+
+    def test_other_operational_error_fails_the_job(self):
+        with mock.patch.object(retention, 'audience', side_effect=self._error('08006')):
+            with self.assertRaises(OperationalError):
+                retention.run_chunk(self.job.pk, 4)
+        self.schedule.assert_not_called()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, RetentionJob.STATUS_FAILED)
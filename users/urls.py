@@ -1,24 +1,33 @@
+from django.conf import settings
 from django.urls import path, include
-from . import views
+from . import views, async_views
 
 app_name = 'users'
 
-urlpatterns = [
-    path('register/', views.register, name='register' ),
-    path('login/', views.login_view, name='login'),
-    path('logout/', views.logout_view, name='logout'),
-    path('profile/', views.profile_views, name='profile'),
 
-    path('account_details/', views.account_details, name='account_details'),
-    path('edit_account_details/', views.edit_account_details, name='edit_account_details'),
-    path('update_account_details/', views.update_account_details, name='update_account_details'),
+def build_urlpatterns(views):
+    # views - модуль з представленнями: views (WSGI) або async_views (ASGI)
+    return [
+        path('register/', views.register, name='register' ),
+        path('login/', views.login_view, name='login'),
+        path('logout/', views.logout_view, name='logout'),
+        path('profile/', views.profile_views, name='profile'),
 
-    path('password_reset/', views.password_reset_request, name='password_reset_request'),
-    # Юідб і токен який ми повинні були передати в посиланні
-    path('password_reset/<uidb64>/<token>/', views.password_reset_confirm, name='password_reset_confirm'),
+        path('account_details/', views.account_details, name='account_details'),
+        path('edit_account_details/', views.edit_account_details, name='edit_account_details'),
+        path('update_account_details/', views.update_account_details, name='update_account_details'),
 
-    path('account_activation_request/', views.account_activation_request, name='account_activation_request'),
-    path('account_activation_confirm/<uidb64>/<token>/', views.account_activation_confirm, name='account_activation_confirm'),
+        path('password_reset/', views.password_reset_request, name='password_reset_request'),
+        # Юідб і токен який ми повинні були передати в посиланні
+        path('password_reset/<uidb64>/<token>/', views.password_reset_confirm, name='password_reset_confirm'),
 
-]
+        path('account_activation_request/', views.account_activation_request, name='account_activation_request'),
+        path('account_activation_confirm/<uidb64>/<token>/', views.account_activation_confirm, name='account_activation_confirm'),
 
+        path('search/', views.user_search, name='user_search'), # JSON, тільки для персоналу
+        path('export/', views.export_users, name='export_users'), # CSV / NDJSON потоком, тільки для персоналу
+
+    ]
+
+
+urlpatterns = build_urlpatterns(async_views if settings.USERS_ASYNC_VIEWS else views)
@@ -0,0 +1,39 @@
+# Кеш об'єкта користувача між запитами.
+# AuthenticationMiddleware на кожен запит тягне рядок CustomUser з БД, тепер бекенд
+# (users.backends.PooledModelBackend.get_user) спочатку дивиться сюди.
+# Інвалідація - сигнали post_save / post_delete (users/signals.py). queryset.update() сигналів
+# не викликає, тому після масових апдейтів треба викликати invalidate_users() вручну
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _cache():
+    return caches[settings.USER_CACHE_ALIAS]
+
+
+def _key(user_id):
+    return f'users:user:{user_id}'
+
+
+def get_user(user_id):
+    return _cache().get(_key(user_id), version=settings.USER_CACHE_VERSION)
+
+
+async def aget_user(user_id):
+    return await _cache().aget(_key(user_id), version=settings.USER_CACHE_VERSION)
+
+
+def set_user(user):
+    _cache().set(_key(user.pk), user, settings.USER_CACHE_TIMEOUT, version=settings.USER_CACHE_VERSION)
+
+
+async def aset_user(user):
+    await _cache().aset(_key(user.pk), user, settings.USER_CACHE_TIMEOUT, version=settings.USER_CACHE_VERSION)
+
+
+def invalidate_user(user_id):
+    _cache().delete(_key(user_id), version=settings.USER_CACHE_VERSION)
+
+
+def invalidate_users(user_ids):
+    _cache().delete_many([_key(user_id) for user_id in user_ids], version=settings.USER_CACHE_VERSION)
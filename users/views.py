@@ -1,44 +1,51 @@
 from django.contrib import messages
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, logout
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from .forms import CustomUserLoginForm, CustomUserUpdateForm, CustomUserCreationForm, PasswordResetRequestForm, PasswordResetConfirmForm
 from .models import CustomUser
 
 # New
 from .tasks import send_welcome_email, send_password_reset_email, send_account_activation_email
-from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
 import logging
 
-from .tokens import account_activation_token
+from .tokens import account_activation_token, password_reset_token
+from .outbox import enqueue_email
+from .ratelimit import ratelimit
+from .search import search_users
+from . import export
 
 
+@ratelimit('register') # Ліміт перевіряється до форми і хешування пароля
 def register(request):
     if request.method == 'POST': # Перевіряємо на пост запит. Спрацьовуватиме тоді коли буде пост запит
         form = CustomUserCreationForm(request.POST) # Ініціалізуємо запит. реквест пост дані які він нам дав
-        if form.is_valid(): #Даними ми форму заповнили. Якщо форма валідна. Валідації які ми прописували
-            user = form.save() # Зберігаємо користувача
-            user.email_confirmed = False # Вказуємо що пошта не активована
-            user.save()
-            login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+        user = form.save() if form.is_valid() else None # Один INSERT. Якщо email або тег вже зайняті, помилка вже у формі
+        if user is not None and not form.errors:
+            login(request, user, backend='users.backends.PooledModelBackend')
             # логінимо збереженого користувача і передаємо бекенд для того щоб запобігти конфліктів з дефолтним бекендом
 
-            send_welcome_email.delay(user.email, user.first_name) # Відправляємо повідомлення. В таску передали пошту і ім'я
+            enqueue_email(send_welcome_email, user.email, user.first_name) # Кладемо лист в outbox. В таску передали пошту і ім'я
+            # Рядок outbox комітиться разом з користувачем: диспетчер побачить його тільки після коміту, як з on_commit
 
             return redirect('users:profile')  # Редіректимо на профіль
     else:
         form = CustomUserCreationForm() # Якщо форма не валідна. Виводимо пусту форму і помилки
     return render(request, 'users/register.html', {'form': form})
 
+@ratelimit('login') # Ліміт перевіряється до форми і хешування пароля
 def login_view(request):
     if request.method == 'POST':
         form = CustomUserLoginForm(request=request, data=request.POST) # Дата це дані які заповнюють
         if form.is_valid():
             user = form.get_user() # В юзер переміщуємо користувача. Стандартна перевірка джанго яка дістає користувача який є в системі
 
-            login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+            login(request, user, backend='users.backends.PooledModelBackend')
             return redirect('users:profile')
     else:
         form = CustomUserLoginForm()
@@ -52,8 +59,9 @@ def profile_views(request): # Для перегляду профіля
 # Представлення для htmx. Яке динамічно міняє контент сторінки без перезагрузки роблячи запити до серверу
 @login_required
 def account_details(request):
-    user = CustomUser.objects.get(id=request.user.id) # Беремо дані поточного користувача
-    return render(request, 'users/partials/account_details.html', {'user': user})
+    # request.user вже свіжий: бекенд бере його з кешу, а кеш чиститься при кожному save() користувача.
+    # Адреса і телефон - з UserProfile, шаблон підвантажить профіль одним запитом при першому зверненні
+    return render(request, 'users/partials/account_details.html', {'user': request.user})
 
 @login_required
 def edit_account_details(request):
@@ -75,22 +83,49 @@ def update_account_details(request):
             return render(request, 'users/partials/edit_account_details.html', {'user': request.user, 'form': form})
     return render(request, 'users/partials/account_details.html', {'user': request.user})
 
+@transaction.non_atomic_requests # Тільки читання, BEGIN / COMMIT не потрібні
+@staff_member_required
+@permission_required('users.view_customuser', raise_exception=True) # Email, телефон і місто - не для кожного staff
+def user_search(request):
+    # Пошук користувачів для підтримки: ?q=...&cursor=...&limit=... (users/search.py)
+    try:
+        page = search_users(request.GET.get('q'), request.GET.get('cursor'), request.GET.get('limit'))
+    except ValueError:
+        return JsonResponse({'error': 'Невірний курсор.'}, status=400)
+    return JsonResponse(page, json_dumps_params={'ensure_ascii': False})
+
+@transaction.non_atomic_requests # Рядки читаються вже після виходу з представлення, транзакції запиту тоді вже немає
+@staff_member_required
+@permission_required('users.export_customuser', raise_exception=True)
+def export_users(request):
+    # Вивантаження: ?format=csv|ndjson&gzip=1&marketing_consent1=1&email_confirmed=0&country=... (users/export.py)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest('Невідомий формат.')
+    compress = request.GET.get('gzip') == '1'
+    logging.info(f'User export ({fmt}) by staff user id {request.user.pk}: {request.GET.urlencode()}')
+    response = StreamingHttpResponse(export.iter_export(export.filter_users(request.GET), fmt, compress),
+                                     content_type=export.content_type(fmt, compress))
+    response['Content-Disposition'] = f'attachment; filename="{export.filename(fmt, compress)}"'
+    return response
+
 def logout_view(request):
     logout(request)
     return redirect('users:login')
 
 
 
+@ratelimit('password_reset') # Ліміт перевіряється до форми і хешування пароля
 def password_reset_request(request): # Надіслати запит на зміну пароля
     if request.method == 'POST': # Якщо надсилаємо форму
         form = PasswordResetRequestForm(request.POST) # Ініціалізуємо форму з даними
         if form.is_valid(): # Якщо дані валідні
             email = form.cleaned_data['email'] # Беремо пошту з очищених даних з ініціалізованої форми
-            user = CustomUser.objects.filter(email=email).first() # Беремо користувача який це надіслав за допомогою пошти яку ми взяли вище
+            user = CustomUser.objects.filter_by_email(email).first() # Беремо користувача який це надіслав за допомогою пошти яку ми взяли вище
             if user: # Якщо такий користувач існує
                 logging.info(f'Attempting to send password reset email to {email}, for user id {user.pk}') # Логуємо початок
 
-                send_password_reset_email.delay(email, user.pk) # Запускаємо таску на пошту, передаючи емейл і ід користувача
+                enqueue_email(send_password_reset_email, email, user.pk, debounce_key=user.pk) # Кладемо таску в outbox (повтор в межах вікна відкидається)
 
                 messages.success(request, 'Скидання пароля в черзі. Будь ласка, перевірте свою поштову скриньку для того щоб скинути пароль.')
                 # Повідомлення відправлено очікуйте для користувача
@@ -114,7 +149,7 @@ def password_reset_confirm(request, uidb64, token): # Коли користув
         user = None # Якщо нема то так і записуємо
 
     # Якщо користувач є і перевіряємо користувача і його токен, якщо вони співпадають
-    if user is not None and default_token_generator.check_token(user, token):
+    if user is not None and password_reset_token.check_token(user, token):
         if request.method == 'POST':
             form = PasswordResetConfirmForm(request.POST)
             if form.is_valid():
@@ -141,7 +176,7 @@ def account_activation_request(request):
 
 
                 logging.info(f'Attempting to send acctivation email to {email}, for user id {user.pk}') # Логуємо початок
-                send_account_activation_email.delay(email, user.pk) # Запускаємо таску на пошту, передаючи емейл і ід користувача
+                enqueue_email(send_account_activation_email, email, user.pk, debounce_key=user.pk) # Кладемо таску в outbox (повтор в межах вікна відкидається)
                 messages.success(request, f'Лист активації акаунта надіслано на пошту {email}. Перевірте свою пошту та перейдіть за посиланням в листі')
                 # Повідомлення відправлено очікуйте для користувача
                 return redirect('users:profile')
@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'usersguide.settings')
+os.environ.setdefault('USERS_ASYNC_VIEWS', '1') # Нативні async представлення замість sync_to_async потоків
 
 application = get_asgi_application()
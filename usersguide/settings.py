@@ -1,5 +1,6 @@
 
 import os
+import tempfile
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -31,12 +32,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres', # Lookups pg_trgm для пошуку користувачів (users/search.py)
 
     'django_celery_results',
     'users.apps.UsersConfig',
 ]
 
 MIDDLEWARE = [
+    'users.metrics.metrics_middleware', # Першим, щоб міряти весь запит разом з іншими middleware
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +68,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'usersguide.wsgi.application'
 
+# Під ASGI (asgi.py ставить USERS_ASYNC_VIEWS=1) підключаємо async версії представлень з users/async_views.py
+USERS_ASYNC_VIEWS = os.getenv('USERS_ASYNC_VIEWS', '0') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
@@ -82,6 +88,79 @@ DATABASES = {
 }
 
 
+# Cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379/1'), # Брокер celery в /0, кеш в /1
+    },
+    'fragments': { # HTML фрагменти профілю (users/fragments.py). Витіснення - по TIMEOUT і maxmemory-policy редіса
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379/1'),
+        'KEY_PREFIX': 'fragments',
+        'TIMEOUT': 600,
+    },
+}
+
+# Кеш користувача для request.user (users/user_cache.py)
+USER_CACHE_ALIAS = 'default'
+USER_CACHE_TIMEOUT = 300 # Навіть якщо інвалідацію пропустили (queryset.update()), через 5 хв запис оновиться
+USER_CACHE_VERSION = 2 # Збільшити, якщо змінилась модель CustomUser, щоб не читати старі pickle
+
+# Сесії (users/sessions.py): кеш + БД, рядки в users_usersession
+SESSION_ENGINE = 'users.sessions'
+SESSION_CACHE_ALIAS = 'default'
+SESSION_ACTIVITY_FLUSH_INTERVAL = 30.0 # Як часто пишемо last_activity сесій в БД (секунди)
+SESSION_ACTIVITY_BATCH_SIZE = 500 # Сесій в одному UPDATE
+SESSION_CLEANUP_CHUNK = 5000 # Рядків за один DELETE при очистці прострочених сесій
+
+# Кеш HTMX фрагментів профілю ({% fragmentcache %})
+FRAGMENT_CACHE_ALIAS = 'fragments' # Час життя і витіснення налаштовуються в CACHES['fragments']
+
+# Адмінка користувачів (users/changelist.py)
+ADMIN_COUNT_ESTIMATE_THRESHOLD = 100000 # Від скількох рядків (за pg_class) показуємо оцінку замість COUNT(*)
+ADMIN_COUNT_LIMIT = 10000 # Кількість результатів пошуку / фільтра рахуємо не далі цього
+
+# Пошук користувачів для підтримки (users/search.py)
+USER_SEARCH_MIN_LENGTH = 3 # Коротші запити не шукаємо
+USER_SEARCH_PAGE_SIZE = 20
+USER_SEARCH_MAX_PAGE_SIZE = 100
+
+# Вивантаження користувачів (users/export.py)
+EXPORT_CHUNK_SIZE = 2000 # Рядків за один fetch з server-side курсора
+EXPORT_BUFFER_SIZE = 64 * 1024 # Байт серіалізованих рядків в одному шматку відповіді
+
+# Метрики (users/metrics.py, /metrics). Кожен процес скидає свої лічильники в METRICS_DIR
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'usersguide-metrics'))
+METRICS_FLUSH_INTERVAL = 5.0 # Секунди між знімками процесу
+METRICS_STALE_AFTER = 6 * METRICS_FLUSH_INTERVAL # Знімок старший за це - від мертвого процесу
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',') # Хто може читати /metrics
+
+# Дебаунс листів (users/debounce.py). Повторний запит на той самий лист тому ж користувачу
+# всередині вікна (секунди) не ставиться в чергу. Таски, яких тут немає, не дебаунсяться
+DEBOUNCE_CACHE_ALIAS = 'default'
+TASK_DEBOUNCE_WINDOWS = {
+    'users.tasks.send_account_activation_email': 60,
+    'users.tasks.send_password_reset_email': 60,
+}
+
+
+# Обмеження частоти запитів (users/ratelimit.py). Правило - (ключ, 'кількість/період'), період s / m / h / d.
+# Кількість - це і розмір відра (скільки запитів можна зробити підряд), і скільки токенів додається за період
+RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', '1') == '1'
+RATELIMIT_BACKEND = 'users.ratelimit.RedisTokenBucket' # users.ratelimit.LocalTokenBucket - в пам'яті процесу
+RATELIMIT_REDIS_URL = os.getenv('RATELIMIT_REDIS_URL', 'redis://localhost:6379/2')
+RATELIMIT_IP_HEADER = os.getenv('RATELIMIT_IP_HEADER') # Напр. HTTP_X_FORWARDED_FOR за проксі
+# Адреси / мережі наших проксі. Заголовок читається тільки якщо REMOTE_ADDR звідси
+RATELIMIT_TRUSTED_PROXIES = [proxy.strip() for proxy in os.getenv('RATELIMIT_TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if proxy.strip()]
+RATELIMIT_LOCAL_MAX_KEYS = 100_000
+RATELIMITS = {
+    'login': [('ip', '30/m'), ('post:username', '5/m')], # В формі логіну email - це поле username
+    'register': [('ip', '10/h')],
+    'password_reset': [('ip', '10/h'), ('post:email', '3/h')],
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -104,6 +183,23 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Хешування паролів рахується в пулі процесів (users/hashers.py), а не в потоці запиту
+PASSWORD_HASHERS = [
+    'users.hashers.PooledPBKDF2PasswordHasher', # Той самий pbkdf2_sha256, тому старі хеші залишаються валідними
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2')) # Процесів на один воркер сервера
+PASSWORD_HASH_MAX_PENDING = 64 # Більше хешів в черзі пулу не кладемо, решта запитів чекає
+
+AUTHENTICATION_BACKENDS = [
+    'users.backends.PooledModelBackend',
+    'django.contrib.auth.backends.ModelBackend', # В старих сесіях (_auth_user_backend) записаний цей шлях, без нього їх розлогінить
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
 
@@ -132,17 +228,65 @@ LOGOUT_REDIRECT_URL = 'users:login'
 
 # Celery settings
 CELERY_BROKER_URL = 'redis://localhost:6379/0' # Redis як брокер
-CELERY_RESULT_BACKEND = 'django-db' # Зберігаємо результати задач в БД
+CELERY_RESULT_BACKEND = 'users.results:CompactResultBackend' # Компактні результати з TTL в БД (users.TaskResult)
+CELERY_TASK_IGNORE_RESULT = True # Листи - fire-and-forget, результат зберігають тільки таски з ignore_result=False
+CELERY_RESULT_EXPIRES = 24 * 60 * 60 # Скільки секунд живе збережений результат
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# Листи розведені по чергах за класом затримки (профілі воркерів - в not.txt):
+# email_fast - скидання пароля і активація, користувач чекає лист прямо зараз
+# email_bulk - вітальні листи і розсилки, можуть почекати
+# celery     - службові таски (outbox диспетчер, планування розсилок)
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_TASK_ROUTES = {
+    'users.tasks.send_password_reset_email': {'queue': 'email_fast'},
+    'users.tasks.send_account_activation_email': {'queue': 'email_fast'},
+    'users.tasks.send_welcome_email': {'queue': 'email_bulk'},
+    'users.tasks.send_prepared_links': {'queue': 'email_bulk'},
+    'users.tasks.send_campaign_chunk': {'queue': 'email_bulk'},
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1 # За замовчуванням не резервуємо таски наперед, bulk воркер перевизначає в CLI
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-email-outbox': {
+        'task': 'users.tasks.dispatch_email_outbox',
+        'schedule': 2.0, # Кожні 2 секунди передаємо листи з outbox в брокер
+    },
+    'clear-expired-sessions': {
+        'task': 'users.tasks.clear_expired_sessions',
+        'schedule': 3600.0, # Раз на годину, пачками (users/sessions.py)
+    },
+}
+
+# Результати celery тасок (users/results.py)
+TASK_RESULT_BATCH_SIZE = 200 # Скільки результатів вставляємо одним INSERT
+TASK_RESULT_FLUSH_INTERVAL = 2.0 # Не тримаємо результат в буфері довше цього (секунди)
+TASK_RESULT_PURGE_CHUNK = 5000 # Рядків за один DELETE при очистці
+
+# Email outbox
+EMAIL_OUTBOX_BATCH_SIZE = 500 # Скільки рядків outbox передаємо в брокер за одну пачку
+EMAIL_OUTBOX_MAX_BATCHES = 20 # Максимум пачок за один запуск диспетчера
+
+# Маркетингові розсилки (users/campaigns.py)
+CAMPAIGN_CHUNK_SIZE = 200 # Листів в одній celery таске (одне SMTP з'єднання)
+CAMPAIGN_PAGE_CHUNKS = 10 # Скільки пачок планується за один прохід по аудиторії
+
+# Анонімізація / видалення акаунтів (users/retention.py)
+RETENTION_CHUNK_SECONDS = 0.5 # Цільова тривалість транзакції однієї пачки, під неї підлаштовується chunk_size
+RETENTION_MIN_CHUNK_SIZE = 50
+RETENTION_MAX_CHUNK_SIZE = 5000
+RETENTION_CHUNK_PAUSE = 1.0 # Секунди між пачками, щоб запити користувачів встигали між ними
+RETENTION_LOCK_TIMEOUT = 2.0 # Секунди. Довше не чекаємо блокування рядка (Postgres), пачку відкладаємо
 
 # Email settings
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+EMAIL_BACKEND = 'users.smtp_pool.PooledSMTPEmailBackend' # Пул залогінених SMTP з'єднань, листи пачки паралельно
+EMAIL_POOL_SIZE = int(os.getenv('EMAIL_POOL_SIZE', '5')) # З'єднань на процес (у провайдерів є ліміт одночасних)
+EMAIL_POOL_IDLE_TIMEOUT = 60 # Секунди. Довше простояне з'єднання перевідкривається (сервер міг його закрити)
+EMAIL_TIMEOUT = 10
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com') # Для навантажувальних тестів - smtp_standin
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', '1') == '1'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
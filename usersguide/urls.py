@@ -3,9 +3,12 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from users.metrics import metrics_view
+
 urlpatterns = [
     path('users/', include('users.urls', namespace='users')),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view), # Prometheus
 ]
 
 if settings.DEBUG: